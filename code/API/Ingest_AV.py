@@ -1,11 +1,12 @@
 # code/API/ingest_av.py
-import os, json, time, random
+import os, json, time, random, asyncio, gzip
 from datetime import datetime, UTC
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, List, Optional
 import requests
-from elasticsearch import helpers
-from utils import es_client, es_healthcheck, ensure_index  # <- vorhanden in API/utils.py
+from utils import es_client, es_healthcheck, ensure_index, BulkWriter, rate_limiter, QuotaExceeded, RunCheckpoint, SnapshotCache, latest_index, latest_action, seed_latest  # <- vorhanden in API/utils.py
+from fetch_engine import FetchEngine
+from prioritize import prioritize
 
 BASE_DIR = Path(__file__).resolve().parent
 DATA_DIR  = BASE_DIR / "data"
@@ -15,9 +16,26 @@ ES_INDEX = os.getenv("ELASTICSEARCH_INDEX", "stocks")
 API_KEY = os.getenv("ALPHAVANTAGE_API_KEY")
 assert API_KEY, "ALPHAVANTAGE_API_KEY fehlt (.env)!"
 
-AV_BASE = "https://www.alphavantage.co/query"
+AV_BASE = os.getenv("AV_BASE_URL", "https://www.alphavantage.co/query")  # z.B. provider_standin.py
+AV_CONCURRENCY = int(os.getenv("AV_CONCURRENCY", "5"))  # gleichzeitige Requests (Quote begrenzt der Limiter)
+
+# Die fünf Endpunkte je Symbol (Schlüssel = Argumentname in metrics_from_reports)
+AV_FUNCTIONS = {
+    "ov": "OVERVIEW",
+    "inc": "INCOME_STATEMENT",
+    "bal": "BALANCE_SHEET",
+    "cfs": "CASH_FLOW",
+    "ern": "EARNINGS",   # reportedEPS je Quartal/Jahr (für EPS-/Earnings-Growth)
+}
+
+# Antwort-Cache: OVERVIEW täglich neu, Statements erst wenn OVERVIEW ein neues LatestQuarter meldet
+AV_CACHE_DIR = Path(os.getenv("AV_CACHE_DIR", str(DATA_DIR / "av_cache")))
+OVERVIEW_TTL = float(os.getenv("AV_OVERVIEW_TTL_HOURS", "20")) * 3600              # < 24h, damit der Tageslauf neu lädt
+STATEMENT_MAX_AGE = float(os.getenv("AV_STATEMENT_MAX_AGE_DAYS", "120")) * 86400    # Sicherheitsnetz
+CACHE_STATS = {"hits": 0, "misses": 0}
 
 es = es_client()
+LIMITER = rate_limiter("alphavantage")  # ALPHAVANTAGE_CALLS_PER_MINUTE / ALPHAVANTAGE_CALLS_PER_DAY
 
 def load_symbols() -> List[str]:
     if CACHE_FILE.exists():
@@ -25,8 +43,11 @@ def load_symbols() -> List[str]:
     # kleine Fallback-Liste
     return ["AAPL","MSFT","AMZN","GOOGL","META","NVDA","TSLA","JPM","PG","PFE","BAC","XOM","CVX","INTC","T","UNH","DIS"]
 
-def av_get(params: Dict) -> Dict:
+def av_get(params: Dict, limit: bool = True) -> Dict:
+    """limit=False: der Aufrufer (FetchEngine) hat das Rate-Limit-Token bereits geholt."""
     params = {**params, "apikey": API_KEY}
+    if limit:
+        LIMITER.acquire()
     r = requests.get(AV_BASE, params=params, timeout=30)
     r.raise_for_status()
     data = r.json()
@@ -35,21 +56,57 @@ def av_get(params: Dict) -> Dict:
         raise RuntimeError(data.get("Note") or data.get("Information"))
     return data
 
-def fetch_overview(symbol: str) -> Dict:
-    return av_get({"function": "OVERVIEW", "symbol": symbol})
-
-def fetch_income(symbol: str) -> Dict:
-    return av_get({"function": "INCOME_STATEMENT", "symbol": symbol})
-
-def fetch_balance(symbol: str) -> Dict:
-    return av_get({"function": "BALANCE_SHEET", "symbol": symbol})
-
-def fetch_cashflow(symbol: str) -> Dict:
-    return av_get({"function": "CASH_FLOW", "symbol": symbol})
+# === Antwort-Cache (gzip, je Funktion & Symbol) ===
+def _cache_path(function: str, symbol: str) -> Path:
+    return AV_CACHE_DIR / function / f"{symbol}.json.gz"
 
-def fetch_earnings(symbol: str) -> Dict:
-    # reportedEPS je Quartal/Jahr (für EPS-/Earnings-Growth)
-    return av_get({"function": "EARNINGS", "symbol": symbol})
+def cache_load(function: str, symbol: str) -> Optional[Dict]:
+    p = _cache_path(function, symbol)
+    if not p.exists():
+        return None
+    try:
+        with gzip.open(p, "rt", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return None  # defekter Eintrag → wie nicht vorhanden
+
+def cache_store(function: str, symbol: str, data: Dict, quarter: str):
+    """Speichert nur brauchbare Antworten (nicht leer, keine Fehlermeldung); atomar per tmp + replace."""
+    if not data or "Error Message" in data:
+        return
+    p = _cache_path(function, symbol)
+    p.parent.mkdir(parents=True, exist_ok=True)
+    tmp = p.with_suffix(".tmp")
+    entry = {"fetched_at": time.time(), "quarter": quarter, "data": data}
+    with gzip.open(tmp, "wt", encoding="utf-8") as f:
+        json.dump(entry, f)
+    tmp.replace(p)
+
+def cache_fresh(function: str, entry: Optional[Dict], quarter: str = "") -> bool:
+    if not entry:
+        return False
+    age = time.time() - entry.get("fetched_at", 0)
+    if function == "OVERVIEW":
+        return age < OVERVIEW_TTL
+    # Statements/Earnings ändern sich nur mit einem neuen Quartal
+    return age < STATEMENT_MAX_AGE and entry.get("quarter") == quarter
+
+def cached_data(function: str, symbol: str, quarter: str = "") -> Optional[Dict]:
+    """Gültige Daten aus dem Cache oder None (dann muss abgerufen werden)."""
+    entry = cache_load(function, symbol)
+    if cache_fresh(function, entry, quarter):
+        CACHE_STATS["hits"] += 1
+        return entry["data"]
+    CACHE_STATS["misses"] += 1
+    return None
+
+def av_fetch(function: str, symbol: str, quarter: str = "", limit: bool = True) -> Dict:
+    """Ruft einen Endpunkt ab und legt die Antwort im Cache ab (quarter = LatestQuarter aus OVERVIEW)."""
+    data = av_get({"function": function, "symbol": symbol}, limit)
+    if function == "OVERVIEW":
+        quarter = data.get("LatestQuarter") or ""
+    cache_store(function, symbol, data, quarter)
+    return data
 
 # === Helper 
 def _f(x):
@@ -61,12 +118,50 @@ def _f(x):
         return None
 
 def build_metrics(symbol: str) -> Dict:
-    ov  = fetch_overview(symbol)
-    inc = fetch_income(symbol)
-    bal = fetch_balance(symbol)
-    cfs = fetch_cashflow(symbol)
-    ern = fetch_earnings(symbol)
-
+    """Sequentiell: OVERVIEW, dann nur die Statements, deren Quartal sich geändert hat."""
+    ov = cached_data("OVERVIEW", symbol)
+    if ov is None:
+        ov = av_fetch("OVERVIEW", symbol)
+    quarter = ov.get("LatestQuarter") or ""
+    reports = {"ov": ov}
+    for key, function in AV_FUNCTIONS.items():
+        if key == "ov":
+            continue
+        data = cached_data(function, symbol, quarter)
+        reports[key] = data if data is not None else av_fetch(function, symbol, quarter)
+    return metrics_from_reports(**reports)
+
+async def fetch_reports(engine: FetchEngine, symbol: str) -> Dict[str, Dict]:
+    """
+    Endpunkte eines Symbols über die FetchEngine: zuerst OVERVIEW (täglich), dann die
+    fehlenden Statements gleichzeitig. Gecachte Antworten kosten kein Kontingent.
+    """
+    ov = cached_data("OVERVIEW", symbol)
+    if ov is None:
+        ov = await engine.call(av_fetch, "OVERVIEW", symbol, "", False)
+    quarter = ov.get("LatestQuarter") or ""
+
+    reports, missing = {"ov": ov}, []
+    for key, function in AV_FUNCTIONS.items():
+        if key == "ov":
+            continue
+        reports[key] = cached_data(function, symbol, quarter)
+        if reports[key] is None:
+            missing.append(key)
+    results = await asyncio.gather(
+        *(engine.call(av_fetch, AV_FUNCTIONS[k], symbol, quarter, False) for k in missing),
+        return_exceptions=True,
+    )
+    for res in results:
+        if isinstance(res, BaseException):
+            raise res
+    reports.update(zip(missing, results))
+    return reports
+
+async def _metrics_job(engine: FetchEngine, symbol: str) -> Dict:
+    return metrics_from_reports(**await fetch_reports(engine, symbol))
+
+def metrics_from_reports(ov: Dict, inc: Dict, bal: Dict, cfs: Dict, ern: Dict) -> Dict:
     # ---- OVERVIEW (aktuell) -> direkte Mappings auf YF-Namen ----
     marketCap     = _f(ov.get("MarketCapitalization"))
     peRatio       = _f(ov.get("PERatio"))
@@ -248,3 +343,74 @@ def build_metrics(symbol: str) -> Dict:
 
     # Nur nicht-None Felder zurückgeben
     return {k: v for k, v in metrics.items() if v is not None}
+
+# === Dokument & Pipeline ===
+def build_doc(symbol: str, metrics: Dict) -> Dict:
+    today = str(datetime.now(UTC).date())
+    return {
+        "_index": ES_INDEX,
+        "_id": f"{symbol}|{today}|alphavantage",
+        "_source": {
+            "symbol": symbol,
+            "date": today,
+            "source": "alphavantage",
+            "ingested_at": datetime.now(UTC).isoformat(),
+            **metrics
+        },
+    }
+
+def run():
+    print(es_healthcheck(es))
+    ensure_index(es, ES_INDEX)
+    ensure_index(es, latest_index(ES_INDEX))
+    seed_latest(es, ES_INDEX)
+
+    symbols = load_symbols()
+    symbols = prioritize(es, symbols, ES_INDEX, source="alphavantage")  # alt/unvollständig/Earnings zuerst
+
+    # Checkpoint: nach einem Neustart am selben Tag dort weitermachen, wo der Lauf stand
+    ckpt = RunCheckpoint("alphavantage", symbols)
+    symbols = ckpt.pending()
+    print(f"Starte Alpha-Vantage-Ingestion für {len(symbols)} Symbole...")
+
+    # unveränderte Kennzahlen nur bestätigen statt als neues Tagesdokument schreiben
+    snaps = SnapshotCache("alphavantage", es)
+
+    def on_batch(actions, errors):
+        ckpt.ack(actions, errors)
+        snaps.ack(actions, errors)
+
+    # Schreiben läuft im Hintergrund – der Abruf wartet nicht auf ES
+    writer = BulkWriter(es, batch_docs=25, label="alphavantage", on_batch=on_batch)
+    writer.write(ckpt.buffered_actions())  # vor dem Neustart abgerufen, aber nicht bestätigt
+
+    # Symbole nebenläufig abrufen; je Symbol laufen die fünf Endpunkte parallel
+    engine = FetchEngine("alphavantage", concurrency=AV_CONCURRENCY, limiter=LIMITER)
+    try:
+        for symbol, metrics, err in engine.run(_metrics_job, symbols):
+            if isinstance(err, QuotaExceeded):
+                print(f"⛔ {err} – breche ab, bisher Geladenes wird gespeichert.")
+                break
+            if err is not None:
+                print(f"[FEHLER] {symbol}: {err}")  # bleibt offen → nächster Start versucht es erneut
+                continue
+            if metrics:
+                doc = build_doc(symbol, metrics)
+                # Historie (nur bei Änderung bzw. fälliger Bestätigung) + aktueller Stand in <ES_INDEX>_latest
+                for action in filter(None, (snaps.dedupe(doc), latest_action(doc))):
+                    ckpt.hold(symbol, action)
+                    writer.add(action)
+            else:
+                ckpt.done(symbol)
+    finally:
+        writer.close()
+        snaps.save()
+        ckpt.finish()
+    print(f"🗄️  AV-Cache: {CACHE_STATS['hits']} Treffer, {CACHE_STATS['misses']} Abrufe nötig "
+          f"({engine.stats['calls']} Requests).")
+    hist, latest = writer.index_summary(ES_INDEX), writer.index_summary(latest_index(ES_INDEX))
+    print(f"✅ Fertig. Gesamt gespeichert: {hist['ok']} Dokumente in '{ES_INDEX}' ({hist['failed']} nicht geschrieben); "
+          f"aktueller Stand: {latest['ok']} in '{latest_index(ES_INDEX)}' ({latest['failed']} nicht geschrieben).")
+
+if __name__ == "__main__":
+    run()
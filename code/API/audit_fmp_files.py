@@ -1,5 +1,7 @@
 import json
+import argparse
 from pathlib import Path
+import json_io
 
 # === Pfade & Config ===
 BASE_DIR = Path(__file__).resolve().parent              # .../code/API
@@ -9,30 +11,29 @@ FILES = ["Profile", "IncomeStatement", "BalanceSheet", "CashflowStatement", "Key
 
 def _read_json(p: Path):
     """Liest JSON oder gibt [] bei leer/ungültig zurück"""
-    if not p.exists():
-        return []
-    try:
-        txt = p.read_text(encoding="utf-8", errors="ignore").strip()
-        if not txt:
-            return []
-        return json.loads(txt)
-    except Exception:
-        return []
-
-def audit_fmp_folder(folder: Path):
-    if not folder.exists():
-        raise FileNotFoundError(f"❌ FMP-Ordner nicht gefunden: {folder}")
-
-    symbols = sorted({f.name.split("_")[0] for f in folder.glob("*_*.json")})
-    print(f"🔍 Prüfe {len(symbols)} Symbole in: {folder}")
+    return json_io.load_strict(p)
+
+def audit_fmp_folder(folder: Path, store=None):
+    """store: FmpStore (fmp_store.py) — dann werden keine Einzeldateien geöffnet."""
+    if store is not None:
+        symbols = store.symbols()
+        print(f"🔍 Prüfe {len(symbols)} Symbole im FMP-Store: {store.store_dir}")
+    else:
+        if not folder.exists():
+            raise FileNotFoundError(f"❌ FMP-Ordner nicht gefunden: {folder}")
+        symbols = sorted({f.name.split("_")[0] for f in folder.glob("*_*.json")})
+        print(f"🔍 Prüfe {len(symbols)} Symbole in: {folder}")
 
     report = []
     for sym in symbols:
         status = {}
+        files = store.file_status(sym) if store is not None else None
         for name in FILES:
-            p = folder / f"{sym}_{name}.json"
-            js = _read_json(p)
-            status[name] = "OK" if js else "EMPTY"
+            if files is not None:
+                ok = bool(files.get(name, {}).get("audit_ok"))
+            else:
+                ok = bool(_read_json(folder / f"{sym}_{name}.json"))
+            status[name] = "OK" if ok else "EMPTY"
 
         empty_count = list(status.values()).count("EMPTY")
         completeness = "✅ Vollständig" if empty_count == 0 else "⚠️ Unvollständig"
@@ -56,4 +57,12 @@ def audit_fmp_folder(folder: Path):
     print(f"💾 Bericht gespeichert unter: {out_path}")
 
 if __name__ == "__main__":
-    audit_fmp_folder(FMP_DIR)
+    parser = argparse.ArgumentParser(description="Vollständigkeit der lokalen FMP-Dateien prüfen.")
+    parser.add_argument("--store", action="store_true",
+                        help="aus dem Parquet-Store (fmp_store.py) statt aus den Einzeldateien lesen")
+    args = parser.parse_args()
+    if args.store:
+        from fmp_store import FmpStore, STORE_DIR  # pyarrow nur im Store-Modus nötig
+        audit_fmp_folder(FMP_DIR, FmpStore(STORE_DIR))
+    else:
+        audit_fmp_folder(FMP_DIR)
@@ -0,0 +1,172 @@
+# code/API/fetch_engine.py
+"""
+Nebenläufiger Abruf für die Live-Ingestoren (asyncio).
+
+- begrenzte Parallelität (Semaphore) für die HTTP-Aufrufe
+- Rate-Limit je Provider (Token-Bucket aus utils, asynchron abgewartet)
+- Retry mit exponentiellem Backoff für vorübergehende Fehler (Netz, 429, 5xx)
+- sauberes Beenden: bricht der Aufrufer ab (break, Strg+C, QuotaExceeded),
+  werden offene Tasks abgebrochen und laufende Requests zu Ende gewartet
+
+Die eigentlichen Requests bleiben blockierend (requests) und laufen per
+asyncio.to_thread; die Ingestoren konsumieren die Ergebnisse weiterhin synchron:
+
+    engine = FetchEngine("fmp", concurrency=4)
+    for batch, quotes, err in engine.map(fetch_batch, batches):
+        ...
+"""
+import asyncio
+import queue
+import random
+import threading
+from typing import Any, Awaitable, Callable, Iterable, Iterator, Optional, Tuple
+
+import requests
+
+from utils import RateLimiter, QuotaExceeded, rate_limiter, log
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+_DONE = object()
+
+
+def is_transient(exc: BaseException) -> bool:
+    """Netzwerkfehler, Timeouts sowie HTTP 429/5xx lohnen einen neuen Versuch."""
+    if isinstance(exc, QuotaExceeded):
+        return False
+    if isinstance(exc, requests.HTTPError):
+        return exc.response is not None and exc.response.status_code in RETRY_STATUS
+    return isinstance(exc, (requests.ConnectionError, requests.Timeout, TimeoutError, ConnectionError))
+
+
+class FetchEngine:
+    """
+    provider:    Name für rate_limiter() (fmp, alphavantage, ...); limiter überschreibt das
+    concurrency: max. gleichzeitige Requests
+    retries:     weitere Versuche je Aufruf bei vorübergehenden Fehlern
+    """
+
+    def __init__(
+        self,
+        provider: str,
+        concurrency: int = 4,
+        retries: int = 3,
+        backoff: float = 1.0,
+        max_backoff: float = 30.0,
+        limiter: Optional[RateLimiter] = None,
+        retry_if: Callable[[BaseException], bool] = is_transient,
+    ):
+        self.provider = provider
+        self.concurrency = max(1, concurrency)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.limiter = limiter or rate_limiter(provider)
+        self.retry_if = retry_if
+        self.stats = {"calls": 0, "retries": 0, "errors": 0}
+        self._sem: Optional[asyncio.Semaphore] = None
+
+    # --- innerhalb des Event-Loops ---
+    async def acquire(self):
+        """Wartet asynchron auf das nächste Token des Providers (QuotaExceeded wird durchgereicht)."""
+        while True:
+            delay = self.limiter.reserve()
+            if delay <= 0:
+                return
+            await asyncio.sleep(delay)
+
+    async def call(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Ein blockierender Aufruf mit Parallelitätsgrenze, Rate-Limit und Retry."""
+        attempt = 0
+        while True:
+            async with self._sem:
+                await self.acquire()
+                self.stats["calls"] += 1
+                try:
+                    return await asyncio.to_thread(fn, *args, **kwargs)
+                except Exception as e:
+                    if attempt >= self.retries or not self.retry_if(e):
+                        self.stats["errors"] += 1
+                        raise
+                    err = e
+            attempt += 1
+            self.stats["retries"] += 1
+            delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+            delay += random.uniform(0, delay / 4)
+            log(f"[{self.provider}] ↻ Versuch {attempt + 1}/{self.retries + 1} in {delay:.1f}s: {err}")
+            await asyncio.sleep(delay)
+
+    async def _drive(self, job, items: Iterable[Any], out: "queue.Queue", ready: threading.Event, ctl: dict):
+        ctl["loop"], ctl["task"] = asyncio.get_running_loop(), asyncio.current_task()
+        ready.set()
+        self._sem = asyncio.Semaphore(self.concurrency)
+        window = asyncio.Semaphore(self.concurrency * 2)  # begrenzt die Items im Umlauf
+        tasks = set()
+
+        async def one(item):
+            try:
+                out.put((item, await job(self, item), None))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                out.put((item, None, e))
+            finally:
+                window.release()
+
+        try:
+            for item in items:
+                await window.acquire()
+                t = asyncio.create_task(one(item))
+                tasks.add(t)
+                t.add_done_callback(tasks.discard)
+            while tasks:
+                await asyncio.gather(*list(tasks))
+        except asyncio.CancelledError:  # Aufrufer hat abgebrochen
+            pass
+        except Exception as e:  # z.B. Fehler im Item-Iterator → beim Aufrufer erneut auslösen
+            ctl["error"] = e
+        finally:
+            for t in list(tasks):
+                t.cancel()
+            await asyncio.gather(*list(tasks), return_exceptions=True)
+            out.put(_DONE)
+
+    # --- synchrone Schnittstelle ---
+    def run(self, job: Callable[["FetchEngine", Any], Awaitable[Any]], items: Iterable[Any]) -> Iterator[Tuple[Any, Any, Optional[Exception]]]:
+        """
+        Führt job(engine, item) für alle Items nebenläufig aus und liefert
+        (item, Ergebnis, Fehler) in Fertigstellungsreihenfolge.
+        Wird der Generator vorzeitig geschlossen, werden offene Tasks abgebrochen.
+        """
+        out: "queue.Queue" = queue.Queue()
+        ready, ctl = threading.Event(), {}
+        thread = threading.Thread(
+            target=lambda: asyncio.run(self._drive(job, items, out, ready, ctl)),
+            name=f"fetch-{self.provider}", daemon=True,
+        )
+        thread.start()
+        finished = False
+        try:
+            while True:
+                msg = out.get()
+                if msg is _DONE:
+                    finished = True
+                    break
+                yield msg
+        finally:
+            if not finished:
+                ready.wait()
+                try:
+                    ctl["loop"].call_soon_threadsafe(ctl["task"].cancel)
+                except RuntimeError:  # Loop schon beendet
+                    pass
+            thread.join()
+            log(f"[{self.provider}] Abruf beendet: {self.stats['calls']} Requests, "
+                f"{self.stats['retries']} Wiederholungen, {self.stats['errors']} Fehler")
+        if "error" in ctl:
+            raise ctl["error"]
+
+    def map(self, fn: Callable[[Any], Any], items: Iterable[Any]) -> Iterator[Tuple[Any, Any, Optional[Exception]]]:
+        """Wie run(), für eine einfache blockierende Funktion fn(item)."""
+        async def job(engine, item):
+            return await engine.call(fn, item)
+        return self.run(job, items)
@@ -0,0 +1,317 @@
+# code/API/fmp_derive.py
+"""
+Spaltenweise Ableitung der historischen FMP-Kennzahlen.
+
+Statt jedes Dokument einzeln durch _f() zu schicken, werden alle zusammengeführten
+Zeilen (beliebig viele Symbole × Daten) als Tabelle betrachtet: je Feld ein
+NumPy-Array, darauf Normalisierung, Mapping der FMP-Rohfelder, PEG und die
+Turnaround-Kennzahlen (totalDebt, freeCashflow, cashToDebt, equityRatio, fcfMargin).
+
+Die Regeln sind dieselben wie bisher pro Dokument:
+- Werte werden wie _f() gelesen; None, NaN und ±inf gelten als "nicht vorhanden"
+- `a or b` bleibt `a or b` (0 fällt auf das nächste Feld zurück)
+- Division nur bei Nenner != 0, vorhandene Werte werden nie überschrieben
+- Schlüsselreihenfolge und missing_fields der Dokumente bleiben unverändert
+"""
+import math
+from itertools import repeat
+from operator import is_not
+from typing import Any, Dict, List, NamedTuple
+
+import numpy as np
+
+# numerische Felder, die in den Dokumenten als float (oder None) stehen
+NUM_KEYS = [
+    "marketCap","peRatio","priceToBook","dividendYield","payoutRatio",
+    "revenueGrowth","earningsGrowth","epsGrowth","profitMargin","fcfMargin",
+    "currentRatio","quickRatio","debtToAssets","freeCashFlow","freeCashflow",
+    "freeCashFlowPerShare","cashPerShare","bookValuePerShare","totalDebt",
+    "totalAssets","revenue","eps","beta","pegRatio","debtToEquity",
+    "cashToDebt","equityRatio",
+    # rohe FMP-Ratio-Felder, die wir später mappen
+    "priceEarningsRatioTTM","priceEarningsRatio",
+    "priceToBookRatio","pbRatio",
+    "dividendYieldTTM",
+    "priceEarningsToGrowthRatio","priceEarningsToGrowthRatioTTM",
+    "debtToEquityTTM","debtEquityRatio",
+    "currentRatioTTM","quickRatioTTM",
+]
+
+# Zielfeld ← Kandidaten (erster Treffer gewinnt), Reihenfolge = Reihenfolge der Zuweisung
+ALIASES = [
+    ("peRatio",       ("priceEarningsRatioTTM", "priceEarningsRatio")),
+    ("priceToBook",   ("priceToBookRatio", "pbRatio")),
+    ("dividendYield", ("dividendYieldTTM", "dividendYield")),
+    ("payoutRatio",   ("payoutRatioTTM", "payoutRatio")),
+    ("debtToEquity",  ("debtToEquityTTM", "debtEquityRatio")),
+    ("currentRatio",  ("currentRatioTTM", "currentRatio")),
+    ("quickRatio",    ("quickRatioTTM", "quickRatio")),
+    ("pegRatio",      ("pegRatioTTM", "pegRatio", "priceEarningsToGrowthRatioTTM", "priceEarningsToGrowthRatio")),
+]
+# Reihenfolge, in der neue Schlüssel an ein Dokument angehängt werden
+ASSIGN_ORDER = [k for k, _ in ALIASES] + [
+    "totalDebt", "freeCashflow", "freeCashFlow", "cashToDebt", "equityRatio", "fcfMargin",
+]
+MISSING_REQUIRED = ["peRatio", "revenueGrowth", "earningsGrowth", "dividendYield", "payoutRatio", "marketCap"]
+
+_NUM_SET = set(NUM_KEYS)
+_PLAIN_TYPES = {int, float, bool, type(None)}
+_FLOAT_TYPES = {float, type(None)}
+
+
+class Col(NamedTuple):
+    """Eine Tabellenspalte: Wert wie _f() plus Masken für die Python-Semantik der Einzelschritte."""
+    x: np.ndarray       # float64; NaN, wo _f() None liefert
+    ok: np.ndarray      # _f(v) is not None
+    num: np.ndarray     # isinstance(v, (int, float)) auf dem Rohwert
+    truthy: np.ndarray  # bool(v) auf dem Rohwert — für `a or b`
+
+
+def _f(x):
+    try:
+        if x is None: return None
+        if isinstance(x, (int, float)):
+            if isinstance(x, float) and (math.isnan(x) or math.isinf(x)):
+                return None
+            return float(x)
+        return float(str(x).replace(",", ""))
+    except Exception:
+        return None
+
+
+def column(values: List[Any]) -> Col:
+    """
+    Rohwerte einer Spalte → Col. Zahlen/None laufen ohne Python-Schleife über NumPy,
+    nur abweichende Werte (Strings, Listen, ...) gehen einzeln durch _f().
+    """
+    n = len(values)
+    odd = []
+    if not set(map(type, values)) <= _PLAIN_TYPES:
+        odd = [i for i, v in enumerate(values) if type(v) not in _PLAIN_TYPES]
+    plain = values
+    if odd:
+        plain = list(values)
+        for i in odd:
+            plain[i] = None
+    try:
+        x = np.array(plain, dtype=float)  # None → NaN, bool → 0/1
+    except OverflowError:                 # riesige Ganzzahlen → alles einzeln
+        odd, x = list(range(n)), np.full(n, np.nan)
+
+    nan = np.isnan(x)
+    if plain.count(None) == int(nan.sum()):
+        num = ~nan                        # keine NaN-Rohwerte, nur None
+    else:
+        num = np.fromiter((v is not None for v in plain), bool, n)
+    truthy = num & (x != 0)               # NaN ist truthy, wie in Python
+    ok = num & np.isfinite(x)
+
+    for i in odd:
+        v = values[i]
+        f = _f(v)
+        x[i] = np.nan if f is None else f
+        ok[i] = f is not None
+        num[i] = isinstance(v, (int, float))
+        truthy[i] = bool(v)
+    return Col(x, ok, num, truthy)
+
+
+def _value(x: np.ndarray, ok: np.ndarray) -> Col:
+    """Col für einen bereits normalisierten Wert (float oder None)."""
+    return Col(x, ok, ok, ok & (x != 0))
+
+
+def _first(*cols: Col) -> Col:
+    """_f(a or b or c) spaltenweise: erster truthy Wert, sonst der letzte."""
+    x, ok = cols[-1].x, cols[-1].ok
+    for c in reversed(cols[:-1]):
+        x, ok = np.where(c.truthy, c.x, x), np.where(c.truthy, c.ok, ok)
+    return _value(x, ok)
+
+
+def _refloat(c: Col) -> Col:
+    """_f() auf einen schon normalisierten Wert: NaN/inf (aus Strings wie "nan") werden None."""
+    return Col(c.x, c.ok & np.isfinite(c.x), c.num, c.truthy)
+
+
+def _or_zero(c: Col) -> np.ndarray:
+    """`_f(v) or 0.0` (auch -0.0 → 0.0)."""
+    return np.where(c.ok & (c.x != 0), c.x, 0.0)
+
+
+# ===================== Ableitung auf der Tabelle =====================
+def derive_table(table: Dict[str, Col], n: int):
+    """
+    Berechnet alle abgeleiteten Kennzahlen spaltenweise.
+    table: Feldname → Col der Rohwerte (fehlende Felder gelten als None)
+    Rückgabe: (values, assigned)
+      values:   Feld → Endwert nach der letzten Normalisierung (NaN = None), für NUM_KEYS
+      assigned: Feld → Maske der Zeilen, in denen das Feld neu gesetzt wurde
+    """
+    no = np.zeros(n, bool)
+    empty = Col(np.full(n, np.nan), no, no, no)
+    raw = lambda k: table.get(k, empty)
+
+    # 1) Normalisierung der numerischen Felder
+    val = {k: _value(raw(k).x, raw(k).ok) for k in NUM_KEYS}
+    assigned: Dict[str, np.ndarray] = {}
+
+    def assign(target: str, mask: np.ndarray, x: np.ndarray, ok: np.ndarray = None):
+        cur = val[target]
+        ok = mask if ok is None else ok
+        val[target] = _value(np.where(mask, x, cur.x), np.where(mask, ok, cur.ok))
+        assigned[target] = assigned.get(target, no) | mask
+
+    # 2) FMP-Rohfelder auf die Lynch-Felder mappen (nur wo noch None)
+    for target, cands in ALIASES:
+        need = ~val[target].ok
+        hit = np.zeros(n, bool)
+        out = np.full(n, np.nan)
+        for k in cands:
+            c = val[k] if k in _NUM_SET else raw(k)
+            take = need & ~hit & c.num
+            out = np.where(take, c.x, out)
+            hit |= take
+        assign(target, hit, out)
+
+    # 3) PEG selbst berechnen: pe = peRatio or trailingPE, nur bei earningsGrowth > 0
+    pe_ratio, tpe = val["peRatio"], raw("trailingPE")
+    pe = np.where(pe_ratio.truthy, pe_ratio.x, tpe.x)
+    pe_num = pe_ratio.truthy | tpe.num
+    eg = val["earningsGrowth"]
+    peg_mask = ~val["pegRatio"].ok & pe_num & eg.ok & (eg.x > 0)
+    assign("pegRatio", peg_mask, pe / (eg.x * 100.0))
+
+    # 4) Turnaround-Kennzahlen
+    revenue = _first(_refloat(val["revenue"]), raw("totalRevenue"))
+    total_assets = _first(_refloat(val["totalAssets"]))
+    equity = _first(raw("totalStockholdersEquity"), raw("totalStockholderEquity"))
+
+    cash_eq, sti = raw("cashAndCashEquivalents"), raw("shortTermInvestments")
+    total_cash = _value(_or_zero(cash_eq) + _or_zero(sti), cash_eq.ok | sti.ok)
+
+    long_debt, short_debt, sld_total = raw("longTermDebt"), raw("shortTermDebt"), raw("shortLongTermDebtTotal")
+    has_ls = long_debt.ok | short_debt.ok
+    total_debt = _value(np.where(has_ls, _or_zero(long_debt) + _or_zero(short_debt), sld_total.x),
+                        has_ls | sld_total.ok)
+
+    assign("totalDebt", ~val["totalDebt"].ok & total_debt.ok, total_debt.x)
+
+    ocf = _first(raw("netCashProvidedByOperatingActivities"), raw("operatingCashFlow"), raw("operatingCashflow"))
+    capex = _first(raw("capitalExpenditure"), raw("capitalExpenditures"))
+    fcf = _value(ocf.x - capex.x, ocf.ok & capex.ok)
+
+    m = ~val["freeCashflow"].ok & fcf.ok
+    assign("freeCashflow", m, fcf.x)
+    assign("freeCashFlow", m, fcf.x)  # Alias wie im Heute-Dokument
+
+    for target, num, den in (("cashToDebt", total_cash, total_debt),
+                             ("equityRatio", equity, total_assets),
+                             ("fcfMargin", fcf, revenue)):
+        m = ~val[target].ok & num.ok & den.truthy
+        assign(target, m, num.x / np.where(m, den.x, 1.0))
+
+    # 5) letzte Normalisierung: None und nicht endliche Werte werden None
+    final = {}
+    for k in NUM_KEYS:
+        c = val[k]
+        final[k] = np.where(c.ok & np.isfinite(c.x), c.x, np.nan)
+    return final, assigned
+
+
+def _as_list(x: np.ndarray) -> List[Any]:
+    """float64-Array → Python-Liste mit None statt NaN."""
+    out = x.astype(object)
+    out[np.isnan(x)] = None
+    return out.tolist()
+
+
+# ===================== Dokumente =====================
+_TABLE_KEYS = sorted(_NUM_SET | {k for _, cands in ALIASES for k in cands} | {
+    "trailingPE", "totalRevenue", "totalStockholdersEquity", "totalStockholderEquity",
+    "cashAndCashEquivalents", "shortTermInvestments", "longTermDebt", "shortTermDebt",
+    "shortLongTermDebtTotal", "netCashProvidedByOperatingActivities", "operatingCashFlow",
+    "operatingCashflow", "capitalExpenditure", "capitalExpenditures",
+})
+_MISSING = object()
+_ABSENT = [_MISSING] * len(_TABLE_KEYS)
+
+
+def derive_docs(docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Reichert zusammengeführte historische Dokumente (beliebig viele Symbole/Daten)
+    in einem Durchgang an: Normalisierung, Mapping, PEG, Turnaround-Kennzahlen und
+    missing_fields. Die Dokumente werden in-place geändert und zurückgegeben.
+    """
+    n = len(docs)
+    if not n:
+        return docs
+    table = {}
+    present = {}    # Feld → Maske der Dokumente, die das Feld schon enthalten
+    unchanged = set()  # Felder, deren Werte die Normalisierung nicht verändert
+    # zeilenweise lesen (map/zip laufen in C), dann spaltenweise weiter
+    rows = [list(map(d.get, _TABLE_KEYS, _ABSENT)) for d in docs]
+    for k, values in zip(_TABLE_KEYS, zip(*rows)):
+        absent = values.count(_MISSING)
+        if absent == n:
+            continue
+        if absent:
+            has = np.fromiter(map(is_not, values, repeat(_MISSING)), bool, n)
+            values = [None if v is _MISSING else v for v in values]
+        else:
+            has = None  # in allen Dokumenten vorhanden
+            values = list(values)
+        col = table[k] = column(values)
+        if k in _NUM_SET:
+            present[k] = has
+            if set(map(type, values)) <= _FLOAT_TYPES and np.array_equal(col.ok, col.num):
+                unchanged.add(k)
+
+    with np.errstate(all="ignore"):  # NaN/inf werden wie bei _f() zu None
+        val, assigned = derive_table(table, n)
+
+    # zurückschreiben: vorhandene Felder behalten ihre Position, neue werden in der
+    # Reihenfolge der bisherigen Einzelschritte angehängt
+    everywhere = [k for k in NUM_KEYS if k in present and k not in unchanged and present[k] is None]
+    if everywhere:
+        for d, row in zip(docs, zip(*[_as_list(val[k]) for k in everywhere])):
+            d.update(zip(everywhere, row))
+    for k in NUM_KEYS:
+        if k not in present or k in unchanged or present[k] is None:
+            continue
+        vals = _as_list(val[k])
+        for i in np.flatnonzero(present[k]).tolist():
+            docs[i][k] = vals[i]
+    for k in ASSIGN_ORDER:
+        idx = np.flatnonzero(assigned.get(k, ())).tolist()
+        if idx:
+            vals = _as_list(val[k])
+            for i in idx:
+                docs[i][k] = vals[i]
+
+    # missing_fields: je Kombination fehlender Pflichtfelder eine Vorlage
+    missing = np.stack([np.isnan(val[k]) for k in MISSING_REQUIRED], axis=1)
+    codes = missing @ (1 << np.arange(len(MISSING_REQUIRED)))
+    patterns = {c: [k for j, k in enumerate(MISSING_REQUIRED) if c >> j & 1] for c in np.unique(codes).tolist()}
+    for i, c in zip(np.flatnonzero(codes).tolist(), codes[codes != 0].tolist()):
+        docs[i]["missing_fields"] = list(patterns[c])
+    return docs
+
+
+def derive_frame(df):
+    """
+    Tabellen-Variante für Auswertungen über das ganze Universum: DataFrame mit den
+    Rohfeldern (eine Zeile je Symbol/Datum) → DataFrame mit den abgeleiteten
+    NUM_KEYS (NaN = None). Fehlende Spalten gelten als None.
+    """
+    import pandas as pd
+    n = len(df)
+    table = {k: column(df[k].tolist()) for k in _TABLE_KEYS if k in df.columns}
+    with np.errstate(all="ignore"):
+        val, _ = derive_table(table, n)
+    return pd.DataFrame(val, index=df.index)
+
+
+def derive_doc(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Einzelnes Dokument — dünner Wrapper um derive_docs."""
+    return derive_docs([doc])[0]
@@ -0,0 +1,301 @@
+# code/API/fmp_store.py
+"""
+Spaltenbasierter Zwischenspeicher für die lokalen FMP-Dateien.
+
+Statt ~8.000 kleiner JSON-Dateien (6 Dateitypen × Symbol) liegt je Dateityp eine
+Parquet-Datei vor, dazu eine Übersicht files.parquet mit Signatur und Inhalts-Flags je
+Quelldatei. Jedes Feld der Abschlusszeilen ist eine eigene typisierte Spalte (Typ = häufigster
+Typ des Feldes); abweichende Werte, verschachtelte Daten und fehlende Schlüssel stehen als JSON
+in _extra/_missing, so dass jede Zeile exakt wiederhergestellt wird. Je BLOCK_SYMBOLS Symbole
+(sortiert) eine Row-Group: gefiltert nach _symbol liest ein Leser nur die Blöcke seiner Symbole.
+
+Aufbau:  python fmp_store.py            (liest FMP_DIR, schreibt FMP_STORE)
+Nutzung: python ingest_fmp_sp.py --store / python audit_fmp_files.py --store
+"""
+import os, json, hashlib, argparse, time
+from datetime import datetime, UTC
+from pathlib import Path
+from typing import Dict, List, Any, Tuple
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import json_io
+
+# === Pfade & Config ===
+BASE_DIR    = Path(__file__).resolve().parent          # .../code/API
+PROJECTROOT = BASE_DIR.parents[1]                      # .../ (Projektwurzel)
+FMP_DIR     = PROJECTROOT / "data" / "sp_data" / "total_sp_data"  # Ordner mit den FMP-Dateien
+STORE_DIR   = Path(os.getenv("FMP_STORE", str(FMP_DIR.parent / "fmp_store")))
+FILES       = ["Profile", "IncomeStatement", "BalanceSheet", "CashflowStatement", "KeyMetrics", "Ratios"]
+
+# Form des geparsten Inhalts, damit list/dict/Skalar exakt wiederhergestellt werden
+SHAPE_NONE, SHAPE_LIST, SHAPE_DICT, SHAPE_VALUE = "none", "list", "dict", "value"
+
+BLOCK_SYMBOLS = int(os.getenv("FMP_STORE_BLOCK", "16"))  # Symbole je Row-Group
+
+# interne Spalten der Zeilen-Dateien; alle übrigen Spalten sind Felder der Originalzeilen
+META_COLUMNS = [
+    ("_symbol", pa.string()),
+    ("_seq", pa.int32()),       # Zeilenposition in der Originaldatei
+    ("_row", pa.string()),      # Zeile als JSON, wenn sie kein Objekt ist
+    ("_extra", pa.string()),    # JSON-Objekt mit Feldern, die nicht in ihre Spalte passen
+    ("_missing", pa.string()),  # JSON-Liste der Spaltenfelder, die in der Zeile fehlen
+]
+_META_NAMES = {name for name, _ in META_COLUMNS}
+_INT64_MIN, _INT64_MAX = -(2 ** 63), 2 ** 63 - 1
+FILE_SCHEMA = pa.schema([
+    ("symbol", pa.string()),
+    ("kind", pa.string()),
+    ("size", pa.int64()),       # null = Datei fehlt
+    ("mtime", pa.int64()),
+    ("sha256", pa.string()),
+    ("shape", pa.string()),
+    ("has_content", pa.bool_()),  # wie _json_has_content im Backfill
+    ("audit_ok", pa.bool_()),     # wie _read_json im Audit (gültiges JSON, nicht leer)
+])
+
+# ===================== Dateien lesen =====================
+def _parse(raw: bytes) -> Tuple[Any, bool, bool]:
+    """
+    Gleiche Regeln wie _read_file (ingest_fmp_sp) und _read_json (audit_fmp_files):
+    liefert (Daten, Inhalt-Flag, Audit-Flag). NDJSON wird zeilenweise gelesen, zählt
+    aber nicht als Inhalt.
+    """
+    res, _ = json_io.parse_bytes(raw)
+    return res.data, res.has_content, res.valid and bool(res.data)
+
+def _discover_symbols(folder: Path) -> List[str]:
+    return sorted({p.name.split("_", 1)[0] for p in folder.glob("*_*.json")})
+
+def _shape(data: Any) -> str:
+    if data is None: return SHAPE_NONE
+    if isinstance(data, list): return SHAPE_LIST
+    if isinstance(data, dict): return SHAPE_DICT
+    return SHAPE_VALUE
+
+# ===================== Store aufbauen =====================
+def _arrow_type(value: Any):
+    """Spaltentyp für einen JSON-Wert; None = nur als JSON in _extra speicherbar."""
+    if isinstance(value, bool):
+        return pa.bool_()
+    if isinstance(value, int):
+        return pa.int64() if _INT64_MIN <= value <= _INT64_MAX else None
+    if isinstance(value, float):
+        return pa.float64()
+    if isinstance(value, str):
+        return pa.string()
+    return None
+
+def _infer_fields(items: List[Any]) -> List[Tuple[str, Any]]:
+    """Je Feld der häufigste Spaltentyp über alle Zeilen (Reihenfolge: erstes Auftreten)."""
+    counts: Dict[str, Dict[Any, int]] = {}
+    for r in items:
+        if not isinstance(r, dict):
+            continue
+        for k, v in r.items():
+            c = counts.setdefault(k, {})
+            t = _arrow_type(v) if v is not None else None
+            if t is not None:
+                c[t] = c.get(t, 0) + 1
+    return [(k, max(c, key=c.get)) for k, c in counts.items() if c and k not in _META_NAMES]
+
+def _row_table(rows: List[Tuple[str, int, Any]], fields: List[Tuple[str, Any]], schema: pa.Schema) -> pa.Table:
+    """(symbol, seq, Zeile) → Tabelle; was nicht in die typisierte Spalte passt, geht nach _extra."""
+    cols: Dict[str, List[Any]] = {name: [] for name in schema.names}
+    for sym, seq, r in rows:
+        cols["_symbol"].append(sym)
+        cols["_seq"].append(seq)
+        if not isinstance(r, dict):
+            cols["_row"].append(json.dumps(r, ensure_ascii=False))
+            cols["_extra"].append(None)
+            cols["_missing"].append(None)
+            for k, _ in fields:
+                cols[k].append(None)
+            continue
+        extra, missing = {}, []
+        for k, t in fields:
+            if k not in r:
+                missing.append(k)
+                cols[k].append(None)
+                continue
+            v = r[k]
+            if v is None or _arrow_type(v) == t:
+                cols[k].append(v)
+            else:
+                extra[k] = v
+                cols[k].append(None)
+        typed = {k for k, _ in fields}
+        extra.update((k, v) for k, v in r.items() if k not in typed)
+        cols["_row"].append(None)
+        cols["_extra"].append(json.dumps(extra, ensure_ascii=False) if extra else None)
+        cols["_missing"].append(json.dumps(missing) if missing else None)
+    return pa.table(cols, schema=schema)
+
+def build_store(src_dir: Path = FMP_DIR, store_dir: Path = STORE_DIR) -> Dict[str, int]:
+    """Liest alle FMP-Dateien einmal und schreibt je Dateityp eine Parquet-Datei."""
+    if not src_dir.exists():
+        raise FileNotFoundError(f"❌ FMP-Ordner nicht gefunden: {src_dir}")
+    store_dir.mkdir(parents=True, exist_ok=True)
+
+    symbols = _discover_symbols(src_dir)
+    print(f"📦 Baue FMP-Store aus {len(symbols)} Symbolen: {src_dir} → {store_dir}")
+    t0 = time.monotonic()
+
+    rows: Dict[str, Dict[str, List[Any]]] = {kind: {} for kind in FILES}  # Typ → Symbol → Zeilen
+    files = {name: [] for name in FILE_SCHEMA.names}
+
+    for sym in symbols:
+        for kind in FILES:
+            p = src_dir / f"{sym}_{kind}.json"
+            data, has_content, audit_ok, sig = None, False, False, None
+            if p.exists():
+                st = p.stat()
+                raw = p.read_bytes()
+                data, has_content, audit_ok = _parse(raw)
+                sig = {"size": st.st_size, "mtime": st.st_mtime_ns, "sha256": hashlib.sha256(raw).hexdigest()}
+
+            shape = _shape(data)
+            items = data if shape == SHAPE_LIST else ([data] if shape != SHAPE_NONE else [])
+            if items:
+                rows[kind][sym] = items
+
+            files["symbol"].append(sym)
+            files["kind"].append(kind)
+            files["size"].append(sig["size"] if sig else None)
+            files["mtime"].append(sig["mtime"] if sig else None)
+            files["sha256"].append(sig["sha256"] if sig else None)
+            files["shape"].append(shape)
+            files["has_content"].append(has_content)
+            files["audit_ok"].append(audit_ok)
+
+    # erst in temporäre Dateien, dann umbenennen — ein Abbruch lässt den alten Store intakt
+    meta = {b"source_dir": str(src_dir).encode(), b"built_at": datetime.now(UTC).isoformat().encode(),
+            b"block_symbols": str(BLOCK_SYMBOLS).encode()}
+    blocks = [symbols[i:i + BLOCK_SYMBOLS] for i in range(0, len(symbols), BLOCK_SYMBOLS)]
+    written = {}
+    for kind in FILES:
+        by_sym = rows.pop(kind)
+        fields = _infer_fields([r for items in by_sym.values() for r in items])
+        schema = pa.schema(META_COLUMNS + fields, metadata=meta)
+        tmp = store_dir / f"{kind}.parquet.tmp"
+        n = 0
+        with pq.ParquetWriter(tmp, schema, compression="zstd") as writer:
+            for block in blocks:  # eine Row-Group je Block
+                part = [(sym, i, r) for sym in block for i, r in enumerate(by_sym.get(sym, ()))]
+                if part:
+                    writer.write_table(_row_table(part, fields, schema), row_group_size=len(part))
+                    n += len(part)
+        tmp.replace(store_dir / f"{kind}.parquet")
+        written[kind] = n
+    table = pa.table(files, schema=FILE_SCHEMA).replace_schema_metadata(meta)
+    tmp = store_dir / "files.parquet.tmp"
+    pq.write_table(table, tmp, compression="zstd")
+    tmp.replace(store_dir / "files.parquet")
+    written["files"] = table.num_rows
+
+    print(f"✅ FMP-Store fertig in {time.monotonic() - t0:.1f}s: "
+          + ", ".join(f"{k}={v}" for k, v in written.items()))
+    return written
+
+# ===================== Store lesen =====================
+class FmpStore:
+    """
+    Hält nur die Übersicht (files.parquet) im Speicher; Zeilen werden je Symbolgruppe
+    gefiltert gelesen (bundles) und liefern dieselben Strukturen wie die Einzeldateien.
+    """
+
+    def __init__(self, store_dir: Path = STORE_DIR):
+        files_path = store_dir / "files.parquet"
+        if not files_path.exists():
+            raise FileNotFoundError(f"❌ FMP-Store nicht gefunden: {store_dir} (erst 'python fmp_store.py' ausführen)")
+        self.store_dir = store_dir
+
+        files = pq.read_table(files_path)
+        meta = files.schema.metadata or {}
+        self.built_at = meta.get(b"built_at", b"").decode()
+        self.block_symbols = int(meta.get(b"block_symbols", b"0") or 0)
+        self._files: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        for r in files.to_pylist():
+            self._files.setdefault(r["symbol"], {})[r["kind"]] = r
+
+    def symbols(self) -> List[str]:
+        return sorted(self._files)
+
+    def blocks(self, symbols: List[str]) -> List[List[str]]:
+        """
+        symbols nach Row-Groups gruppiert (Blöcke in der Reihenfolge ihres ersten Auftretens),
+        damit ein gefilterter Read je Block genügt.
+        """
+        size = self.block_symbols or len(self._files) or 1
+        pos = {s: i // size for i, s in enumerate(self.symbols())}
+        groups: Dict[int, List[str]] = {}
+        for s in symbols:
+            groups.setdefault(pos.get(s, -1), []).append(s)
+        return list(groups.values())
+
+    def file_status(self, symbol: str) -> Dict[str, Dict[str, Any]]:
+        """Je Dateityp: size/mtime/sha256/shape/has_content/audit_ok (size None = Datei fehlt)."""
+        return self._files.get(symbol, {})
+
+    def signature(self, symbol: str) -> Dict[str, Any]:
+        """Datei-Signaturen im Format des Backfill-Manifests (Stand beim Aufbau des Stores)."""
+        out = {}
+        for kind in FILES:
+            f = self._files.get(symbol, {}).get(kind)
+            out[kind] = None if not f or f["size"] is None else {
+                "size": f["size"], "mtime": f["mtime"], "sha256": f["sha256"]}
+        return out
+
+    def _rows(self, kind: str, symbols: List[str]) -> Dict[str, List[Any]]:
+        """Originalzeilen je Symbol aus EINEM gefilterten Read (nur die passenden Row-Groups)."""
+        t = pq.read_table(self.store_dir / f"{kind}.parquet", filters=[("_symbol", "in", list(symbols))])
+        cols = t.to_pydict()
+        fields = [k for k in t.column_names if k not in _META_NAMES]
+        out: Dict[str, List[Any]] = {}
+        for i, sym in enumerate(cols["_symbol"]):
+            if cols["_row"][i] is not None:
+                row = json.loads(cols["_row"][i])
+            else:
+                row = {k: cols[k][i] for k in fields}
+                if cols["_missing"][i]:
+                    for k in json.loads(cols["_missing"][i]):
+                        del row[k]
+                if cols["_extra"][i]:
+                    row.update(json.loads(cols["_extra"][i]))
+            out.setdefault(sym, []).append(row)  # geschrieben und gelesen in seq-Reihenfolge
+        return out
+
+    def bundles(self, symbols: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Bundles wie _load_bundle in ingest_fmp_sp (symbol/data/content) für mehrere Symbole."""
+        symbols = [s for s in symbols if s in self._files]
+        if not symbols:
+            return {}
+        rows = {kind: self._rows(kind, symbols) for kind in FILES}
+        out = {}
+        for sym in symbols:
+            status = self._files[sym]
+            data = {}
+            for kind in FILES:
+                shape = status.get(kind, {}).get("shape", SHAPE_NONE)
+                items = rows[kind].get(sym, [])
+                data[kind] = None if shape == SHAPE_NONE else (items if shape == SHAPE_LIST else items[0])
+            out[sym] = {
+                "symbol": sym,
+                "data": data,
+                "content": {kind: bool(status.get(kind, {}).get("has_content")) for kind in FILES},
+            }
+        return out
+
+    def bundle(self, symbol: str) -> Dict[str, Any]:
+        """Bundle eines einzelnen Symbols (liest dessen Row-Group je Dateityp)."""
+        return self.bundles([symbol]).get(symbol) or {
+            "symbol": symbol, "data": {kind: None for kind in FILES}, "content": {kind: False for kind in FILES}}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="FMP-Einzeldateien in einen Parquet-Store je Dateityp umwandeln.")
+    parser.add_argument("--src", type=Path, default=FMP_DIR, help="Ordner mit den FMP-JSON-Dateien")
+    parser.add_argument("--out", type=Path, default=STORE_DIR, help="Zielordner des Stores")
+    args = parser.parse_args()
+    build_store(args.src, args.out)
@@ -1,13 +1,11 @@
 import os
-import time
 import random
 import json
 from datetime import datetime, UTC
-from typing import Dict, List
+from typing import Dict, Iterable, List
 from pathlib import Path
 
 import requests
-from elasticsearch import helpers
 from dotenv import load_dotenv
 
 # --- interne Helfer aus utils.py (noch zu erstellen) ---
@@ -17,7 +15,17 @@ from utils import (
     ensure_index,
     requests_session,
     random_user_agent,
+    BulkWriter,
+    rate_limiter,
+    QuotaExceeded,
+    RunCheckpoint,
+    SnapshotCache,
+    latest_index,
+    latest_action,
+    seed_latest,
 )
+from fetch_engine import FetchEngine
+from prioritize import prioritize
 
 # === 1️⃣ Setup & Konfiguration ===
 
@@ -26,6 +34,9 @@ load_dotenv(BASE_DIR / ".env.local", override=False)
 load_dotenv(BASE_DIR / ".env", override=False)
 
 FMP_API_KEY = os.getenv("FMP_API_KEY")
+FMP_BASE = os.getenv("FMP_BASE_URL", "https://financialmodelingprep.com/api/v3").rstrip("/")
+QUOTE_BATCH = int(os.getenv("FMP_QUOTE_BATCH", "50"))  # Symbole pro Quote-Request (kommagetrennt)
+CONCURRENCY = int(os.getenv("FMP_CONCURRENCY", "4"))   # gleichzeitige Quote-Requests
 ES_INDEX = os.getenv("ELASTICSEARCH_INDEX", "metrics_sp500")
 
 if not FMP_API_KEY:
@@ -33,6 +44,7 @@ if not FMP_API_KEY:
 
 es = es_client()
 SESSION = requests_session()
+LIMITER = rate_limiter("fmp")  # FMP_CALLS_PER_MINUTE / FMP_CALLS_PER_DAY
 
 DATA_DIR = Path(__file__).resolve().parents[0] / "data"
 DATA_DIR.mkdir(exist_ok=True)
@@ -60,7 +72,8 @@ def get_sp500_symbols(force_refresh: bool = False) -> List[str]:
             with open(CACHE_FILE, "r") as f:
                 return json.load(f)
 
-    url = f"https://financialmodelingprep.com/api/v3/etf-holdings/SPY?apikey={FMP_API_KEY}"
+    url = f"{FMP_BASE}/etf-holdings/SPY?apikey={FMP_API_KEY}"
+    LIMITER.acquire()
     r = SESSION.get(url, timeout=20, headers={"User-Agent": random_user_agent()})
     r.raise_for_status()
     data = r.json()
@@ -74,16 +87,76 @@ def get_sp500_symbols(force_refresh: bool = False) -> List[str]:
 
 
 
-def get_quote(symbol: str) -> Dict:
-    """Lädt aktuelle Kennzahlen (Quote) für ein Symbol."""
-    url = f"https://financialmodelingprep.com/api/v3/quote/{symbol}?apikey={FMP_API_KEY}"
+def _chunks(items: List[str], size: int) -> Iterable[List[str]]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+FATAL_STATUS = {401, 402, 403}  # Key ungültig, Tarif ohne Batch-Quotes, gesperrt
+SPLIT_STATUS = {400, 404}       # vermutlich ein ungültiges Symbol im Batch
+
+
+def get_quotes(symbols: List[str], limit: bool = True) -> Dict[str, Dict]:
+    """
+    Lädt Quotes für mehrere Symbole in EINEM Request (/quote/AAPL,MSFT,...).
+    Rückgabe: {Symbol: Quote}; fehlende Symbole fehlen einfach im Ergebnis.
+    Nur wenn die Antwort auf ein einzelnes schlechtes Symbol hindeutet (400/404, keine Liste),
+    wird der Batch halbiert, damit es nicht alle anderen mitnimmt.
+    Key/Tarif/Kontingent (401/402/403, "Limit Reach") → QuotaExceeded, der Lauf endet;
+    429 und 5xx → HTTPError (Retry mit Backoff in der FetchEngine), ohne Aufteilen.
+    limit=False: der Aufrufer (FetchEngine) hat das Rate-Limit-Token bereits geholt.
+    """
+    if not symbols:
+        return {}
+    url = f"{FMP_BASE}/quote/{','.join(symbols)}?apikey={FMP_API_KEY}"
     headers = {"User-Agent": random_user_agent()}
-    r = SESSION.get(url, timeout=15, headers=headers)
-    if r.status_code != 200:
-        print(f"[WARN] {symbol}: HTTP {r.status_code}")
+    if limit:
+        LIMITER.acquire()
+    try:
+        r = SESSION.get(url, timeout=15 + len(symbols) // 10, headers=headers)
+    except requests.RequestException as e:
+        # Netzwerk/5xx nach allen Session-Retries: Aufteilen würde nur mehr Last erzeugen
+        print(f"[WARN] Quote-Batch ({len(symbols)} Symbole) fehlgeschlagen: {e}")
         return {}
-    arr = r.json() or []
-    return arr[0] if arr else {}
+    if r.status_code in FATAL_STATUS:
+        raise QuotaExceeded(f"FMP HTTP {r.status_code}: {r.text[:120]}")
+    if r.status_code not in (200, *SPLIT_STATUS):
+        raise requests.HTTPError(f"FMP HTTP {r.status_code}", response=r)
+    try:
+        if r.status_code != 200:
+            raise RuntimeError(f"HTTP {r.status_code}")
+        arr = r.json() or []
+        if not isinstance(arr, list):
+            msg = str(arr.get("Error Message", "")) if isinstance(arr, dict) else ""
+            if "limit" in msg.lower():
+                raise QuotaExceeded(f"FMP: {msg[:120]}")
+            raise RuntimeError(f"unerwartete Antwort: {str(arr)[:120]}")
+    except QuotaExceeded:
+        raise
+    except Exception as e:
+        if len(symbols) == 1:
+            print(f"[WARN] {symbols[0]}: {e}")
+            return {}
+        mid = len(symbols) // 2
+        print(f"[WARN] Quote-Batch ({len(symbols)} Symbole) abgelehnt: {e} → teile auf")
+        return {**get_quotes(symbols[:mid]), **get_quotes(symbols[mid:])}
+
+    # Antwort pro Symbol zuordnen (FMP liefert nur, was es kennt — Reihenfolge nicht garantiert)
+    wanted = {s.upper(): s for s in symbols}
+    quotes = {}
+    for row in arr:
+        sym = wanted.get(str(row.get("symbol", "")).upper()) if isinstance(row, dict) else None
+        if sym is not None:
+            quotes[sym] = row
+    missing = [s for s in symbols if s not in quotes]
+    if missing:
+        print(f"[WARN] Keine Quote für {len(missing)} Symbol(e): {', '.join(missing[:10])}")
+    return quotes
+
+
+def get_quote(symbol: str) -> Dict:
+    """Lädt aktuelle Kennzahlen (Quote) für ein Symbol."""
+    return get_quotes([symbol]).get(symbol, {})
 
 
 def build_doc(symbol: str, profile: Dict) -> Dict:
@@ -110,46 +183,71 @@ def build_doc(symbol: str, profile: Dict) -> Dict:
 
 # === 4️⃣ Main-Pipeline ===
 
-def run(batch_sleep: float = 7.0):
+def run(batch_size: int = QUOTE_BATCH):
     """Hauptpipeline für FMP-Ingestion (S&P 500)."""
     print(es_healthcheck(es))
     ensure_index(es, ES_INDEX)
+    ensure_index(es, latest_index(ES_INDEX))
+    seed_latest(es, ES_INDEX)
 
     symbols = get_sp500_symbols()
     random.shuffle(symbols)  # Anti-Bot
-    print(f"Starte Ingestion für {len(symbols)} Symbole...")
-
-    docs_buffer = []
-    written = 0
-
-    for i, symbol in enumerate(symbols, 1):
-        try:
-            quote = get_quote(symbol)
-            if not quote:
+    symbols = prioritize(es, symbols, ES_INDEX, source="FMP (Quote)")  # alt/unvollständig/Earnings zuerst
+
+    # Checkpoint: nach einem Neustart am selben Tag mit der gleichen Reihenfolge weitermachen
+    ckpt = RunCheckpoint("fmp", symbols)
+    symbols = ckpt.pending()
+    print(f"Starte Ingestion für {len(symbols)} Symbole (je {batch_size} pro Quote-Request)...")
+
+    # unveränderte Kennzahlen nur bestätigen statt als neues Tagesdokument schreiben
+    snaps = SnapshotCache("fmp", es)
+
+    def on_batch(actions, errors):
+        ckpt.ack(actions, errors)
+        snaps.ack(actions, errors)
+
+    # Schreiben läuft im Hintergrund – der Abruf wartet nicht auf ES
+    writer = BulkWriter(es, batch_docs=100, label="fmp", on_batch=on_batch)
+    writer.write(ckpt.buffered_actions())  # vor dem Neustart abgerufen, aber nicht bestätigt
+
+    # Quote-Batches nebenläufig abrufen (Rate-Limit holt die Engine, nicht get_quotes)
+    engine = FetchEngine("fmp", concurrency=CONCURRENCY, limiter=LIMITER)
+    batches = _chunks(symbols, max(1, batch_size))
+    try:
+        for batch, quotes, err in engine.map(lambda b: get_quotes(b, limit=False), batches):
+            rate_limited = isinstance(err, requests.HTTPError) and getattr(err.response, "status_code", None) == 429
+            if isinstance(err, QuotaExceeded) or rate_limited:
+                # 429 auch nach allen Wiederholungen: weitere Batches würden nur Kontingent verbrennen
+                print(f"⛔ {err} – breche ab, bisher Geladenes wird gespeichert.")
+                break
+            if err is not None:
+                print(f"[FEHLER] Quote-Batch {batch[0]}…{batch[-1]}: {err}")
                 continue
 
-            doc = build_doc(symbol, quote)
-            docs_buffer.append(doc)
-
-            # Alle 100 Docs in Elasticsearch schreiben
-            if len(docs_buffer) >= 100:
-                helpers.bulk(es, docs_buffer)
-                written += len(docs_buffer)
-                docs_buffer.clear()
-                print(f"[{i}/{len(symbols)}] {written} Dokumente gespeichert...")
-
-        except Exception as e:
-            print(f"[FEHLER] {symbol}: {e}")
-
-        # Sleep mit Jitter (Anti-Bot)
-        time.sleep(batch_sleep + random.uniform(0.3, 1.2))
-
-    # Rest speichern
-    if docs_buffer:
-        helpers.bulk(es, docs_buffer)
-        written += len(docs_buffer)
-
-    print(f"✅ Fertig. Gesamt gespeichert: {written} Dokumente.")
+            for symbol in batch:
+                quote = quotes.get(symbol)
+                if not quote:
+                    if quotes:  # Batch beantwortet, nur dieses Symbol fehlt → nicht erneut versuchen
+                        ckpt.done(symbol)
+                    continue
+                try:
+                    doc = build_doc(symbol, quote)
+                    # Historie (nur bei Änderung bzw. fälliger Bestätigung) + aktueller Stand in <ES_INDEX>_latest
+                    for action in filter(None, (snaps.dedupe(doc), latest_action(doc))):
+                        ckpt.hold(symbol, action)
+                        writer.add(action)
+                except Exception as e:
+                    print(f"[FEHLER] {symbol}: {e}")
+                    ckpt.done(symbol)
+    finally:
+        # Rest speichern, danach Stand sichern (auch bei Abbruch)
+        writer.close()
+        snaps.save()
+        ckpt.finish()
+
+    hist, latest = writer.index_summary(ES_INDEX), writer.index_summary(latest_index(ES_INDEX))
+    print(f"✅ Fertig. Gesamt gespeichert: {hist['ok']} Dokumente in '{ES_INDEX}' ({hist['failed']} nicht geschrieben); "
+          f"aktueller Stand: {latest['ok']} in '{latest_index(ES_INDEX)}' ({latest['failed']} nicht geschrieben).")
 
 
 # === 5️⃣ Einstiegspunkt ===
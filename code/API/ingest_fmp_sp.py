@@ -1,10 +1,13 @@
 # code/API/ingest_fmp_sp.py
-import os, json, random, math
+import os, json, random, argparse, hashlib, time, threading
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from itertools import islice
 from datetime import datetime, UTC
 from pathlib import Path
 from typing import Dict, List, Any, Iterable, Tuple
-from elasticsearch import helpers
-from utils import es_client, es_healthcheck, ensure_index  # vorhanden in code/API/utils.py
+from utils import es_client, es_healthcheck, ensure_index, BulkWriter, latest_index, latest_action, action_symbol  # vorhanden in code/API/utils.py
+from fmp_derive import derive_docs, derive_doc, MISSING_REQUIRED, _f
+import json_io
 
 # === Pfade & Config ===
 BASE_DIR    = Path(__file__).resolve().parent          # .../code/API
@@ -12,8 +15,11 @@ PROJECTROOT = BASE_DIR.parents[1]                      # .../ (Projektwurzel)
 FMP_DIR     = PROJECTROOT / "data" / "sp_data" / "total_sp_data"  # Ordner mit den FMP-Dateien
 ES_INDEX    = os.getenv("ELASTICSEARCH_INDEX", "stocks")
 STRICT_MODE = os.getenv("STRICT_REQUIRED", "0") == "1"  # 1 = streng, 0 = aufnehmen + warnen
+MANIFEST_FILE = Path(os.getenv("FMP_MANIFEST", str(FMP_DIR.parent / "fmp_ingest_manifest.json")))  # inkrementeller Stand
+STORE_DIR   = Path(os.getenv("FMP_STORE", str(FMP_DIR.parent / "fmp_store")))  # Parquet-Store (fmp_store.py)
 
 es = es_client()
+_STORE = None  # FmpStore, wenn aus dem Parquet-Store statt aus Einzeldateien gelesen wird
 
 # === Anforderungen definieren ===
 REQUIRED_FILES = ["Profile", "IncomeStatement", "BalanceSheet", "CashflowStatement", "KeyMetrics", "Ratios"]
@@ -38,18 +44,11 @@ REQUIRED_FIELDS = {
 
 # ===================== kleine Helfer =====================
 def _json_has_content(p: Path) -> bool:
-    if not p.exists() or p.stat().st_size < 10:
-        return False
-    try:
-        txt = p.read_text(encoding="utf-8", errors="ignore").strip()
-        if not txt or txt in ("[]", "{}"):
-            return False
-        json.loads(txt)
-        return True
-    except Exception:
-        return False
+    return json_io.load(p).has_content
 
-def _has_all_required_files(sym: str) -> bool:
+def _has_all_required_files(sym: str, bundle: Dict[str, Any] = None) -> bool:
+    if bundle is not None:
+        return all(bundle["content"].get(name) for name in REQUIRED_FILES)
     for name in REQUIRED_FILES:
         if not _json_has_content(FMP_DIR / f"{sym}_{name}.json"):
             return False
@@ -58,30 +57,30 @@ def _has_all_required_files(sym: str) -> bool:
 def _missing_required_fields(metrics: dict) -> List[str]:
     return sorted(k for k in REQUIRED_FIELDS if k not in metrics or metrics[k] is None)
 
-def _f(x):
-    try:
-        if x is None: return None
-        if isinstance(x, (int, float)):
-            if isinstance(x, float) and (math.isnan(x) or math.isinf(x)):
-                return None
-            return float(x)
-        return float(str(x).replace(",", ""))
-    except Exception:
-        return None
-
 def _read_json(path: Path):
-    txt = path.read_text(encoding="utf-8", errors="ignore").strip()
-    if not txt: return None
-    try:
-        return json.loads(txt)
-    except Exception:
-        rows = []
-        for ln in txt.splitlines():
-            ln = ln.strip()
-            if not ln: continue
-            try: rows.append(json.loads(ln))
-            except: pass
-        return rows or None
+    return json_io.load_data(path)
+
+def _read_file(path: Path) -> Tuple[Any, bool]:
+    """
+    Liest eine Datei genau einmal und liefert (Daten wie _read_json, Inhalt-Flag wie _json_has_content).
+    """
+    res = json_io.load(path)
+    return res.data, res.has_content
+
+def _symbol_files(symbol: str, base_dir: Path) -> Dict[str, Path]:
+    return {name: base_dir / f"{symbol}_{name}.json" for name in REQUIRED_FILES}
+
+def _load_bundle(symbol: str, base_dir: Path = None) -> Dict[str, Any]:
+    """
+    Lädt alle sechs FMP-Dateien eines Symbols genau einmal.
+    - data:    geparste Inhalte je Datei (None bei fehlend/leer)
+    - content: True, wenn die Datei gültiges, nicht-leeres JSON enthält
+    Das Bundle wird von Vollständigkeits-Check, Heute-Dokument und Historie gemeinsam genutzt.
+    """
+    data, content = {}, {}
+    for name, p in _symbol_files(symbol, base_dir or FMP_DIR).items():
+        data[name], content[name] = _read_file(p)
+    return {"symbol": symbol, "data": data, "content": content}
 
 def _latest_row(seq):
     if isinstance(seq, list) and seq:
@@ -121,6 +120,13 @@ def _rows_with_date(obj, date_key="date") -> Iterable[Tuple[datetime.date, Dict[
         if d:
             yield d, obj
 
+def _index_by_date(obj, date_key="date") -> Dict[Any, List[Dict[str, Any]]]:
+    """Gruppiert alle Zeilen einmalig nach Datum (Reihenfolge innerhalb eines Datums bleibt erhalten)."""
+    idx: Dict[Any, List[Dict[str, Any]]] = {}
+    for d, r in _rows_with_date(obj, date_key):
+        idx.setdefault(d, []).append(r)
+    return idx
+
 def _merge_dict(dst: dict, src: dict, prefer_existing: bool = True) -> dict:
     for k, v in src.items():
         if v is None:
@@ -129,39 +135,12 @@ def _merge_dict(dst: dict, src: dict, prefer_existing: bool = True) -> dict:
             continue
         dst[k] = v
     return dst
-def _normalize_numeric_fields(d: dict) -> dict:
-    num_keys = [
-        "marketCap","peRatio","priceToBook","dividendYield","payoutRatio",
-        "revenueGrowth","earningsGrowth","epsGrowth","profitMargin","fcfMargin",
-        "currentRatio","quickRatio","debtToAssets","freeCashFlow","freeCashflow",
-        "freeCashFlowPerShare","cashPerShare","bookValuePerShare","totalDebt",
-        "totalAssets","revenue","eps","beta","pegRatio","debtToEquity",
-        "cashToDebt","equityRatio",
-        # rohe FMP-Ratio-Felder, die wir später mappen
-        "priceEarningsRatioTTM","priceEarningsRatio",
-        "priceToBookRatio","pbRatio",
-        "dividendYieldTTM",
-        "priceEarningsToGrowthRatio","priceEarningsToGrowthRatioTTM",
-        "debtToEquityTTM","debtEquityRatio",
-        "currentRatioTTM","quickRatioTTM",
-    ]
-    for k in num_keys:
-        if k in d:
-            d[k] = _f(d[k])
-    return d
-
 
 # ===================== Heute-Dokument (aktuelle Kennzahlen) =====================
-def build_metrics_fmp(symbol: str, base_dir: Path) -> Dict[str, Any]:
-    files = {
-        "Profile":           base_dir / f"{symbol}_Profile.json",
-        "IncomeStatement":   base_dir / f"{symbol}_IncomeStatement.json",
-        "BalanceSheet":      base_dir / f"{symbol}_BalanceSheet.json",
-        "CashflowStatement": base_dir / f"{symbol}_CashflowStatement.json",
-        "KeyMetrics":        base_dir / f"{symbol}_KeyMetrics.json",
-        "Ratios":            base_dir / f"{symbol}_Ratios.json",
-    }
-    data = {k: (_read_json(p) if p.exists() else None) for k, p in files.items()}
+def build_metrics_fmp(symbol: str, base_dir: Path, bundle: Dict[str, Any] = None) -> Dict[str, Any]:
+    if bundle is None:
+        bundle = _load_bundle(symbol, base_dir)
+    data = bundle["data"]
 
     empty_parts = [k for k, v in data.items() if not v or v in ([], {}, None)]
     if empty_parts:
@@ -258,23 +237,11 @@ def build_metrics_fmp(symbol: str, base_dir: Path) -> Dict[str, Any]:
     cur_liab      = _f(bal.get("totalCurrentLiabilities"))
     inventory     = _f(bal.get("inventory"))
 
-    long_debt     = _f(bal.get("longTermDebt"))
-    short_debt    = _f(bal.get("shortTermDebt"))
-    sld_total     = _f(bal.get("shortLongTermDebtTotal"))
-    totalDebt     = (long_debt or 0.0) + (short_debt or 0.0) if (long_debt is not None or short_debt is not None) else sld_total
-
-    currentRatio  = (cur_assets / cur_liab) if isinstance(cur_assets, float) and isinstance(cur_liab, float) and cur_liab else pick("currentRatio")
-    quickRatio    = ((cur_assets - inventory) / cur_liab) if all(isinstance(x, float) for x in [cur_assets, inventory, cur_liab]) and cur_liab else pick("quickRatio")
-    debtToEquity  = (totalDebt / equity) if isinstance(totalDebt, float) and isinstance(equity, float) and equity else pick("debtToEquity")
-
-    ocf   = _f(cfs.get("netCashProvidedByOperatingActivities") or cfs.get("operatingCashFlow") or cfs.get("operatingCashflow"))
-    capex = _f(cfs.get("capitalExpenditure") or cfs.get("capitalExpenditures"))
-    freeCashflow = (ocf - capex) if isinstance(ocf, float) and isinstance(capex, float) else None
-
+    kms_raw = _latest_row(data.get("KeyMetrics") or [])
     shares_out = _f(
         (prof.get("sharesOutstanding") if prof else None) or
-        (_latest_row(_read_json(FMP_DIR / f"{symbol}_KeyMetrics.json") or []).get("sharesOutstandingTTM") if (FMP_DIR / f"{symbol}_KeyMetrics.json").exists() else None) or
-        (_latest_row(_read_json(FMP_DIR / f"{symbol}_KeyMetrics.json") or []).get("sharesOutstanding") if (FMP_DIR / f"{symbol}_KeyMetrics.json").exists() else None) or
+        kms_raw.get("sharesOutstandingTTM") or
+        kms_raw.get("sharesOutstanding") or
         (inc.get("weightedAverageShsOutDil") if inc else None) or
         (inc.get("weightedAverageShsOut") if inc else None)
     )
@@ -289,16 +256,8 @@ def build_metrics_fmp(symbol: str, base_dir: Path) -> Dict[str, Any]:
     bookValuePerShare    = pick("bookValuePerShare")
     cashPerShare         = pick("cashPerShare")
     freeCashFlowPerShare = pick("freeCashFlowPerShare")
-    if freeCashFlowPerShare is None and isinstance(freeCashflow, float) and isinstance(shares_out, float) and shares_out:
-        freeCashFlowPerShare = freeCashflow / shares_out
-
-    cashToDebt  = (totalCash / totalDebt) if isinstance(totalCash, float) and isinstance(totalDebt, float) and totalDebt else None
-    equityRatio = (equity / totalAssets) if isinstance(equity, float) and isinstance(totalAssets, float) and totalAssets else None
-    fcfMargin   = (freeCashflow / revenue) if isinstance(freeCashflow, float) and isinstance(revenue, float) and revenue else None
 
     trailingPE     = peRatio
-    freeCashFlow   = freeCashflow
-    debtToAssets   = (totalDebt / totalAssets) if isinstance(totalDebt, float) and isinstance(totalAssets, float) and totalAssets else None
 
     # Growth
     earningsGrowth = None
@@ -340,8 +299,30 @@ def build_metrics_fmp(symbol: str, base_dir: Path) -> Dict[str, Any]:
         if all(isinstance(x, float) for x in (r0, r1, r2)):
             sgaTrend = (r0 < r1) and (r1 < r2)
 
-    if pegRatio is None and isinstance(trailingPE, float) and isinstance(earningsGrowth, float) and earningsGrowth > 0:
-        pegRatio = trailingPE / (earningsGrowth * 100.0)
+    # PEG, Schulden, Free Cashflow und Turnaround-Quoten wie im Backfill über fmp_derive
+    # (jüngste Zeile je Statement als ein Tabellen-Dokument, dieselben None-/Null-Regeln)
+    derived = derive_doc({
+        "peRatio": peRatio, "pegRatio": pegRatio, "earningsGrowth": earningsGrowth, "trailingPE": trailingPE,
+        "revenue": revenue,  # schon aus revenue/totalRevenue gewählt (wie im Dokument)
+        **{k: bal.get(k) for k in ("totalAssets", "totalStockholdersEquity", "totalStockholderEquity",
+                                   "cashAndCashEquivalents", "shortTermInvestments",
+                                   "longTermDebt", "shortTermDebt", "shortLongTermDebtTotal")},
+        **{k: cfs.get(k) for k in ("netCashProvidedByOperatingActivities", "operatingCashFlow", "operatingCashflow",
+                                   "capitalExpenditure", "capitalExpenditures")},
+    })
+    pegRatio     = derived.get("pegRatio")
+    totalDebt    = derived.get("totalDebt")
+    freeCashflow = derived.get("freeCashflow")
+    cashToDebt   = derived.get("cashToDebt")
+    equityRatio  = derived.get("equityRatio")
+    fcfMargin    = derived.get("fcfMargin")
+
+    currentRatio  = (cur_assets / cur_liab) if isinstance(cur_assets, float) and isinstance(cur_liab, float) and cur_liab else pick("currentRatio")
+    quickRatio    = ((cur_assets - inventory) / cur_liab) if all(isinstance(x, float) for x in [cur_assets, inventory, cur_liab]) and cur_liab else pick("quickRatio")
+    debtToEquity  = (totalDebt / equity) if isinstance(totalDebt, float) and isinstance(equity, float) and equity else pick("debtToEquity")
+    debtToAssets  = (totalDebt / totalAssets) if isinstance(totalDebt, float) and isinstance(totalAssets, float) and totalAssets else None
+    if freeCashFlowPerShare is None and isinstance(freeCashflow, float) and isinstance(shares_out, float) and shares_out:
+        freeCashFlowPerShare = freeCashflow / shares_out
 
     out = {k: v for k, v in {
         "marketCap": marketCap,
@@ -398,154 +379,19 @@ def build_doc(symbol: str, metrics: Dict[str, Any], missing_fields: List[str]) -
     }
 
 # ===================== Historischer Backfill (vereinheitlicht als "fmp") =====================
-def _load_all(symbol: str) -> Dict[str, Any]:
-    files = {
-        "Profile":           FMP_DIR / f"{symbol}_Profile.json",
-        "IncomeStatement":   FMP_DIR / f"{symbol}_IncomeStatement.json",
-        "BalanceSheet":      FMP_DIR / f"{symbol}_BalanceSheet.json",
-        "CashflowStatement": FMP_DIR / f"{symbol}_CashflowStatement.json",
-        "KeyMetrics":        FMP_DIR / f"{symbol}_KeyMetrics.json",
-        "Ratios":            FMP_DIR / f"{symbol}_Ratios.json",
-    }
-    data = {k: (_read_json(p) if p.exists() else None) for k, p in files.items()}
+def _load_all(symbol: str, bundle: Dict[str, Any] = None) -> Dict[str, Any]:
+    if bundle is None:
+        bundle = _load_bundle(symbol)
+    data = dict(bundle["data"])  # Bundle selbst nicht verändern
     prof = data.get("Profile")
     if isinstance(prof, list) and prof: prof = prof[0]
     if not isinstance(prof, dict): prof = {}
     data["Profile"] = prof
     return data
 
-def build_missing_fields(doc: dict) -> List[str]:
-    req = ["peRatio","revenueGrowth","earningsGrowth","dividendYield","payoutRatio","marketCap"]
-    return [k for k in req if doc.get(k) is None]
-def _compute_derived_turnaround_metrics(doc: dict) -> dict:
-    """
-    Berechnet für historische Dokumente Turnaround-Kennzahlen nach,
-    ähnlich wie in build_metrics_fmp:
-    - cashToDebt
-    - equityRatio
-    - fcfMargin
-    """
-    # Basisgrößen
-    revenue = _f(doc.get("revenue") or doc.get("totalRevenue"))
-
-    totalAssets = _f(doc.get("totalAssets"))
-    equity = _f(doc.get("totalStockholdersEquity") or doc.get("totalStockholderEquity"))
-
-    cash_eq = _f(doc.get("cashAndCashEquivalents"))
-    sti = _f(doc.get("shortTermInvestments"))
-    totalCash = ((cash_eq or 0.0) + (sti or 0.0)) if (cash_eq is not None or sti is not None) else None
-
-    long_debt = _f(doc.get("longTermDebt"))
-    short_debt = _f(doc.get("shortTermDebt"))
-    sld_total = _f(doc.get("shortLongTermDebtTotal"))
-    totalDebt = (long_debt or 0.0) + (short_debt or 0.0) if (long_debt is not None or short_debt is not None) else sld_total
-
-    if doc.get("totalDebt") is None and totalDebt is not None:
-        doc["totalDebt"] = totalDebt
-
-    ocf = _f(
-        doc.get("netCashProvidedByOperatingActivities")
-        or doc.get("operatingCashFlow")
-        or doc.get("operatingCashflow")
-    )
-    capex = _f(doc.get("capitalExpenditure") or doc.get("capitalExpenditures"))
-    freeCashflow = (ocf - capex) if isinstance(ocf, float) and isinstance(capex, float) else None
-
-    if doc.get("freeCashflow") is None and freeCashflow is not None:
-        doc["freeCashflow"] = freeCashflow
-        doc["freeCashFlow"] = freeCashflow  # Alias wie im Heute-Dokument
-
-    # cashToDebt
-    if doc.get("cashToDebt") is None and isinstance(totalCash, float) and isinstance(totalDebt, float) and totalDebt:
-        doc["cashToDebt"] = totalCash / totalDebt
-
-    # equityRatio
-    if doc.get("equityRatio") is None and isinstance(equity, float) and isinstance(totalAssets, float) and totalAssets:
-        doc["equityRatio"] = equity / totalAssets
-
-    # fcfMargin
-    if doc.get("fcfMargin") is None and isinstance(freeCashflow, float) and isinstance(revenue, float) and revenue:
-        doc["fcfMargin"] = freeCashflow / revenue
-
-    return doc
-
-def _enrich_historical_metrics(doc: dict) -> dict:
-    """
-    Versucht, historische Dokus so aufzubereiten wie build_metrics_fmp:
-    - normalisierte Felder (peRatio, priceToBook, dividendYield, payoutRatio, pegRatio, ...)
-    - PEG-Berechnung wie im Heute-Dokument, falls möglich.
-    """
-    # --- 1) peRatio & Co aus Roh-Feldern mappen ---
-    # Wenn peRatio noch nicht gesetzt ist, aus FMP-Feldern holen
-    if doc.get("peRatio") is None:
-        for k in ("priceEarningsRatioTTM", "priceEarningsRatio"):
-            v = doc.get(k)
-            if isinstance(v, (int, float)):
-                doc["peRatio"] = v
-                break
-
-    if doc.get("priceToBook") is None:
-        for k in ("priceToBookRatio", "pbRatio"):
-            v = doc.get(k)
-            if isinstance(v, (int, float)):
-                doc["priceToBook"] = v
-                break
-
-    if doc.get("dividendYield") is None:
-        for k in ("dividendYieldTTM", "dividendYield"):
-            v = doc.get(k)
-            if isinstance(v, (int, float)):
-                doc["dividendYield"] = v
-                break
-
-    if doc.get("payoutRatio") is None:
-        for k in ("payoutRatioTTM", "payoutRatio"):
-            v = doc.get(k)
-            if isinstance(v, (int, float)):
-                doc["payoutRatio"] = v
-                break
-
-    if doc.get("debtToEquity") is None:
-        for k in ("debtToEquityTTM", "debtEquityRatio"):
-            v = doc.get(k)
-            if isinstance(v, (int, float)):
-                doc["debtToEquity"] = v
-                break
-
-    if doc.get("currentRatio") is None:
-        for k in ("currentRatioTTM", "currentRatio"):
-            v = doc.get(k)
-            if isinstance(v, (int, float)):
-                doc["currentRatio"] = v
-                break
-
-    if doc.get("quickRatio") is None:
-        for k in ("quickRatioTTM", "quickRatio"):
-            v = doc.get(k)
-            if isinstance(v, (int, float)):
-                doc["quickRatio"] = v
-                break
-
-    # --- 2) PEG aus FMP-Feldern mappen ---
-    if doc.get("pegRatio") is None:
-        for k in ("pegRatioTTM", "pegRatio",
-                  "priceEarningsToGrowthRatioTTM", "priceEarningsToGrowthRatio"):
-            v = doc.get(k)
-            if isinstance(v, (int, float)):
-                doc["pegRatio"] = v
-                break
-
-    # --- 3) Falls immer noch None: PEG selbst berechnen wie im Heute-Dokument ---
-    pe = doc.get("peRatio") or doc.get("trailingPE")
-    earnings_growth = doc.get("earningsGrowth")
-    if doc.get("pegRatio") is None and isinstance(pe, (int, float)) and isinstance(earnings_growth, (int, float)) and earnings_growth > 0:
-        # gleiches Schema wie in build_metrics_fmp
-        doc["pegRatio"] = pe / (earnings_growth * 100.0)
-
-    return doc
-
-def build_historical_actions(symbol: str) -> List[Dict[str, Any]]:
-    d = _load_all(symbol)
+def build_historical_actions(symbol: str, bundle: Dict[str, Any] = None, skip_ids: set = None) -> List[Dict[str, Any]]:
+    """skip_ids: bereits geschriebene Dokument-IDs — diese Daten werden gar nicht erst aufgebaut."""
+    d = _load_all(symbol, bundle)
     prof = d.get("Profile") or {}
 
     inc_list = d.get("IncomeStatement") if isinstance(d.get("IncomeStatement"), list) else []
@@ -554,15 +400,17 @@ def build_historical_actions(symbol: str) -> List[Dict[str, Any]]:
     kms_list = d.get("KeyMetrics") if isinstance(d.get("KeyMetrics"), list) else []
     rat_list = d.get("Ratios") if isinstance(d.get("Ratios"), list) else []
 
+    # jede Liste genau einmal nach Datum indizieren (Merge-Reihenfolge wie bisher)
+    by_date = [_index_by_date(seq) for seq in (kms_list, rat_list, inc_list, bal_list, cfs_list)]
+
     # alle verfügbaren Datumsstempel einsammeln
     dates = set()
-    for seq in (inc_list, bal_list, cfs_list, kms_list, rat_list):
-        for dd, _ in _rows_with_date(seq):
-            dates.add(dd)
+    for idx in by_date:
+        dates.update(idx)
     if not dates:
         return []
 
-    actions: List[Dict[str, Any]] = []
+    docs: List[Dict[str, Any]] = []
     today_iso = datetime.now(UTC).date().isoformat()
 
     for dd in sorted(dates):
@@ -572,6 +420,8 @@ def build_historical_actions(symbol: str) -> List[Dict[str, Any]]:
         # würde _op_type=create mit der heutigen ID kollidieren → überspringen.
         if dd_iso == today_iso:
             continue
+        if skip_ids and f"{symbol}|{dd_iso}|fmp" in skip_ids:
+            continue
 
         doc = {
             "symbol": symbol,
@@ -581,99 +431,320 @@ def build_historical_actions(symbol: str) -> List[Dict[str, Any]]:
         }
 
         # pro Quelle nur die Einträge mit exakt diesem Datum einmischen
-        for seq in (kms_list, rat_list, inc_list, bal_list, cfs_list):
-            for ddd, row in _rows_with_date(seq):
-                if ddd == dd and isinstance(row, dict):
-                    _merge_dict(doc, row, prefer_existing=True)
+        for idx in by_date:
+            for row in idx.get(dd, ()):
+                _merge_dict(doc, row, prefer_existing=True)
 
         # Profile (ohne Datum) einmalig
         if isinstance(prof, dict):
             _merge_dict(doc, prof, prefer_existing=True)
 
-        # 1) numerische Roh-Felder in Floats umwandeln
-        _normalize_numeric_fields(doc)
+        docs.append(doc)
 
-        # 2) Historische Kennzahlen wie im Heute-Dokument "anreichern"
-        doc = _enrich_historical_metrics(doc)
+    # Normalisierung, Mapping der Rohfelder, PEG, Turnaround-Kennzahlen und
+    # missing_fields für alle Daten des Symbols spaltenweise (fmp_derive.py)
+    derive_docs(docs)
 
-        # 3) Turnaround-Kennzahlen (cashToDebt, equityRatio, fcfMargin) nachberechnen
-        doc = _compute_derived_turnaround_metrics(doc)
+    return [{
+        "_op_type": "create",                       # nichts überschreiben
+        "_index": ES_INDEX,
+        "_id": f"{symbol}|{doc['date']}|fmp",       # konsistenter ID-Suffix
+        "_source": doc
+    } for doc in docs]
+
+# ===================== Manifest (inkrementeller Backfill) =====================
+def _file_signature(path: Path, prev: Dict[str, Any] = None):
+    """Größe, mtime und SHA-256 einer Datei; der Hash wird nur bei geänderter Größe/mtime neu berechnet."""
+    if not path.exists():
+        return None
+    st = path.stat()
+    if prev and prev.get("size") == st.st_size and prev.get("mtime") == st.st_mtime_ns:
+        return prev
+    h = hashlib.sha256()
+    with path.open("rb") as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b""):
+            h.update(chunk)
+    return {"size": st.st_size, "mtime": st.st_mtime_ns, "sha256": h.hexdigest()}
+
+def _symbol_signature(sym: str, prev_files: Dict[str, Any] = None) -> Dict[str, Any]:
+    prev_files = prev_files or {}
+    return {name: _file_signature(p, prev_files.get(name)) for name, p in _symbol_files(sym, FMP_DIR).items()}
+
+def _same_content(a: Dict[str, Any], b: Dict[str, Any]) -> bool:
+    """Vergleicht zwei Signaturen nur über den Inhalt (mtime allein ist keine Änderung)."""
+    if not a or not b or set(a) != set(b):
+        return False
+    for name in a:
+        x, y = a[name], b[name]
+        if (x is None) != (y is None):
+            return False
+        if x is not None and (x["size"], x["sha256"]) != (y["size"], y["sha256"]):
+            return False
+    return True
 
-        # 4) ggf. neu hinzugekommene Felder nochmal normalisieren
-        _normalize_numeric_fields(doc)
+def _index_uuid(es, name: str) -> str:
+    """UUID(s) der konkreten Indizes hinter name — ändert sich, wenn der Index neu angelegt wird."""
+    try:
+        info = es.indices.get(index=name)
+        return ",".join(sorted(v["settings"]["index"]["uuid"] for v in info.values()))
+    except Exception as e:
+        print(f"⚠️ Index-UUID von '{name}' nicht lesbar ({e}).")
+        return ""
 
+def _new_manifest(index_uuid: str) -> Dict[str, Any]:
+    return {"index": ES_INDEX, "index_uuid": index_uuid, "strict": STRICT_MODE, "symbols": {}}
 
-        miss = build_missing_fields(doc)
-        if miss:
-            doc["missing_fields"] = miss
+def _load_manifest(path: Path, index_uuid: str) -> Dict[str, Any]:
+    """
+    Lädt das Manifest; passt Index, STRICT-Modus oder die Index-UUID nicht (Index gelöscht,
+    neu angelegt oder per reindex_stocks.py umgezogen), wird neu begonnen.
+    """
+    fresh = _new_manifest(index_uuid)
+    if not path.exists():
+        return fresh
+    try:
+        m = json.loads(path.read_text(encoding="utf-8"))
+    except Exception as e:
+        print(f"⚠️ Manifest unlesbar ({e}) — vollständiger Lauf.")
+        return fresh
+    if m.get("index") != ES_INDEX or m.get("strict") != STRICT_MODE:
+        print("ℹ️  Manifest gehört zu anderem Index/STRICT-Modus — vollständiger Lauf.")
+        return fresh
+    if not index_uuid:
+        print("ℹ️  Index-UUID unbekannt — Manifest wird nicht verwendet, vollständiger Lauf.")
+        return fresh
+    if m.get("index_uuid") != index_uuid:
+        print(f"ℹ️  '{ES_INDEX}' wurde seit dem letzten Lauf neu angelegt — Manifest verworfen, vollständiger Lauf.")
+        return fresh
+    m.setdefault("symbols", {})
+    return m
+
+def _save_manifest(path: Path, manifest: Dict[str, Any]):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_text(json.dumps(manifest), encoding="utf-8")
+    tmp.replace(path)  # atomar, ein Abbruch hinterlässt kein halbes Manifest
+
+def _failed_ids(errors: List[Dict[str, Any]]) -> set:
+    """IDs aus den Bulk-Fehlern; 409 (existiert bereits) zählt als geschrieben."""
+    failed = set()
+    for item in errors or []:
+        for res in item.values():
+            if res.get("status") != 409:
+                failed.add(res.get("_id"))
+    return failed
 
+# ===================== Lauf =====================
+def _use_store(store_dir: Path):
+    """Öffnet den Parquet-Store (auch als Initializer der Worker-Prozesse) — nur die Übersicht, keine Zeilen."""
+    global _STORE
+    from fmp_store import FmpStore  # pyarrow nur im Store-Modus nötig
+    _STORE = FmpStore(store_dir)
+    return _STORE
+
+def _process_symbol(sym: str, prev: Dict[str, Any] = None, bundle: Dict[str, Any] = None) -> Dict[str, Any]:
+    """
+    Baut Heute-Dokument + Historie für EIN Symbol.
+    Läuft unverändert sequentiell oder in einem Worker-Prozess; Meldungen werden
+    gesammelt und vom Schreiber ausgegeben.
+    prev: Manifest-Eintrag des letzten Laufs — unveränderte Dateien werden übersprungen,
+    bei geänderten nur noch nicht geschriebene Daten aufgebaut.
+    bundle: bereits geladene Rohdaten (Store-Modus, siehe _process_block), sonst wird gelesen.
+    """
+    actions: List[Dict[str, Any]] = []
+    logs: List[str] = []
+    result = {"symbol": sym, "actions": actions, "logs": logs, "files": None, "unchanged": False}
+    try:
+        prev = prev or {}
+        if _STORE is not None:
+            result["files"] = _STORE.signature(sym)
+        else:
+            result["files"] = _symbol_signature(sym, prev.get("files"))
+        if _same_content(result["files"], prev.get("files")):
+            result["unchanged"] = True
+            return result
+
+        # 0) alle Dateien des Symbols genau einmal lesen (bzw. aus dem Store holen)
+        if bundle is None:
+            bundle = _STORE.bundle(sym) if _STORE is not None else _load_bundle(sym, FMP_DIR)
+
+        # 1) Datei-Vollständigkeit prüfen (STRICT steuert Skip)
+        if not _has_all_required_files(sym, bundle):
+            msg = f"⚠️ {sym}: unvollständige JSON-Dateien"
+            if STRICT_MODE:
+                logs.append(msg + " — wird übersprungen (STRICT).")
+                return result
+            else:
+                logs.append(msg + " — wird dennoch versucht (STRICT=0).")
 
-        actions.append({
-            "_op_type": "create",                       # nichts überschreiben
-            "_index": ES_INDEX,
-            "_id": f"{symbol}|{dd_iso}|fmp",            # konsistenter ID-Suffix
-            "_source": doc
-        })
+        # 2) HEUTE-Dokument
+        metrics = build_metrics_fmp(sym, FMP_DIR, bundle)
+        if not metrics:
+            logs.append(f"⚠️ {sym}: keine Metriken extrahiert — wird übersprungen.")
+            return result
 
-    return actions
+        fehlend = _missing_required_fields(metrics)
+        if STRICT_MODE and fehlend:
+            logs.append(f"⚠️ {sym}: wichtige Kennzahlen fehlen → {', '.join(fehlend)} — wird übersprungen (STRICT).")
+        else:
+            if fehlend:
+                logs.append(f"ℹ️  {sym}: fehlende Kennzahlen (wird dennoch gespeichert) → {', '.join(fehlend)}")
+            doc = build_doc(sym, metrics, fehlend)
+            actions.append(doc)
+            actions.append(latest_action(doc))  # aktueller Stand für das Frontend
+
+        # 3) HISTORIE: nur Daten, die noch nicht in ES liegen (eigene IDs, _op_type=create)
+        hist_actions = build_historical_actions(sym, bundle, skip_ids=set(prev.get("ids", ())))
+        if hist_actions:
+            actions.extend(hist_actions)
+
+    except Exception as e:
+        logs.append(f"[FEHLER] {sym}: {e}")
+        result["files"] = None  # beim nächsten Lauf erneut versuchen
+    finally:
+        bundle = None  # Rohdaten des Symbols freigeben, Speicher bleibt flach
+
+    return result
+
+def _process_block(symbols: List[str], prevs: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Store-Modus: die Symbole einer Row-Group gemeinsam — Signaturen prüfen, dann nur die
+    geänderten Symbole in EINEM gefilterten Read je Dateityp laden.
+    """
+    changed = [s for s in symbols
+               if not _same_content(_STORE.signature(s), (prevs.get(s) or {}).get("files"))]
+    bundles = _STORE.bundles(changed) if changed else {}
+    return [_process_symbol(s, prevs.get(s), bundles.pop(s, None)) for s in symbols]
 
-# ===================== Lauf =====================
-def run(batch_flush: int = 500):
+def _iter_processed(symbols: List[str], manifest: Dict[str, Any], workers: int = 1, store_dir: Path = None) -> Iterable[Dict[str, Any]]:
+    """
+    Liefert die Ergebnisse von _process_symbol.
+    workers > 1: Prozess-Pool mit begrenzter Zahl offener Aufträge, damit sich bei
+    langsamem Elasticsearch keine Ergebnisse im Speicher stauen.
+    store_dir: Aufträge sind Blöcke (_process_block); jeder Worker liest nur die Zeilen
+    seiner Blöcke, nie den ganzen Store.
+    """
+    entries = manifest["symbols"]
+    if store_dir is not None:
+        tasks = [(_process_block, block, {s: entries.get(s) for s in block}) for block in _STORE.blocks(symbols)]
+        window = workers * 2
+    else:
+        tasks = [(_process_symbol, sym, entries.get(sym)) for sym in symbols]
+        window = workers * 4
+    unpack = (lambda res: res) if store_dir is not None else (lambda res: [res])
+
+    if workers <= 1:
+        for fn, arg, prev in tasks:
+            yield from unpack(fn(arg, prev))
+        return
+
+    it = iter(tasks)
+    init = (_use_store, (store_dir,)) if store_dir is not None else (None, ())
+    with ProcessPoolExecutor(max_workers=workers, initializer=init[0], initargs=init[1]) as pool:
+        pending = {pool.submit(*task) for task in islice(it, window)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                yield from unpack(fut.result())
+                nxt = next(it, None)
+                if nxt is not None:
+                    pending.add(pool.submit(*nxt))
+
+def _record_batch(manifest: Dict[str, Any], batch: List[Dict[str, Any]], errors: List[Dict[str, Any]], state: Dict[str, Any]):
+    """
+    Übernimmt nach einem Bulk-Batch die geschriebenen IDs ins Manifest. Die Datei-Signatur
+    eines Symbols wird erst gesetzt, wenn ALLE seine Actions fehlerfrei geschrieben sind.
+    """
+    entries = manifest["symbols"]
+    failed = _failed_ids(errors)
+    for a in batch:
+        sym = action_symbol(a)
+        if a["_id"] in failed:
+            state["failed"].add(sym)
+        elif a.get("_op_type") == "create":
+            entries.setdefault(sym, {}).setdefault("ids", []).append(a["_id"])
+        state["outstanding"][sym] -= 1
+        if state["outstanding"][sym] == 0:
+            del state["outstanding"][sym]
+            files = state["files"].pop(sym, None)
+            if sym not in state["failed"] and files is not None:
+                entries.setdefault(sym, {})["files"] = files
+            state["failed"].discard(sym)
+
+def run(batch_flush: int = 500, workers: int = 1, full: bool = False, store: bool = False):
     print(es_healthcheck(es))
     ensure_index(es, ES_INDEX)
+    ensure_index(es, latest_index(ES_INDEX))
 
-    if not FMP_DIR.exists():
-        raise FileNotFoundError(f"FMP-Datenordner nicht gefunden: {FMP_DIR}")
+    if store:
+        st = _use_store(STORE_DIR)
+        print(f"📦 Lese aus FMP-Store {STORE_DIR} (Stand {st.built_at or 'unbekannt'})")
+        symbols = st.symbols()
+    else:
+        if not FMP_DIR.exists():
+            raise FileNotFoundError(f"FMP-Datenordner nicht gefunden: {FMP_DIR}")
+        symbols = _discover_symbols(FMP_DIR)
 
-    symbols = _discover_symbols(FMP_DIR)
-    random.shuffle(symbols)
+    index_uuid = _index_uuid(es, ES_INDEX)
+    manifest = _new_manifest(index_uuid) if full else _load_manifest(MANIFEST_FILE, index_uuid)
 
-    buffer, written = [], 0
-    for i, sym in enumerate(symbols, 1):
-        try:
-            # 1) Datei-Vollständigkeit prüfen (STRICT steuert Skip)
-            if not _has_all_required_files(sym):
-                msg = f"⚠️ {sym}: unvollständige JSON-Dateien"
-                if STRICT_MODE:
-                    print(msg + " — wird übersprungen (STRICT).")
-                    continue
-                else:
-                    print(msg + " — wird dennoch versucht (STRICT=0).")
-
-            # 2) HEUTE-Dokument
-            metrics = build_metrics_fmp(sym, FMP_DIR)
-            if not metrics:
-                print(f"⚠️ {sym}: keine Metriken extrahiert — wird übersprungen.")
-                continue
-
-            fehlend = _missing_required_fields(metrics)
-            if STRICT_MODE and fehlend:
-                print(f"⚠️ {sym}: wichtige Kennzahlen fehlen → {', '.join(fehlend)} — wird übersprungen (STRICT).")
-            else:
-                if fehlend:
-                    print(f"ℹ️  {sym}: fehlende Kennzahlen (wird dennoch gespeichert) → {', '.join(fehlend)}")
-                buffer.append(build_doc(sym, metrics, fehlend))
-
-            # 3) HISTORIE: alle Jahre aus lokalen JSONs (eigene IDs, _op_type=create)
-            hist_actions = build_historical_actions(sym)
-            if hist_actions:
-                buffer.extend(hist_actions)
-
-            # 4) Bulk flushen
-            if len(buffer) >= batch_flush:
-                helpers.bulk(es, buffer, raise_on_error=False)
-                written += len(buffer)
-                buffer.clear()
-                print(f"[{i}/{len(symbols)}] {written} Dokumente gespeichert...")
+    random.shuffle(symbols)
+    if workers > 1:
+        print(f"⚙️  Parallelmodus: {workers} Worker-Prozesse, ein Schreiber.")
 
-        except Exception as e:
-            print(f"[FEHLER] {sym}: {e}")
+    # Manifest-Buchhaltung: der Schreib-Thread bestätigt Actions, die Hauptschleife meldet Symbole an
+    lock = threading.Lock()
+    state = {"outstanding": {}, "files": {}, "failed": set()}
 
-    if buffer:
-        helpers.bulk(es, buffer, raise_on_error=False)
-        written += len(buffer)
+    def _on_batch(batch, errors):
+        with lock:
+            _record_batch(manifest, batch, errors, state)
 
-    print(f"✅ FMP-Ingest fertig. Gesamt gespeichert: {written} Dokumente in '{ES_INDEX}'.")
+    # Einziger Schreiber: konsumiert die Ergebnisse (sequentiell oder aus den Workern)
+    writer = BulkWriter(es, batch_docs=batch_flush, label="fmp_sp", on_batch=_on_batch)
+    unchanged = 0
+    last_save = time.monotonic()
+    try:
+        for res in _iter_processed(symbols, manifest, workers, STORE_DIR if store else None):
+            sym, actions = res["symbol"], res["actions"]
+            for msg in res["logs"]:
+                print(msg)
+            with lock:
+                if res["unchanged"]:
+                    unchanged += 1
+                    manifest["symbols"].setdefault(sym, {})["files"] = res["files"]
+                    continue
+                if not actions:
+                    if res["files"] is not None:
+                        manifest["symbols"].setdefault(sym, {})["files"] = res["files"]
+                    continue
+                state["outstanding"][sym] = len(actions)
+                state["files"][sym] = res["files"]
+
+            writer.write(actions)
+
+            if time.monotonic() - last_save > 30:
+                with lock:
+                    _save_manifest(MANIFEST_FILE, manifest)
+                last_save = time.monotonic()
+    finally:
+        writer.close()
+        with lock:
+            _save_manifest(MANIFEST_FILE, manifest)
+
+    print(f"ℹ️  {unchanged} Symbole unverändert seit dem letzten Lauf (übersprungen).")
+    hist, latest = writer.index_summary(ES_INDEX), writer.index_summary(latest_index(ES_INDEX))
+    print(f"✅ FMP-Ingest fertig. Gesamt gespeichert: {hist['ok']} Dokumente in '{ES_INDEX}' "
+          f"({hist['conflict']} bereits vorhanden, {hist['rejected'] + hist['mapping_error']} fehlgeschlagen); "
+          f"aktueller Stand: {latest['ok']} in '{latest_index(ES_INDEX)}'.")
 
 if __name__ == "__main__":
-    run()
+    parser = argparse.ArgumentParser(description="Offline-Backfill der lokalen FMP-Dateien nach Elasticsearch.")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("FMP_WORKERS", "1")),
+                        help="Anzahl Worker-Prozesse für den Dokumentaufbau (1 = sequentiell)")
+    parser.add_argument("--full", action="store_true",
+                        help="Manifest ignorieren und alle Symbole neu aufbauen")
+    parser.add_argument("--store", action="store_true",
+                        help="aus dem Parquet-Store (fmp_store.py) statt aus den Einzeldateien lesen")
+    args = parser.parse_args()
+    run(workers=args.workers, full=args.full, store=args.store)
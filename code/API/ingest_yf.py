@@ -1,14 +1,17 @@
 import os
 import json
-import time
 import random
 from datetime import datetime, UTC
 from pathlib import Path
-from typing import Dict, List
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
+from typing import Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlsplit
+import requests
 import yfinance as yf
-from elasticsearch import helpers
 from dotenv import load_dotenv
-from utils import es_client, es_healthcheck, ensure_index
+from utils import es_client, es_healthcheck, ensure_index, BulkWriter, rate_limiter, QuotaExceeded, RunCheckpoint, SnapshotCache, latest_index, latest_action, seed_latest
+from prioritize import prioritize
 
 # === 1️⃣ Setup ===
 BASE_DIR = Path(__file__).resolve().parent
@@ -16,11 +19,28 @@ load_dotenv(BASE_DIR / ".env", override=False)
 load_dotenv(BASE_DIR / ".env.local", override=False)
 
 ES_INDEX = os.getenv("ELASTICSEARCH_INDEX", "stocks")
+YF_WORKERS = int(os.getenv("YF_WORKERS", "4"))   # parallele .info-Abrufe (1 = sequentiell)
 es = es_client()
+LIMITER = rate_limiter("yfinance")  # YFINANCE_CALLS_PER_MINUTE
 
 DATA_DIR = BASE_DIR / "data"
 CACHE_FILE = DATA_DIR / "sp500_symbols.json"
 
+# Umleitung aller Yahoo-Aufrufe (z.B. auf provider_standin.py); yfinance hat die Hosts fest verdrahtet
+YF_BASE = os.getenv("YF_BASE_URL", "").rstrip("/")
+
+
+class _YahooRedirect(requests.Session):
+    """requests-Session, die *.yahoo.com-URLs auf YF_BASE umschreibt (Pfad und Query bleiben)."""
+    def request(self, method, url, *args, **kwargs):
+        parts = urlsplit(url)
+        if parts.hostname and parts.hostname.endswith("yahoo.com"):
+            url = f"{YF_BASE}{parts.path or '/'}" + (f"?{parts.query}" if parts.query else "")
+        return super().request(method, url, *args, **kwargs)
+
+
+YF_SESSION = _YahooRedirect() if YF_BASE else None  # None = yfinance wählt selbst (curl_cffi)
+
 # === 2️⃣ Symbol-Quelle ===
 def load_symbols() -> List[str]:
     DATA_DIR.mkdir(parents=True, exist_ok=True)
@@ -107,8 +127,46 @@ FIELD_MAP = {
 
 # === 4️⃣ Daten laden ===
 def get_metrics(symbol: str) -> Dict:
-    ticker = yf.Ticker(symbol)
-    info = ticker.info
+    LIMITER.acquire()
+    return metrics_from_info(yf.Ticker(symbol, session=YF_SESSION).info)
+
+def _fetch_info(ticker: "yf.Ticker") -> Dict:
+    LIMITER.acquire()
+    return ticker.info
+
+def iter_metrics(symbols: List[str], workers: int = YF_WORKERS) -> Iterator[Tuple[str, Optional[Dict], Optional[Exception]]]:
+    """
+    Lädt .info für alle Symbole über einen begrenzten Thread-Pool.
+    Liefert (Symbol, Metriken, Fehler) in Fertigstellungsreihenfolge; ein Fehler
+    betrifft nur sein Symbol. Höchstens workers * 4 Abrufe sind offen, damit sich bei
+    langsamem Elasticsearch keine fertigen Antworten im Speicher stauen. Wird der
+    Generator vorzeitig geschlossen, werden noch nicht gestartete Abrufe verworfen.
+    """
+    workers = max(1, workers)
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="yf")
+    it = iter(symbols)
+
+    def submit(sym):
+        return pool.submit(_fetch_info, yf.Ticker(sym, session=YF_SESSION))
+
+    try:
+        pending = {submit(sym): sym for sym in islice(it, workers * 4)}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                sym = pending.pop(fut)
+                try:
+                    yield sym, metrics_from_info(fut.result()), None
+                except Exception as e:
+                    yield sym, None, e
+                nxt = next(it, None)
+                if nxt is not None:
+                    pending[submit(nxt)] = nxt
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+def metrics_from_info(info: Dict) -> Dict:
+    """Reine Funktion: yfinance-.info → interne Felder inkl. abgeleiteter Kennzahlen."""
     metrics: Dict[str, float | str] = {}
 
     # Rohfelder mappen
@@ -199,41 +257,56 @@ def build_doc(symbol: str, metrics: Dict) -> Dict:
     }
 
 # === 6️⃣ Pipeline ===
-def run(batch_sleep: float = 2.5):
+def run():
     print(es_healthcheck(es))
     ensure_index(es, ES_INDEX)
+    ensure_index(es, latest_index(ES_INDEX))
+    seed_latest(es, ES_INDEX)
 
     symbols = load_symbols()
     random.shuffle(symbols)
+    symbols = prioritize(es, symbols, ES_INDEX, source="yfinance")  # alt/unvollständig/Earnings zuerst
 
-    docs_buffer = []
-    written = 0
-
-    for i, symbol in enumerate(symbols, 1):
-        try:
-            metrics = get_metrics(symbol)
-            if not metrics:
-                continue
-
-            doc = build_doc(symbol, metrics)
-            docs_buffer.append(doc)
-
-            if len(docs_buffer) >= 25:
-                helpers.bulk(es, docs_buffer)
-                written += len(docs_buffer)
-                docs_buffer.clear()
-                print(f"[{i}/{len(symbols)}] {written} Dokumente gespeichert...")
+    # Checkpoint: nach einem Neustart am selben Tag mit der gleichen Reihenfolge weitermachen
+    ckpt = RunCheckpoint("yfinance", symbols)
+    symbols = ckpt.pending()
 
-        except Exception as e:
-            print(f"[FEHLER] {symbol}: {e}")
+    # unveränderte Kennzahlen nur bestätigen statt als neues Tagesdokument schreiben
+    snaps = SnapshotCache("yfinance", es)
 
-        time.sleep(batch_sleep + random.uniform(0.4, 0.8))
+    def on_batch(actions, errors):
+        ckpt.ack(actions, errors)
+        snaps.ack(actions, errors)
 
-    if docs_buffer:
-        helpers.bulk(es, docs_buffer)
-        written += len(docs_buffer)
+    # Schreiben läuft im Hintergrund – der Abruf wartet nicht auf ES
+    writer = BulkWriter(es, batch_docs=25, label="yfinance", on_batch=on_batch)
+    writer.write(ckpt.buffered_actions())  # vor dem Neustart abgerufen, aber nicht bestätigt
 
-    print(f"✅ Fertig. Gesamt gespeichert: {written} Dokumente.")
+    print(f"Starte yfinance-Ingestion für {len(symbols)} Symbole ({YF_WORKERS} Threads)...")
+    try:
+        for symbol, metrics, err in iter_metrics(symbols):
+            if isinstance(err, QuotaExceeded):
+                print(f"⛔ {err} – breche ab, bisher Geladenes wird gespeichert.")
+                break
+            if err is not None:
+                print(f"[FEHLER] {symbol}: {err}")  # bleibt offen → nächster Start versucht es erneut
+                continue
+            if metrics:
+                doc = build_doc(symbol, metrics)
+                # Historie (nur bei Änderung bzw. fälliger Bestätigung) + aktueller Stand in <ES_INDEX>_latest
+                for action in filter(None, (snaps.dedupe(doc), latest_action(doc))):
+                    ckpt.hold(symbol, action)
+                    writer.add(action)
+            else:
+                ckpt.done(symbol)
+    finally:
+        writer.close()
+        snaps.save()
+        ckpt.finish()
+
+    hist, latest = writer.index_summary(ES_INDEX), writer.index_summary(latest_index(ES_INDEX))
+    print(f"✅ Fertig. Gesamt gespeichert: {hist['ok']} Dokumente in '{ES_INDEX}' ({hist['failed']} nicht geschrieben); "
+          f"aktueller Stand: {latest['ok']} in '{latest_index(ES_INDEX)}' ({latest['failed']} nicht geschrieben).")
 
 # === 7️⃣ Einstiegspunkt ===
 if __name__ == "__main__":
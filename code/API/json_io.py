@@ -0,0 +1,197 @@
+# code/API/json_io.py
+"""
+Gemeinsames Einlesen der lokalen Provider-Dateien (FMP-JSON, vereinzelt NDJSON).
+
+- orjson, falls installiert (sonst json aus der Standardbibliothek)
+- große Dateien per mmap, ohne den Inhalt erst komplett in einen str zu kopieren
+- NDJSON wird zeilenweise gelesen, der Gesamttext wird nie aufgebaut
+- das Format (json/ndjson) wird je Pfad einmal erkannt und gemerkt
+
+Ergebnisse wie bisher: read_text(errors="ignore").strip() → json.loads,
+bei Fehlern zeilenweise (ungültige Zeilen werden übersprungen).
+"""
+import os
+import json
+import mmap
+from pathlib import Path
+from typing import Any, Dict, Iterator, NamedTuple, Tuple
+
+try:
+    import orjson  # optional, deutlich schneller bei großen Dateien
+except ImportError:
+    orjson = None
+
+MMAP_MIN_BYTES = int(os.getenv("JSON_MMAP_MIN_BYTES", str(1 << 20)))  # ab 1 MB per mmap
+FORMAT_JSON, FORMAT_NDJSON = "json", "ndjson"
+_WS = b" \t\n\r\x0b\x0c"
+
+# Pfad → (Größe, mtime_ns, Format); gilt nur, solange sich die Datei nicht ändert
+_formats: Dict[str, Tuple[int, int, str]] = {}
+
+
+class Decoded(NamedTuple):
+    data: Any          # geparster Inhalt (None bei fehlend/leer/unlesbar)
+    has_content: bool  # gültiges JSON, >= 10 Bytes, nicht "[]"/"{}"
+    valid: bool        # Datei ist als Ganzes gültiges JSON
+
+
+EMPTY = Decoded(None, False, False)
+_FAILED, _BLANK = object(), object()
+# orjson (3.8) liest Ganzzahlen jenseits 64 Bit als float statt int → dann json nehmen
+_DIGITS = bytes.maketrans(b"0123456789", b"0" * 10)
+_LONG_RUN = b"0" * 19
+
+
+# ===================== Parser =====================
+def _has_long_number(buf, chunk: int = 1 << 22) -> bool:
+    """Gibt es eine Ziffernfolge mit >= 19 Stellen? (blockweise, eine mmap wird nie komplett kopiert)"""
+    for start in range(0, len(buf), chunk):
+        if _LONG_RUN in bytes(buf[max(start - 18, 0):start + chunk]).translate(_DIGITS):
+            return True
+    return False
+
+
+def _loads(buf) -> Any:
+    """orjson zuerst; was orjson ablehnt (NaN, sehr große Ganzzahlen, ...) nochmal mit json."""
+    if orjson is not None and not _has_long_number(buf):
+        try:
+            return orjson.loads(buf)
+        except orjson.JSONDecodeError:
+            pass
+    # strikt dekodieren: json.loads(bytes) würde sonst z.B. ein BOM stillschweigend akzeptieren
+    return json.loads(bytes(buf).decode("utf-8"))
+
+
+def _bounds(buf) -> Tuple[int, int]:
+    """Start/Ende ohne ASCII-Whitespace am Rand."""
+    i, j = 0, len(buf)
+    while i < j and buf[i] in _WS:
+        i += 1
+    while j > i and buf[j - 1] in _WS:
+        j -= 1
+    return i, j
+
+
+def iter_ndjson(buf) -> Iterator[Any]:
+    """NDJSON zeilenweise aus bytes/mmap; ungültige Zeilen werden übersprungen."""
+    start, n = 0, len(buf)
+    while start < n:
+        end = buf.find(b"\n", start)
+        if end < 0:
+            end = n
+        raw = buf[start:end]
+        start = end + 1
+        # reine ASCII-Zeile ohne \r: splitlines würde nichts weiter trennen → direkt parsen
+        if orjson is not None and raw.isascii() and b"\r" not in raw and _LONG_RUN not in raw.translate(_DIGITS):
+            try:
+                yield orjson.loads(raw)
+                continue
+            except orjson.JSONDecodeError:
+                pass
+        # sonst wie auf dem Gesamttext: splitlines trennt auch bei \r, \x1c, \u2028, ...
+        for ln in raw.decode("utf-8", errors="ignore").splitlines():
+            ln = ln.strip()
+            if not ln: continue
+            try: yield json.loads(ln)
+            except: pass
+
+
+def _slow_json(buf) -> Any:
+    """Bisheriger Weg über den Text — nur für Sonderfälle (BOM, Unicode-Whitespace, ungültiges UTF-8)."""
+    txt = bytes(buf).decode("utf-8", errors="ignore").strip()
+    if not txt:
+        return _BLANK
+    try:
+        return json.loads(txt)
+    except Exception:
+        return _FAILED
+
+
+def _looks_ndjson(buf, i: int, j: int, max_lines: int = 8) -> bool:
+    """
+    Erste Zeile ist ein vollständiges Objekt und in einer der folgenden Zeilen steht
+    noch etwas → als Ganzes kein gültiges JSON, also direkt zeilenweise lesen.
+    """
+    if buf[i] != ord("{"):
+        return False
+    nl = buf.find(b"\n", i, j)
+    if nl < 0:
+        return False
+    try:
+        with memoryview(buf) as mv:
+            _loads(mv[i:nl])
+    except Exception:
+        return False
+    for _ in range(max_lines):
+        start, nl = nl + 1, buf.find(b"\n", nl + 1, j)
+        line = buf[start:nl if nl >= 0 else j]
+        if line.decode("utf-8", errors="ignore").strip():
+            return True
+        if nl < 0:
+            return False
+    return False  # unklar → normal parsen, Fallback greift trotzdem
+
+
+def parse_bytes(buf, fmt: str = None) -> Tuple[Decoded, str]:
+    """
+    Dekodiert einen Dateiinhalt (bytes oder mmap).
+    fmt: bereits bekanntes Format oder None (dann wird es erkannt).
+    Rückgabe: (Decoded, Format)
+    """
+    i, j = _bounds(buf)
+    if i == j:
+        return EMPTY, fmt or FORMAT_JSON
+    if fmt is None and _looks_ndjson(buf, i, j):
+        fmt = FORMAT_NDJSON
+
+    if fmt != FORMAT_NDJSON:
+        try:
+            with memoryview(buf) as mv:
+                data = _loads(mv[i:j])
+        except Exception:
+            data = _slow_json(buf)
+            if data is _BLANK:
+                return EMPTY, FORMAT_JSON
+        else:
+            empty = j - i == 2 and buf[i:j] in (b"[]", b"{}")
+            return Decoded(data, len(buf) >= 10 and not empty, True), FORMAT_JSON
+        if data is not _FAILED:
+            txt = bytes(buf).decode("utf-8", errors="ignore").strip()
+            return Decoded(data, len(buf) >= 10 and txt not in ("[]", "{}"), True), FORMAT_JSON
+
+    return Decoded(list(iter_ndjson(buf)) or None, False, False), FORMAT_NDJSON
+
+
+# ===================== Dateien =====================
+def load(path: Path) -> Decoded:
+    """Liest eine Datei genau einmal; große Dateien per mmap, Format wird je Pfad gemerkt."""
+    path = Path(path)
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return EMPTY
+    if st.st_size == 0:
+        return EMPTY
+
+    key = str(path)
+    cached = _formats.get(key)
+    fmt = cached[2] if cached and cached[:2] == (st.st_size, st.st_mtime_ns) else None
+
+    if st.st_size >= MMAP_MIN_BYTES:
+        with path.open("rb") as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            res, fmt = parse_bytes(mm, fmt)
+    else:
+        res, fmt = parse_bytes(path.read_bytes(), fmt)
+    _formats[key] = (st.st_size, st.st_mtime_ns, fmt)
+    return res
+
+
+def load_data(path: Path) -> Any:
+    """Daten wie bisher _read_json im Backfill (None bei fehlend/leer)."""
+    return load(path).data
+
+
+def load_strict(path: Path) -> Any:
+    """Nur gültiges JSON (wie _read_json im Audit), sonst []."""
+    res = load(path)
+    return res.data if res.valid else []
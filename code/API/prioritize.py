@@ -0,0 +1,169 @@
+# code/API/prioritize.py
+"""
+Reihenfolge der Symbole für die Live-Ingestoren: wichtigste zuerst, damit ein durch
+die Tagesquote abgebrochener Lauf trotzdem die nützlichsten Daten geliefert hat.
+
+Punkte je Symbol:
+- Alter des letzten Snapshots dieser Quelle in ES (ingested_at / last_confirmed, auch aus
+  <index>_latest – unveränderte Symbole werden im Verlauf nur selten bestätigt), gedeckelt auf PRIORITY_MAX_AGE_DAYS; noch nie geladen = maximales Alter
+- Anzahl missing_fields im jüngsten Dokument des Symbols (egal welche Quelle)
+- Earnings: in den letzten PRIORITY_EARNINGS_DAYS Tagen berichtet und seitdem nicht
+  geladen → großer Bonus (optionale Datei data/earnings_calendar.csv|.json)
+
+Bei Gleichstand bleibt die Eingangsreihenfolge erhalten (also weiterhin gemischt).
+Ist ES nicht erreichbar, bleibt die Reihenfolge unverändert.
+
+    symbols = prioritize(es, symbols, index=ES_INDEX, source="yfinance")
+"""
+import os
+import csv
+import json
+from datetime import date, datetime, timedelta, UTC
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from utils import is_latest_index, keyword_field, latest_index, log
+
+DATA_DIR = Path(__file__).resolve().parent / "data"
+EARNINGS_FILE = Path(os.getenv("EARNINGS_CALENDAR", str(DATA_DIR / "earnings_calendar.csv")))
+
+MAX_AGE_DAYS = float(os.getenv("PRIORITY_MAX_AGE_DAYS", "30"))
+EARNINGS_DAYS = int(os.getenv("PRIORITY_EARNINGS_DAYS", "3"))
+WEIGHT_AGE = float(os.getenv("PRIORITY_WEIGHT_AGE", "1.0"))          # Punkte je Tag Alter
+WEIGHT_MISSING = float(os.getenv("PRIORITY_WEIGHT_MISSING", "2.0"))  # Punkte je fehlendem Feld
+EARNINGS_BONUS = float(os.getenv("PRIORITY_EARNINGS_BONUS", "100"))
+
+
+# === 1️⃣ Eingaben ===
+
+def _parse_ts(value: Any) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        ts = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return ts if ts.tzinfo else ts.replace(tzinfo=UTC)
+
+
+def snapshot_status(es, index: str, symbols: List[str], source: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Je Symbol: {"last_seen": datetime | None, "missing": int} aus EINER Aggregation.
+    last_seen bezieht sich auf die angegebene Quelle, missing auf das jüngste Dokument.
+    """
+    sym_field = keyword_field(es, index, "symbol")
+    seen_aggs = {
+        "ingested": {"max": {"field": "ingested_at"}},
+        "confirmed": {"max": {"field": "last_confirmed"}},
+    }
+    if source:
+        seen = {"filter": {"term": {keyword_field(es, index, "source"): source}}, "aggs": seen_aggs}
+    else:
+        seen = {"filter": {"match_all": {}}, "aggs": seen_aggs}
+    body = {
+        "size": 0,
+        "query": {"terms": {sym_field: symbols}},
+        "aggs": {
+            "by_symbol": {
+                "terms": {"field": sym_field, "size": max(1, len(symbols))},
+                "aggs": {
+                    "seen": seen,
+                    "latest": {"top_hits": {"size": 1, "sort": [{"date": {"order": "desc"}}],
+                                            "_source": ["missing_fields"]}},
+                },
+            }
+        },
+    }
+    resp = es.search(index=index, body=body)
+    out = {}
+    for b in resp["aggregations"]["by_symbol"]["buckets"]:
+        seen_b = b["seen"]
+        stamps = [_parse_ts(seen_b[k].get("value_as_string")) for k in ("ingested", "confirmed")]
+        hits = b["latest"]["hits"]["hits"]
+        missing = (hits[0].get("_source") or {}).get("missing_fields") if hits else None
+        out[b["key"]] = {
+            "last_seen": max((s for s in stamps if s), default=None),
+            "missing": len(missing) if isinstance(missing, list) else 0,
+        }
+    return out
+
+
+def load_earnings_calendar(path: Path = EARNINGS_FILE) -> Dict[str, List[date]]:
+    """
+    Symbol → Berichtstermine. CSV wie Alpha Vantage EARNINGS_CALENDAR (symbol, reportDate)
+    oder JSON-Liste wie FMP earning_calendar ([{"symbol", "date"}]). Fehlt die Datei: {}.
+    """
+    path = Path(path)
+    if not path.exists():
+        json_path = path.with_suffix(".json")
+        if not json_path.exists():
+            return {}
+        path = json_path
+    try:
+        if path.suffix == ".json":
+            rows = json.loads(path.read_text(encoding="utf-8"))
+        else:
+            with path.open(newline="", encoding="utf-8") as fh:
+                rows = list(csv.DictReader(fh))
+    except Exception as e:
+        log(f"⚠️ Earnings-Kalender {path.name} unlesbar: {e}")
+        return {}
+    cal: Dict[str, List[date]] = {}
+    for row in rows if isinstance(rows, list) else []:
+        sym = str(row.get("symbol") or "").strip().upper()
+        raw = row.get("reportDate") or row.get("date")
+        try:
+            day = date.fromisoformat(str(raw)[:10])
+        except ValueError:
+            continue
+        if sym:
+            cal.setdefault(sym, []).append(day)
+    return cal
+
+
+# === 2️⃣ Bewertung ===
+
+def _recent_earnings(reports: List[date], last_seen: Optional[datetime], today: date) -> bool:
+    """Bericht in den letzten EARNINGS_DAYS Tagen, der noch nicht geladen wurde."""
+    return any(
+        today - timedelta(days=EARNINGS_DAYS) <= day <= today and (last_seen is None or last_seen.date() <= day)
+        for day in reports
+    )
+
+
+def priority_score(status: Optional[Dict[str, Any]], reports: List[date], now: datetime) -> float:
+    last_seen = status.get("last_seen") if status else None
+    age = MAX_AGE_DAYS if last_seen is None else min(MAX_AGE_DAYS, (now - last_seen).total_seconds() / 86400)
+    score = WEIGHT_AGE * max(0.0, age) + WEIGHT_MISSING * (status.get("missing", 0) if status else 0)
+    if _recent_earnings(reports, last_seen, now.date()):
+        score += EARNINGS_BONUS
+    return score
+
+
+def prioritize(es, symbols: List[str], index: str, source: Optional[str] = None,
+               calendar: Optional[Dict[str, List[date]]] = None) -> List[str]:
+    """Symbole nach Priorität absteigend; Gleichstand behält die Eingangsreihenfolge."""
+    if not symbols:
+        return symbols
+    try:
+        status = snapshot_status(es, index, symbols, source)
+    except Exception as e:
+        log(f"⚠️ Priorisierung ohne ES-Stand ({e}) – Reihenfolge bleibt.")
+        return symbols
+    latest = latest_index(index)
+    try:
+        if not is_latest_index(index) and es.indices.exists(index=latest):
+            for sym, cur in snapshot_status(es, latest, symbols, source).items():
+                prev = status.setdefault(sym, {"last_seen": None, "missing": cur["missing"]})
+                prev["last_seen"] = max((s for s in (prev["last_seen"], cur["last_seen"]) if s), default=None)
+    except Exception as e:
+        log(f"⚠️ {latest} für die Priorisierung nicht lesbar ({e}) – nur Verlauf.")
+    calendar = load_earnings_calendar() if calendar is None else calendar
+    now = datetime.now(UTC)
+    scores = {s: priority_score(status.get(s), calendar.get(s.upper(), []), now) for s in symbols}
+    ordered = sorted(symbols, key=lambda s: -scores[s])  # sorted ist stabil
+    earnings = sum(1 for s in symbols if _recent_earnings(calendar.get(s.upper(), []),
+                                                       (status.get(s) or {}).get("last_seen"), now.date()))
+    log(f"Priorisierung ({source or 'alle Quellen'}): {len(status)}/{len(symbols)} mit Snapshot, "
+        f"{earnings} nach Earnings, vorne: {', '.join(ordered[:5])}")
+    return ordered
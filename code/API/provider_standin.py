@@ -0,0 +1,372 @@
+# code/API/provider_standin.py
+"""
+Lokaler Stand-in für FMP, Alpha Vantage und Yahoo – für Durchsatz-, Parallelitäts- und
+Rate-Limit-Tests ohne echte APIs (und ohne Quote zu verbrauchen).
+
+Bedient genau die Endpunkte, die die Ingestoren aufrufen:
+- FMP:   /fmp/api/v3/quote/<SYM,SYM,...>, /fmp/api/v3/etf-holdings/SPY
+- AV:    /av/query?function=OVERVIEW|INCOME_STATEMENT|BALANCE_SHEET|CASH_FLOW|EARNINGS&symbol=...
+- Yahoo: /yahoo/... (Cookie, getcrumb, v10 quoteSummary, v7 quote, fundamentals-timeseries –
+         das, was Ticker.info abruft)
+
+Antworten kommen aus aufgezeichneten Fixtures (--fixtures), sonst synthetisch und je
+Symbol deterministisch. Fixture-Layout (.json oder .json.gz):
+    <dir>/fmp/quote/<SYM>.json           ein Quote-Objekt
+    <dir>/av/<FUNCTION>/<SYM>.json       rohe AV-Antwort; Einträge des AV-Caches (data/av_cache,
+                                         {"fetched_at", "quarter", "data"}) werden ausgepackt,
+                                         <dir>/av kann also direkt auf den Cache zeigen
+    <dir>/yahoo/quoteSummary/<SYM>.json  komplette quoteSummary-Antwort
+
+Verhalten: Latenz (+ Jitter), Fehlerquote (HTTP 500), zufällige 429 und ein Limit je
+Provider und Minute (FMP/Yahoo: 429, AV wie im Original: 200 mit "Information").
+
+    python provider_standin.py --port 8765 --latency 0.08 --error-rate 0.01 --av-per-minute 75
+
+Ingestoren darauf umbiegen:
+    FMP_BASE_URL=http://localhost:8765/fmp/api/v3
+    AV_BASE_URL=http://localhost:8765/av/query
+    YF_BASE_URL=http://localhost:8765/yahoo
+Zähler je Provider/Status: GET /_stats
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs, unquote, urlsplit
+
+SYMBOLS_FILE = Path(__file__).resolve().parent / "data" / "sp500_symbols.json"
+SECTORS = ["Technology", "Healthcare", "Financial Services", "Industrials", "Energy",
+           "Consumer Cyclical", "Consumer Defensive", "Utilities", "Basic Materials"]
+
+
+# === 1️⃣ Synthetische Antworten (je Symbol deterministisch) ===
+
+def _rng(*key) -> random.Random:
+    return random.Random(hashlib.sha1("|".join(map(str, key)).encode()).hexdigest())
+
+
+def _company(symbol: str) -> Dict[str, float]:
+    r = _rng("company", symbol)
+    revenue = r.uniform(2e9, 4e11)
+    shares = r.uniform(1e8, 1.6e10)
+    price = r.uniform(15, 900)
+    eps = revenue * r.uniform(0.03, 0.25) / shares
+    return {
+        "price": price, "shares": shares, "revenue": revenue, "eps": eps,
+        "assets": revenue * r.uniform(0.8, 3.0), "equity_ratio": r.uniform(0.15, 0.7),
+        "cash": revenue * r.uniform(0.03, 0.4), "debt": revenue * r.uniform(0.05, 1.2),
+        "fcf": revenue * r.uniform(-0.02, 0.3), "growth": r.uniform(-0.1, 0.35),
+        "dividend": price * r.choice([0, 0, r.uniform(0.005, 0.05)]), "beta": r.uniform(0.4, 2.0),
+        "sector": r.choice(SECTORS),
+    }
+
+
+def fmp_quote(symbol: str) -> Dict[str, Any]:
+    c = _company(symbol)
+    return {
+        "symbol": symbol, "name": f"{symbol} Inc.", "price": round(c["price"], 2),
+        "eps": round(c["eps"], 2), "pe": round(c["price"] / c["eps"], 2) if c["eps"] > 0 else None,
+        "marketCap": round(c["price"] * c["shares"]), "sharesOutstanding": round(c["shares"]),
+        "priceToBookRatio": round(c["price"] * c["shares"] / (c["assets"] * c["equity_ratio"]), 2),
+        "bookValue": round(c["assets"] * c["equity_ratio"] / c["shares"], 2),
+        "dividendYield": round(c["dividend"] / c["price"], 4), "exchange": "NASDAQ",
+        "timestamp": int(time.time()),
+    }
+
+
+def _quarters(n: int = 8) -> List[str]:
+    """Letzte n Quartalsenden (neueste zuerst)."""
+    y, q = time.gmtime().tm_year, (time.gmtime().tm_mon - 1) // 3  # abgeschlossene Quartale
+    out = []
+    for _ in range(n):
+        if q == 0:
+            y, q = y - 1, 4
+        out.append(f"{y}-{q * 3:02d}-{30 if q in (2, 3) else 31}")
+        q -= 1
+    return out
+
+
+def av_response(function: str, symbol: str) -> Dict[str, Any]:
+    c = _company(symbol)
+    quarters = _quarters()
+    s = lambda v: str(round(v))  # AV liefert Zahlen als Strings
+    if function == "OVERVIEW":
+        return {
+            "Symbol": symbol, "Name": f"{symbol} Inc.", "Sector": c["sector"].upper(), "Industry": "SYNTHETIC",
+            "LatestQuarter": quarters[0], "MarketCapitalization": s(c["price"] * c["shares"]),
+            "PERatio": f"{c['price'] / c['eps']:.2f}" if c["eps"] > 0 else "None",
+            "PEGRatio": f"{c['price'] / c['eps'] / max(c['growth'] * 100, 1):.2f}" if c["eps"] > 0 else "None",
+            "PriceToBookRatio": f"{c['price'] * c['shares'] / (c['assets'] * c['equity_ratio']):.2f}",
+            "DividendPerShare": f"{c['dividend']:.2f}", "DividendYield": f"{c['dividend'] / c['price']:.4f}",
+            "PayoutRatio": f"{c['dividend'] / c['eps']:.3f}" if c["eps"] > 0 else "0",
+            "Beta": f"{c['beta']:.3f}", "SharesOutstanding": s(c["shares"]), "EPS": f"{c['eps']:.2f}",
+        }
+    if function == "EARNINGS":
+        r = _rng("eps", symbol)
+        qe = [{"fiscalDateEnding": d, "reportedEPS": f"{c['eps'] / 4 * (1 - c['growth'] * i / 4) * r.uniform(0.9, 1.1):.2f}"}
+              for i, d in enumerate(quarters)]
+        return {"symbol": symbol, "quarterlyEarnings": qe,
+                "annualEarnings": [{"fiscalDateEnding": f"{int(quarters[0][:4]) - i}-12-31",
+                                    "reportedEPS": f"{c['eps'] * (1 - c['growth'] * i):.2f}"} for i in range(3)]}
+    reports = []
+    for i, d in enumerate(quarters):
+        k = (1 - c["growth"] * i / 4) / 4
+        if function == "INCOME_STATEMENT":
+            rep = {"totalRevenue": s(c["revenue"] * k), "netIncome": s(c["eps"] * c["shares"] * k),
+                   "sellingGeneralAndAdministrative": s(c["revenue"] * k * 0.12)}
+        elif function == "BALANCE_SHEET":
+            assets = c["assets"] * (1 - c["growth"] * i / 8)
+            rep = {"totalAssets": s(assets), "totalCurrentAssets": s(assets * 0.35),
+                   "totalCurrentLiabilities": s(assets * 0.22), "inventory": s(assets * 0.05),
+                   "totalShareholderEquity": s(assets * c["equity_ratio"]),
+                   "cashAndCashEquivalentsAtCarryingValue": s(c["cash"]),
+                   "shortTermDebt": s(c["debt"] * 0.2), "longTermDebt": s(c["debt"] * 0.8),
+                   "shortLongTermDebtTotal": s(c["debt"])}
+        elif function == "CASH_FLOW":
+            rep = {"operatingCashflow": s((c["fcf"] + c["revenue"] * 0.05) * k),
+                   "capitalExpenditures": s(c["revenue"] * 0.05 * k), "netIncome": s(c["eps"] * c["shares"] * k)}
+        else:
+            return {"Error Message": f"Invalid API call: unknown function {function}"}
+        reports.append({"fiscalDateEnding": d, "reportedCurrency": "USD", **rep})
+    return {"symbol": symbol, "annualReports": [], "quarterlyReports": reports}
+
+
+def yahoo_quote_summary(symbol: str) -> Dict[str, Any]:
+    c = _company(symbol)
+    raw = lambda v: {"raw": v, "fmt": f"{v:.2f}"}
+    mcap = c["price"] * c["shares"]
+    book = c["assets"] * c["equity_ratio"] / c["shares"]
+    result = {
+        "quoteType": {"symbol": symbol, "quoteType": "EQUITY", "shortName": f"{symbol} Inc."},
+        "assetProfile": {"sector": c["sector"], "industry": "Synthetic", "maxAge": 86400},
+        "summaryDetail": {
+            "trailingPE": raw(c["price"] / c["eps"]) if c["eps"] > 0 else {}, "marketCap": raw(mcap),
+            "dividendYield": raw(c["dividend"] / c["price"]), "beta": raw(c["beta"]),
+            "payoutRatio": raw(c["dividend"] / c["eps"] if c["eps"] > 0 else 0.0),
+            "trailingAnnualDividendRate": raw(c["dividend"]), "maxAge": 1,
+        },
+        "defaultKeyStatistics": {
+            "priceToBook": raw(c["price"] / book), "bookValue": raw(book), "trailingEps": raw(c["eps"]),
+            "sharesOutstanding": raw(c["shares"]), "pegRatio": raw(1 + c["growth"]),
+        },
+        "financialData": {
+            "currentPrice": raw(c["price"]), "totalCash": raw(c["cash"]), "totalDebt": raw(c["debt"]),
+            "totalRevenue": raw(c["revenue"]), "freeCashflow": raw(c["fcf"]), "revenueGrowth": raw(c["growth"]),
+            "earningsGrowth": raw(c["growth"] * 1.3), "profitMargins": raw(c["eps"] * c["shares"] / c["revenue"]),
+            "debtToEquity": raw(100 * c["debt"] / (c["assets"] * c["equity_ratio"])),
+            "quickRatio": raw(1.1), "currentRatio": raw(1.6), "totalCashPerShare": raw(c["cash"] / c["shares"]),
+        },
+    }
+    return {"quoteSummary": {"result": [result], "error": None}}
+
+
+def yahoo_quote(symbols: List[str]) -> Dict[str, Any]:
+    rows = []
+    for sym in symbols:
+        c = _company(sym)
+        rows.append({"symbol": sym, "quoteType": "EQUITY", "regularMarketPrice": c["price"],
+                     "marketCap": c["price"] * c["shares"], "currency": "USD"})
+    return {"quoteResponse": {"result": rows, "error": None}}
+
+
+# === 2️⃣ Fixtures ===
+
+class Fixtures:
+    def __init__(self, root: Optional[Path]):
+        self.root = Path(root) if root else None
+
+    def get(self, *parts: str) -> Optional[Any]:
+        """Fixture als JSON; Cache-Hüllen ({"fetched_at", "data", ...}) liefern nur data."""
+        if self.root is None:
+            return None
+        base = self.root.joinpath(*parts)
+        for path, opener in ((base.with_name(base.name + ".json"), open),
+                             (base.with_name(base.name + ".json.gz"), gzip.open)):
+            if path.exists():
+                with opener(path, "rt", encoding="utf-8") as fh:
+                    entry = json.load(fh)
+                if isinstance(entry, dict) and "fetched_at" in entry and "data" in entry:
+                    return entry["data"]
+                return entry
+        return None
+
+
+# === 3️⃣ Verhalten: Latenz, Fehler, Limits ===
+
+class Behaviour:
+    def __init__(self, latency: float, jitter: float, error_rate: float, rate_429: float,
+                 per_minute: Dict[str, int], seed: Optional[int] = None):
+        self.latency, self.jitter = latency, jitter
+        self.error_rate, self.rate_429 = error_rate, rate_429
+        self.per_minute = per_minute
+        self.rand = random.Random(seed)
+        self._windows: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+        self.stats: Dict[str, Dict[str, int]] = {}
+
+    def count(self, provider: str, status: Any):
+        with self._lock:
+            d = self.stats.setdefault(provider, {})
+            d[str(status)] = d.get(str(status), 0) + 1
+
+    def delay(self):
+        with self._lock:
+            d = self.latency + self.rand.uniform(-self.jitter, self.jitter)
+        time.sleep(max(0.0, d))
+
+    def verdict(self, provider: str) -> Optional[str]:
+        """None = normal antworten, sonst "limit", "429" oder "500"."""
+        with self._lock:
+            limit = self.per_minute.get(provider)
+            if limit:
+                now = time.monotonic()
+                win = [t for t in self._windows.get(provider, []) if now - t < 60]
+                if len(win) >= limit:
+                    self._windows[provider] = win
+                    return "limit"
+                win.append(now)
+                self._windows[provider] = win
+            x = self.rand.random()
+        if x < self.error_rate:
+            return "500"
+        if x < self.error_rate + self.rate_429:
+            return "429"
+        return None
+
+
+# === 4️⃣ HTTP ===
+
+def make_handler(fixtures: Fixtures, behaviour: Behaviour, symbols: List[str]):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True  # Header und Body getrennt geschrieben → sonst ~40ms Delayed-ACK je Antwort
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, provider: str, status: int, body: Any, content_type: str = "application/json", headers=None):
+            data = body if isinstance(body, bytes) else (
+                body.encode() if isinstance(body, str) else json.dumps(body).encode())
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(data)
+            behaviour.count(provider, status)
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            query = {k: v[0] for k, v in parse_qs(url.query).items()}
+            provider = url.path.strip("/").split("/", 1)[0]
+            if provider == "_stats":
+                return self._send("_stats", 200, behaviour.stats)
+            if provider not in ("fmp", "av", "yahoo"):
+                return self._send("unknown", 404, {"error": f"unbekannter Pfad {url.path}"})
+
+            behaviour.delay()
+            verdict = behaviour.verdict(provider)
+            if verdict == "500":
+                return self._send(provider, 500, {"error": "stand-in: simulierter Serverfehler"})
+            if verdict in ("429", "limit"):
+                if provider == "av" and verdict == "limit":
+                    # Original-Verhalten: HTTP 200 mit Hinweis statt Daten
+                    return self._send(provider, 200, {"Information": "stand-in: rate limit (requests per minute) reached"})
+                return self._send(provider, 429, "Too Many Requests", "text/plain", {"Retry-After": "1"})
+
+            path = unquote(url.path)
+            try:
+                if provider == "fmp":
+                    return self._fmp(path, query)
+                if provider == "av":
+                    return self._av(query)
+                return self._yahoo(path, query)
+            except Exception as e:  # Stand-in soll nie hängen bleiben
+                return self._send(provider, 500, {"error": f"stand-in: {e}"})
+
+        def _fmp(self, path: str, query: Dict[str, str]):
+            if "/quote/" in path:
+                syms = [s for s in path.rsplit("/", 1)[-1].split(",") if s]
+                rows = [fixtures.get("fmp", "quote", s) or fmp_quote(s) for s in syms]
+                return self._send("fmp", 200, rows)
+            if "/etf-holdings/" in path:
+                return self._send("fmp", 200, {"symbol": path.rsplit("/", 1)[-1],
+                                               "holdings": [{"asset": s} for s in symbols]})
+            return self._send("fmp", 404, {"Error Message": f"stand-in: {path} nicht nachgebildet"})
+
+        def _av(self, query: Dict[str, str]):
+            function, symbol = query.get("function", ""), query.get("symbol", "")
+            if not symbol:
+                return self._send("av", 200, {"Error Message": "Invalid API call: symbol missing"})
+            data = fixtures.get("av", function, symbol) or av_response(function, symbol)
+            return self._send("av", 200, data)
+
+        def _yahoo(self, path: str, query: Dict[str, str]):
+            if path.rstrip("/") in ("/yahoo", "/yahoo/consent"):
+                return self._send("yahoo", 200, "<html>ok</html>", "text/html",
+                                  {"Set-Cookie": "A3=d=standin; Path=/; Max-Age=31536000"})
+            if path.endswith("/v1/test/getcrumb"):
+                return self._send("yahoo", 200, "standin-crumb", "text/plain")
+            if "/v10/finance/quoteSummary/" in path:
+                symbol = path.rsplit("/", 1)[-1]
+                data = fixtures.get("yahoo", "quoteSummary", symbol) or yahoo_quote_summary(symbol)
+                return self._send("yahoo", 200, data)
+            if "/ws/fundamentals-timeseries/" in path:  # .info ergänzt daraus trailingPegRatio
+                symbol = path.rsplit("/", 1)[-1]
+                peg = {"asOfDate": time.strftime("%Y-%m-%d"), "reportedValue": {"raw": round(1 + _company(symbol)["growth"], 3)}}
+                return self._send("yahoo", 200, {"timeseries": {"result": [
+                    {"meta": {"symbol": [symbol], "type": ["trailingPegRatio"]}, "trailingPegRatio": [peg]}], "error": None}})
+            if path.endswith("/v7/finance/quote"):
+                return self._send("yahoo", 200, yahoo_quote([s for s in query.get("symbols", "").split(",") if s]))
+            return self._send("yahoo", 404, {"finance": {"error": {"code": "Not Found", "description": path}}})
+
+    return Handler
+
+
+def _load_symbols() -> List[str]:
+    try:
+        return json.loads(SYMBOLS_FILE.read_text())
+    except Exception:
+        return [f"SYN{i:03d}" for i in range(500)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lokaler Stand-in für FMP, Alpha Vantage und Yahoo.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.05, help="Sekunden je Antwort")
+    parser.add_argument("--jitter", type=float, default=0.02, help="± Sekunden um die Latenz")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Anteil HTTP 500")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Anteil zufälliger HTTP 429")
+    parser.add_argument("--fmp-per-minute", type=int, default=0, help="Requests/Minute, danach 429 (0 = unbegrenzt)")
+    parser.add_argument("--av-per-minute", type=int, default=0, help="Requests/Minute, danach 'Information'")
+    parser.add_argument("--yahoo-per-minute", type=int, default=0, help="Requests/Minute, danach 429")
+    parser.add_argument("--fixtures", type=Path, help="Verzeichnis mit aufgezeichneten Antworten")
+    parser.add_argument("--seed", type=int, help="Zufallsstartwert für Fehler/Jitter")
+    args = parser.parse_args()
+
+    behaviour = Behaviour(
+        args.latency, args.jitter, args.error_rate, args.rate_429,
+        {"fmp": args.fmp_per_minute, "av": args.av_per_minute, "yahoo": args.yahoo_per_minute}, args.seed,
+    )
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(Fixtures(args.fixtures), behaviour, _load_symbols()))
+    server.daemon_threads = True
+    print(f"🧪 Stand-in läuft auf http://{args.host}:{args.port} (fmp/, av/, yahoo/, _stats)", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(behaviour.stats), flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+# code/API/reindex_stocks.py
+"""
+Überführt den Aktien-Index in das kanonische Mapping (utils.STOCKS_MAPPING) und schaltet per Alias um.
+
+Ablauf:
+1. neuer Index <name>_v<Zeitstempel> mit utils.index_body() (Rohfelder nur im _source)
+2. _reindex vom bisherigen Index (konkreter Index oder Alias) als Server-Task, Fortschritt per Tasks-API
+3. Quelle schreibgeschützt setzen (index.blocks.write), dann Nachlauf: alles, was während des
+   Kopierens geschrieben oder bestätigt wurde, noch einmal übernehmen – danach kommt nichts mehr dazu
+4. Prüfung der Dokumentanzahl, dann atomarer Alias-Wechsel: <name> zeigt auf den neuen Index.
+   War <name> bisher ein konkreter Index, wird er im selben Schritt gelöscht (remove_index),
+   sonst bleiben die alten Versionen erhalten (--delete-old entfernt sie).
+   Schlägt ab Schritt 3 etwas fehl, wird der Schreibschutz wieder aufgehoben und das Ziel gelöscht.
+
+Am besten außerhalb der Scheduler-Zeiten laufen lassen: zwischen Schreibschutz und Alias-Wechsel
+abgelehnte Bulk-Items zählt der BulkWriter als Fehler. Ingestoren und Frontend schreiben/lesen
+sonst weiter über den Namen <name> und merken vom Wechsel nichts.
+
+    python reindex_stocks.py --dry-run            # nur Plan und aktuelle Größe anzeigen
+    python reindex_stocks.py                      # stocks
+    python reindex_stocks.py --index stocks_latest
+"""
+import os
+import time
+import argparse
+from datetime import datetime, UTC
+from typing import Any, Dict, List, Tuple
+
+from utils import es_client, es_healthcheck, ensure_template, index_body, log
+
+ES_INDEX = os.getenv("ELASTICSEARCH_INDEX", "stocks")
+POLL_SECONDS = 5
+
+
+# === 1️⃣ Bestandsaufnahme ===
+
+def resolve(es, name: str) -> Tuple[List[str], bool]:
+    """(konkrete Indizes hinter name, name ist Alias)."""
+    if es.indices.exists_alias(name=name):
+        return sorted(es.indices.get_alias(name=name).keys()), True
+    if es.indices.exists(index=name):
+        return [name], False
+    raise SystemExit(f"❌ Weder Index noch Alias '{name}' gefunden.")
+
+
+def _count_fields(props: Dict[str, Any]) -> int:
+    n = 0
+    for spec in props.values():
+        n += 1 + len(spec.get("fields", {}))
+        n += _count_fields(spec.get("properties", {}))
+    return n
+
+
+def index_stats(es, indices: List[str]) -> Dict[str, Any]:
+    """Dokumente, Speicherplatz und Anzahl gemappter Felder (inkl. .keyword-Unterfelder)."""
+    stats = es.indices.stats(index=indices, metric=["docs", "store"])["_all"]["primaries"]
+    mappings = es.indices.get_mapping(index=indices)
+    fields = max(_count_fields(m["mappings"].get("properties", {})) for m in mappings.values())
+    return {
+        "docs": stats["docs"]["count"],
+        "store_mb": round(stats["store"]["size_in_bytes"] / 1e6, 1),
+        "fields": fields,
+    }
+
+
+def _fmt(stats: Dict[str, Any]) -> str:
+    return f"{stats['docs']} Dokumente, {stats['store_mb']} MB, {stats['fields']} gemappte Felder"
+
+
+# === 2️⃣ Kopieren ===
+
+def run_reindex(es, source: List[str], dest: str, query: Dict[str, Any] = None, op_type: str = "create") -> Dict[str, Any]:
+    """_reindex als Task starten und bis zum Ende verfolgen."""
+    src = {"index": source, "size": 1000}
+    if query:
+        src["query"] = query
+    task = es.reindex(source=src, dest={"index": dest, "op_type": op_type},
+                      conflicts="proceed", wait_for_completion=False)["task"]
+    while True:
+        time.sleep(POLL_SECONDS)
+        res = es.tasks.get(task_id=task)
+        status = res["task"]["status"]
+        done = status["created"] + status["updated"] + status["version_conflicts"]
+        log(f"  {done}/{status['total']} kopiert")
+        if res.get("completed"):
+            break
+    resp = res.get("response", {})
+    if res.get("error") or resp.get("failures"):
+        raise RuntimeError(f"Reindex fehlgeschlagen: {res.get('error') or resp['failures'][:3]}")
+    return resp
+
+
+def set_write_block(es, indices: List[str], blocked: bool):
+    """index.blocks.write setzen bzw. (None) auf den Standard zurücksetzen."""
+    es.indices.put_settings(index=indices, settings={"index.blocks.write": True if blocked else None})
+
+
+def swap_alias(es, name: str, old: List[str], dest: str, is_alias: bool):
+    actions = [{"add": {"index": dest, "alias": name, "is_write_index": True}}]
+    if is_alias:
+        actions += [{"remove": {"index": o, "alias": name}} for o in old]
+    else:
+        actions.append({"remove_index": {"index": name}})  # Name wird frei für den Alias
+    es.indices.update_aliases(actions=actions)
+
+
+# === 3️⃣ Einstiegspunkt ===
+
+def main():
+    parser = argparse.ArgumentParser(description="Aktien-Index ins kanonische Mapping überführen (Alias-Wechsel).")
+    parser.add_argument("--index", default=ES_INDEX, help="Index- bzw. Aliasname (Standard: %(default)s)")
+    parser.add_argument("--dest", help="Name des neuen Index (Standard: <index>_v<Zeitstempel>)")
+    parser.add_argument("--dry-run", action="store_true", help="nur Plan und Größe anzeigen")
+    parser.add_argument("--delete-old", action="store_true", help="alte Versionen hinter einem Alias löschen")
+    args = parser.parse_args()
+
+    es = es_client()
+    log(es_healthcheck(es))
+    name = args.index
+    old, is_alias = resolve(es, name)
+    dest = args.dest or f"{name}_v{datetime.now(UTC):%Y%m%d%H%M%S}"
+    before = index_stats(es, old)
+    log(f"Quelle {name} → {', '.join(old)}: {_fmt(before)}")
+    if not is_alias:
+        log(f"⚠️ '{name}' ist ein konkreter Index und wird nach erfolgreichem Kopieren gelöscht.")
+    if args.dry_run:
+        log(f"Ziel wäre {dest} (Alias {name}).")
+        return
+
+    ensure_template(es, name)
+    es.indices.create(index=dest, **index_body())
+    es.indices.put_settings(index=dest, settings={"refresh_interval": "-1"})
+    started = datetime.now(UTC).isoformat()
+    try:
+        log(f"🚚 kopiere nach {dest} ...")
+        resp = run_reindex(es, old, dest)
+        log(f"  {resp.get('created', 0)} angelegt in {resp.get('took', 0) / 1000:.1f}s")
+    except Exception:
+        es.indices.delete(index=dest, ignore_unavailable=True)
+        raise
+
+    # ab hier keine Schreibzugriffe mehr auf die Quelle, sonst gingen sie beim Wechsel verloren
+    log(f"🔒 Schreibschutz für {', '.join(old)}")
+    set_write_block(es, old, True)
+    try:
+        # während des Kopierens neu geschrieben oder als unverändert bestätigt → überschreiben
+        delta = {"bool": {"should": [{"range": {"ingested_at": {"gte": started}}},
+                                     {"range": {"last_confirmed": {"gte": started}}}]}}
+        resp = run_reindex(es, old, dest, query=delta, op_type="index")
+        log(f"  Nachlauf: {resp.get('created', 0) + resp.get('updated', 0)} Dokumente")
+        es.indices.put_settings(index=dest, settings={"refresh_interval": None})
+        es.indices.refresh(index=[*old, dest])
+
+        after = index_stats(es, [dest])
+        if after["docs"] < before["docs"]:
+            set_write_block(es, old, False)
+            raise SystemExit(f"❌ {dest} hat weniger Dokumente als die Quelle ({after['docs']} < {before['docs']}) "
+                             f"– kein Alias-Wechsel, Schreibschutz aufgehoben, {dest} bleibt zur Prüfung stehen.")
+        swap_alias(es, name, old, dest, is_alias)
+    except Exception:
+        log(f"↩️ Abbruch – Schreibschutz aufgehoben, {dest} gelöscht.")
+        set_write_block(es, old, False)
+        es.indices.delete(index=dest, ignore_unavailable=True)
+        raise
+    if is_alias and args.delete_old:
+        es.indices.delete(index=old)
+        log(f"🗑️ alte Indizes gelöscht: {', '.join(old)}")
+    elif is_alias:
+        set_write_block(es, old, False)  # alte Versionen bleiben unverändert erhalten
+    log(f"✅ {name} → {dest}: {_fmt(after)} (vorher {before['store_mb']} MB, {before['fields']} Felder)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+# code/API/scheduler.py
+"""
+Ein Prozess für alle Live-Ingestoren (ersetzt start_ingest.sh und die while/sleep-Schleifen).
+
+- feste Zeitpläne je Job: "HH:MM" (täglich, SCHEDULER_TZ) oder "every 6h" / "every 30m"
+- Provider laufen parallel (eigene Quoten), jeder Job als eigener Python-Prozess
+- kein Überlappen: max_parallel je Job (Standard 1), ein fälliger Lauf wird sonst übersprungen
+- Nachholen: verpasste Termine (Ausfall, Neustart) laufen beim Start einmal nach;
+  mehrere verpasste Termine werden zu einem Lauf zusammengefasst
+- Verlauf: data/scheduler_history.jsonl, letzter erledigter Termin je Job in data/scheduler_state.json
+
+Zeitpläne per Umgebung überschreibbar: SCHEDULE_FMP="23:15", SCHEDULE_YFINANCE="every 12h",
+SCHEDULE_ALPHAVANTAGE="off".
+
+    python scheduler.py              # Dauerbetrieb
+    python scheduler.py --list       # nächste Termine anzeigen
+    python scheduler.py --run fmp    # einen Job sofort einmal ausführen
+"""
+import os
+import re
+import sys
+import json
+import signal
+import argparse
+import subprocess
+import threading
+from datetime import datetime, timedelta, UTC
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from utils import log
+
+BASE_DIR = Path(__file__).resolve().parent
+DATA_DIR = BASE_DIR / "data"
+STATE_FILE = Path(os.getenv("SCHEDULER_STATE", str(DATA_DIR / "scheduler_state.json")))
+HISTORY_FILE = Path(os.getenv("SCHEDULER_HISTORY", str(DATA_DIR / "scheduler_history.jsonl")))
+TZ = ZoneInfo(os.getenv("SCHEDULER_TZ", "Europe/Berlin"))
+STOP_TIMEOUT = float(os.getenv("SCHEDULER_STOP_TIMEOUT", "90"))  # Sekunden bis zum harten Abbruch
+MAX_SLEEP = 300  # spätestens alle 5 Minuten neu rechnen (Uhrsprünge, Suspend)
+CATCHUP_NOTE = timedelta(minutes=5)  # ab dieser Verspätung gilt ein Lauf als nachgeholt
+
+
+# === 1️⃣ Zeitpläne ===
+
+class Job:
+    """
+    name:         Job-Name (auch für SCHEDULE_<NAME>)
+    script:       Ingestor-Skript in code/API
+    schedule:     "HH:MM" täglich oder "every <n>h|m"; "off" deaktiviert
+    max_parallel: gleichzeitige Läufe dieses Jobs
+    """
+
+    def __init__(self, name: str, script: str, schedule: str, max_parallel: int = 1):
+        self.name = name
+        self.script = script
+        self.schedule = os.getenv(f"SCHEDULE_{name.upper()}", schedule).strip().lower()
+        self.max_parallel = int(os.getenv(f"{name.upper()}_MAX_PARALLEL", str(max_parallel)))
+        self.enabled = self.schedule not in ("", "off", "none")
+        self._daily = self._every = None
+        if not self.enabled:
+            return
+        m = re.fullmatch(r"(\d{1,2}):(\d{2})", self.schedule)
+        if m:
+            self._daily = (int(m.group(1)), int(m.group(2)))
+            return
+        m = re.fullmatch(r"every\s+(\d+)\s*([hm])", self.schedule)
+        if not m:
+            raise ValueError(f"Ungültiger Zeitplan für {name}: {self.schedule!r}")
+        self._every = timedelta(hours=int(m.group(1))) if m.group(2) == "h" else timedelta(minutes=int(m.group(1)))
+
+    def prev_slot(self, now: datetime) -> datetime:
+        """Letzter Termin <= now."""
+        if self._daily:
+            h, mi = self._daily
+            slot = datetime.combine(now.date(), datetime.min.time(), tzinfo=TZ).replace(hour=h, minute=mi)
+            return slot if slot <= now else slot - timedelta(days=1)
+        step = self._every.total_seconds()
+        return datetime.fromtimestamp(now.timestamp() // step * step, TZ)
+
+    def next_slot(self, now: datetime) -> datetime:
+        slot = self.prev_slot(now)
+        return slot + timedelta(days=1) if self._daily else slot + self._every
+
+
+JOBS: List[Job] = [
+    Job("yfinance", "ingest_yf.py", "22:00"),        # bisher start_ingest.sh
+    Job("fmp", "ingest_fmp.py", "22:30"),            # nach US-Börsenschluss
+    Job("alphavantage", "Ingest_AV.py", "23:00"),    # Free-Tier: 25 Requests/Tag, Cache macht den Rest
+]
+
+
+# === 2️⃣ Zustand & Verlauf ===
+
+def _load_state() -> Dict[str, Dict[str, str]]:
+    try:
+        return json.loads(STATE_FILE.read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        log(f"⚠️ Scheduler-Zustand unlesbar ({e}) – alle Jobs gelten als fällig.")
+        return {}
+
+
+def _save_state(state: Dict[str, Dict[str, str]]):
+    STATE_FILE.parent.mkdir(parents=True, exist_ok=True)
+    tmp = STATE_FILE.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps(state, indent=2), encoding="utf-8")
+    tmp.replace(STATE_FILE)
+
+
+def _record(entry: Dict):
+    HISTORY_FILE.parent.mkdir(parents=True, exist_ok=True)
+    with HISTORY_FILE.open("a", encoding="utf-8") as fh:
+        fh.write(json.dumps(entry) + "\n")
+
+
+# === 3️⃣ Scheduler ===
+
+class Scheduler:
+    def __init__(self, jobs: List[Job]):
+        self.jobs = [j for j in jobs if j.enabled]
+        self.state = _load_state()
+        self.running: Dict[str, List[Tuple[subprocess.Popen, datetime]]] = {j.name: [] for j in self.jobs}
+        self.threads: List[threading.Thread] = []
+        self.stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def _last_slot(self, job: Job) -> Optional[datetime]:
+        last = self.state.get(job.name, {}).get("last_slot")
+        return datetime.fromisoformat(last) if last else None
+
+    def _mark_done(self, job: Job, slot: datetime):
+        with self._lock:
+            entry = self.state.setdefault(job.name, {})
+            last = entry.get("last_slot")
+            if not last or datetime.fromisoformat(last) < slot:
+                entry["last_slot"] = slot.isoformat()
+                _save_state(self.state)
+
+    def _execute(self, job: Job, slot: datetime, proc: subprocess.Popen):
+        """Läuft im eigenen Thread: Ausgabe mit Präfix weiterreichen, Ergebnis festhalten."""
+        started = datetime.now(UTC)
+        for line in proc.stdout:
+            print(f"[{job.name}] {line.rstrip()}", flush=True)
+        rc = proc.wait()
+        seconds = round((datetime.now(UTC) - started).total_seconds(), 1)
+        with self._lock:
+            self.running[job.name].remove((proc, slot))
+        interrupted = self.stop.is_set()
+        status = "ok" if rc == 0 else ("interrupted" if interrupted else "failed")
+        _record({"job": job.name, "slot": slot.isoformat(), "started_at": started.isoformat(),
+                 "finished_at": datetime.now(UTC).isoformat(), "seconds": seconds,
+                 "returncode": rc, "status": status})
+        # abgebrochene Läufe bleiben fällig → werden nach dem Neustart nachgeholt (Checkpoint setzt fort)
+        if status != "interrupted":
+            self._mark_done(job, slot)
+        log(f"{'✅' if rc == 0 else '⚠️'} {job.name}: {status} nach {seconds}s (Termin {slot:%Y-%m-%d %H:%M})")
+
+    def launch(self, job: Job, slot: datetime) -> Optional[threading.Thread]:
+        with self._lock:
+            if len(self.running[job.name]) >= job.max_parallel:
+                busy = True
+            else:
+                busy = False
+                env = {**os.environ, "PYTHONUNBUFFERED": "1"}
+                proc = subprocess.Popen(
+                    [sys.executable, str(BASE_DIR / job.script)], cwd=BASE_DIR, env=env,
+                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, errors="replace",
+                )
+                self.running[job.name].append((proc, slot))
+        if busy:
+            log(f"⏭️ {job.name}: Termin {slot:%Y-%m-%d %H:%M} übersprungen – vorheriger Lauf noch aktiv.")
+            _record({"job": job.name, "slot": slot.isoformat(), "started_at": datetime.now(UTC).isoformat(),
+                     "status": "skipped"})
+            self._mark_done(job, slot)
+            return None
+        log(f"🚀 {job.name}: starte {job.script} (Termin {slot:%Y-%m-%d %H:%M})")
+        t = threading.Thread(target=self._execute, args=(job, slot, proc), name=f"job-{job.name}", daemon=True)
+        t.start()
+        self.threads.append(t)
+        return t
+
+    def tick(self, now: datetime):
+        """Startet alle Jobs, deren letzter Termin noch nicht erledigt ist (inkl. verpasster)."""
+        for job in self.jobs:
+            slot = job.prev_slot(now)
+            last = self._last_slot(job)
+            if last is not None and last >= slot:
+                continue
+            with self._lock:
+                if any(s == slot for _, s in self.running[job.name]):
+                    continue  # läuft bereits
+            if now - slot > CATCHUP_NOTE:
+                log(f"↩️ {job.name}: verpasster Termin {slot:%Y-%m-%d %H:%M} wird nachgeholt.")
+            self.launch(job, slot)
+
+    def shutdown(self):
+        """Laufende Jobs per SIGINT beenden (Ingestoren speichern Puffer und Checkpoint), notfalls hart."""
+        with self._lock:
+            procs = [p for ps in self.running.values() for p, _ in ps]
+        for p in procs:
+            p.send_signal(signal.SIGINT)
+        deadline = datetime.now(UTC) + timedelta(seconds=STOP_TIMEOUT)
+        for p in procs:
+            try:
+                p.wait(timeout=max(0.0, (deadline - datetime.now(UTC)).total_seconds()))
+            except subprocess.TimeoutExpired:
+                log(f"⛔ harter Abbruch (PID {p.pid})")
+                p.kill()
+        for t in self.threads:
+            t.join(timeout=5)
+
+    def serve(self):
+        log("🗓️ Scheduler gestartet: " + ", ".join(f"{j.name} ({j.schedule})" for j in self.jobs))
+        try:
+            while not self.stop.is_set():
+                now = datetime.now(TZ)
+                self.tick(now)
+                self.threads = [t for t in self.threads if t.is_alive()]
+                wake = min(j.next_slot(now) for j in self.jobs) if self.jobs else now + timedelta(seconds=MAX_SLEEP)
+                self.stop.wait(min(MAX_SLEEP, max(1.0, (wake - datetime.now(TZ)).total_seconds())))
+        finally:
+            self.stop.set()
+            self.shutdown()
+            log("🛑 Scheduler beendet.")
+
+
+# === 4️⃣ Einstiegspunkt ===
+
+def main():
+    parser = argparse.ArgumentParser(description="Zeitgesteuerte Ausführung der Live-Ingestoren.")
+    parser.add_argument("--list", action="store_true", help="Zeitpläne und nächste Termine anzeigen")
+    parser.add_argument("--run", metavar="JOB", help="einen Job sofort einmal ausführen")
+    args = parser.parse_args()
+
+    sched = Scheduler(JOBS)
+    now = datetime.now(TZ)
+    if args.list:
+        for j in sched.jobs:
+            last = sched._last_slot(j)
+            done = f"zuletzt erledigt {last:%Y-%m-%d %H:%M}" if last else "noch nie gelaufen"
+            print(f"{j.name:13} {j.schedule:10} nächster Termin {j.next_slot(now):%Y-%m-%d %H:%M}  {done}")
+        return
+    if args.run:
+        job = next((j for j in sched.jobs if j.name == args.run), None)
+        if job is None:
+            parser.error(f"unbekannter Job: {args.run} ({', '.join(j.name for j in sched.jobs)})")
+        t = sched.launch(job, job.prev_slot(now))
+        try:
+            if t is not None:
+                t.join()
+        except KeyboardInterrupt:
+            sched.stop.set()
+            sched.shutdown()
+        return
+
+    def _stop(signum, frame):
+        log(f"Signal {signum} empfangen – beende laufende Jobs...")
+        sched.stop.set()
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+    sched.serve()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,16 @@
+import atexit
+import hashlib
+import heapq
 import os
+import json
+import queue
 import random
+import threading
 import time
-from datetime import datetime
-from elasticsearch import Elasticsearch
+from datetime import datetime, UTC
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional
+from elasticsearch import Elasticsearch, helpers
 from elastic_transport import ConnectionError as ESConnectionError
 from requests.adapters import HTTPAdapter, Retry
 import requests
@@ -37,72 +45,177 @@ def es_healthcheck(es: Elasticsearch) -> str:
         return f"❌ Fehler beim Healthcheck: {e}"
 
 
-def ensure_index(es: Elasticsearch, index_name: str):
-    """Erstellt Index mit Mapping, falls er nicht existiert."""
-    try:
-        if es.indices.exists(index=index_name):
-            print(f"ℹ️ Index '{index_name}' existiert bereits.")
-            return
-    except Exception as e:
-        print(f"Fehler beim Prüfen des Index: {e}")
+# --- Kanonisches Mapping für stocks / stocks_latest (bzw. <index>_latest) ---
+# Nur kuratierte Felder werden indiziert. Alle übrigen Rohfelder der Provider (der FMP-Backfill
+# mischt jede Spalte aus sechs Dateien ein) bleiben dank "dynamic": false unverändert im _source,
+# erzeugen aber keine Mappings, keine text+keyword-Paare und keinen Heap-Verbrauch.
+METRIC_FIELDS = [
+    "peRatio", "trailingPE", "priceToBook", "eps", "dividendYield", "marketCap", "bookValuePerShare",
+    "freeCashflow", "freeCashFlow", "revenue", "totalDebt", "totalAssets", "beta", "pegRatio",
+    "payoutRatio", "cashPerShare", "revenueGrowth", "earningsGrowth", "epsGrowth", "profitMargin",
+    "debtToEquity", "quickRatio", "currentRatio", "totalCash", "sharesOutstanding",
+    "totalStockholderEquity",
+    # Abgeleitete
+    "cashToDebt", "equityRatio", "freeCashFlowPerShare", "fcfMargin", "debtToAssets",
+]
 
-    body = {
-        "settings": {"number_of_shards": 1, "number_of_replicas": 0},
-        "mappings": {
-        "properties": {
+STOCKS_MAPPING = {
+    "dynamic": False,  # unbekannte Felder: nur _source, nicht indiziert
+    "properties": {
         "symbol": {"type": "keyword"},
         "date": {"type": "date"},
         "source": {"type": "keyword"},
         "ingested_at": {"type": "date"},
+        "last_confirmed": {"type": "date"},  # unveränderter Stand zuletzt bestätigt (SnapshotCache)
+        "missing_fields": {"type": "keyword"},
+        # Berichtsperiode (Top_10: Vorquartal / Vorjahr); FMP liefert calendarYear als String
+        "calendarYear": {"type": "keyword"},
+        "period": {"type": "keyword"},
 
         # Zahlen
-        "peRatio": {"type": "double"},
-        "priceToBook": {"type": "double"},
-        "eps": {"type": "double"},
-        "dividendYield": {"type": "double"},
-        "marketCap": {"type": "double"},
-        "bookValuePerShare": {"type": "double"},
-        "freeCashflow": {"type": "double"},
-        "revenue": {"type": "double"},
-        "totalDebt": {"type": "double"},
-        "totalAssets": {"type": "double"},
-        "beta": {"type": "double"},
-        "pegRatio": {"type": "double"},
-        "payoutRatio": {"type": "double"},
-        "cashPerShare": {"type": "double"},
-        "revenueGrowth": {"type": "double"},
-        "profitMargin": {"type": "double"},
-        "debtToEquity": {"type": "double"},
-        "quickRatio": {"type": "double"},
-        "currentRatio": {"type": "double"},
-        "earningsGrowth": {"type": "double"},
-        "totalCash": {"type": "double"},
-        "sharesOutstanding": {"type": "double"},
-        "totalStockholderEquity": {"type": "double"},
-        # Abgeleitete
-        "cashToDebt": {"type": "double"},
-        "equityRatio": {"type": "double"},
-        "freeCashFlowPerShare": {"type": "double"},
-        "fcfMargin": {"type": "double"},
-        "debtToAssets": {"type": "double"},
+        **{k: {"type": "double"} for k in METRIC_FIELDS},
+        "sgaTrend": {"type": "boolean"},
 
         # Strings als keyword
         "sector": {"type": "keyword"},
-        "industry": {"type": "keyword"}
-    }
-    }
+        "industry": {"type": "keyword"},
+    },
+}
 
-        }
-        
+STOCKS_SETTINGS = {"number_of_shards": 1, "number_of_replicas": 0}
+
+
+def index_body() -> Dict[str, Any]:
+    """Settings + Mapping für einen neuen Aktien-Index (auch für reindex_stocks.py)."""
+    return {"settings": STOCKS_SETTINGS, "mappings": STOCKS_MAPPING}
 
 
+def ensure_template(es: Elasticsearch, index_name: str):
+    """
+    Index-Template für index_name und seine Versionen (<name>_v*, siehe reindex_stocks.py):
+    auch von Hand oder per Auto-Create angelegte Indizes bekommen so das kanonische Mapping.
+    """
     try:
-        es.indices.create(index=index_name, body=body)
+        es.indices.put_index_template(
+            name=f"{index_name}_template",
+            index_patterns=[index_name, f"{index_name}_v*"],
+            priority=100,
+            template=index_body(),
+        )
+    except Exception as e:
+        print(f"Fehler beim Anlegen des Index-Templates: {e}")
+
+
+def ensure_index(es: Elasticsearch, index_name: str):
+    """Erstellt Index mit Mapping, falls er nicht existiert."""
+    ensure_template(es, index_name)
+    try:
+        if es.indices.exists(index=index_name):
+            print(f"ℹ️ Index '{index_name}' existiert bereits.")
+            return
+    except Exception as e:
+        print(f"Fehler beim Prüfen des Index: {e}")
+
+    try:
+        es.indices.create(index=index_name, body=index_body())
         print(f"✅ Index '{index_name}' wurde neu erstellt.")
     except Exception as e:
         print(f"Fehler beim Erstellen des Index: {e}")
 
 
+def keyword_field(es: Elasticsearch, index: str, field: str) -> str:
+    """symbol/source sind je nach Index keyword oder text mit .keyword-Unterfeld."""
+    try:
+        mappings = es.indices.get_mapping(index=index)
+        for m in mappings.values():
+            props = m.get("mappings", {}).get("properties", {}).get(field, {})
+            if props.get("type") == "keyword":
+                return field
+            if "keyword" in props.get("fields", {}):
+                return f"{field}.keyword"
+    except Exception:
+        pass
+    return field
+
+
+# --- Aktueller Stand je Symbol und Quelle (<index>_latest, z.B. stocks_latest) ---
+# Die Historie bleibt im Hauptindex; das Frontend liest das aktuelle Universum aus dem
+# zugehörigen kleinen Index (ein Dokument je Symbol|Quelle) statt den ganzen Verlauf zu sortieren.
+# Jeder Verlaufsindex hat seinen eigenen: metrics_sp500 (ingest_fmp) landet nie in stocks_latest.
+LATEST_SUFFIX = "_latest"
+
+
+def latest_index(index: str) -> str:
+    """Index mit dem aktuellen Stand zu einem Verlaufsindex (stocks → stocks_latest)."""
+    return f"{index}{LATEST_SUFFIX}"
+
+
+def is_latest_index(index: Optional[str]) -> bool:
+    return bool(index) and index.endswith(LATEST_SUFFIX)
+
+# nur ersetzen, wenn der neue Stand nicht älter ist (Backfills schreiben auch ältere Daten)
+_LATEST_SCRIPT = (
+    "if (ctx._source.date != null && params.doc.date != null "
+    "&& params.doc.date.compareTo(ctx._source.date) < 0) { ctx.op = 'noop' } "
+    "else { ctx._source.clear(); ctx._source.putAll(params.doc) }"
+)
+
+
+def latest_action(action: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Upsert des Dokuments in latest_index(action["_index"]) (_id = Symbol|Quelle);
+    ältere Stände überschreiben nichts.
+    """
+    src = action["_source"]
+    return {
+        "_op_type": "update",
+        "_index": latest_index(action["_index"]),
+        "_id": f"{src['symbol']}|{src['source']}",
+        "_source": {
+            "script": {"source": _LATEST_SCRIPT, "lang": "painless", "params": {"doc": src}},
+            "upsert": src,
+        },
+    }
+
+
+def seed_latest(es: Elasticsearch, source_index: str, page_size: int = 500) -> int:
+    """
+    Befüllt latest_index(source_index) einmalig aus der Historie, solange er leer ist: je Symbol|Quelle das
+    jüngste Dokument (composite-Aggregation + top_hits). Sonst kennt der Index nur Symbole,
+    die seit der Einführung schon wieder geladen wurden. Rückgabe: Anzahl geschriebener Docs.
+    """
+    target = latest_index(source_index)
+    try:
+        if es.count(index=target).get("count", 0) > 0:
+            return 0
+        sources = [{f: {"terms": {"field": keyword_field(es, source_index, f)}}} for f in ("symbol", "source")]
+        top = {"size": 1, "sort": [{"date": {"order": "desc", "unmapped_type": "date"}},
+                                   {"ingested_at": {"order": "desc", "missing": "_last", "unmapped_type": "date"}}]}
+
+        def actions():
+            after = None
+            while True:
+                composite = {"size": page_size, "sources": sources}
+                if after:
+                    composite["after"] = after
+                resp = es.search(index=source_index, size=0,
+                                 aggs={"groups": {"composite": composite, "aggs": {"top": {"top_hits": top}}}})
+                agg = resp["aggregations"]["groups"]
+                for b in agg["buckets"]:
+                    for h in b["top"]["hits"]["hits"]:
+                        yield latest_action({"_index": source_index, "_source": h["_source"]})
+                after = agg.get("after_key")
+                if not after or len(agg["buckets"]) < page_size:
+                    return
+
+        ok, failed = helpers.bulk(es, actions(), raise_on_error=False, stats_only=True)
+        print(f"✅ {target} aus '{source_index}' befüllt: {ok} Dokumente, {failed} Fehler.")
+        return ok
+    except Exception as e:
+        print(f"Fehler beim Befüllen von {target}: {e}")
+        return 0
+
+
 # === 2️⃣ HTTP Session (mit Retry & Anti-Bot Headern) ===
 
 def requests_session() -> requests.Session:
@@ -137,14 +250,716 @@ def random_user_agent() -> str:
 
 # === 4️⃣ Kleine Helper ===
 
-def sleep_with_jitter(base: float = 1.2, var: float = 1.0):
-    """Schläft mit leichtem Zufallsintervall (Anti-Bot)."""
-    delay = base + random.uniform(0, var)
-    time.sleep(delay)
-    return delay
-
-
 def log(msg: str):
     """Konsolen-Log mit Zeitstempel."""
     now = datetime.now().strftime("%H:%M:%S")
     print(f"[{now}] {msg}")
+
+
+# === 5️⃣ Bulk-Schreiber (gemeinsam für alle Ingestoren) ===
+
+# Status, bei denen ES das Dokument nur vorübergehend ablehnt (429 = Queue voll, None = Transportfehler)
+RETRYABLE_STATUS = {429, 502, 503, 504, None}
+
+# Ergebnis je Action: created/updated = angenommen, der Rest = nicht geschrieben
+OUTCOMES = ("created", "updated", "conflict", "rejected", "mapping_error")
+MAPPING_ERRORS = {
+    "mapper_parsing_exception", "document_parsing_exception",
+    "strict_dynamic_mapping_exception", "illegal_argument_exception",
+}
+
+# Kurze Laufstatistik je BulkWriter (eine JSON-Zeile pro Lauf)
+BULK_STATS_FILE = Path(os.getenv("BULK_STATS_FILE", str(Path(__file__).resolve().parent / "data" / "bulk_stats.jsonl")))
+
+
+def bulk_outcome(success: bool, item: Dict[str, Any]) -> str:
+    """Ordnet ein Bulk-Item einer der OUTCOMES zu."""
+    info = next(iter(item.values()), {}) if item else {}
+    if success:
+        return "created" if info.get("result") == "created" else "updated"
+    status = info.get("status")
+    if status == 409:
+        return "conflict"
+    err = info.get("error")
+    etype = err.get("type") if isinstance(err, dict) else None
+    if status == 400 or etype in MAPPING_ERRORS:
+        return "mapping_error"
+    return "rejected"
+
+
+class BulkWriter:
+    """
+    Streamt Bulk-Actions nach Elasticsearch, ohne den Produzenten auszubremsen.
+
+    - Batches werden nach Dokumentanzahl UND Payload-Größe (max_bytes) gebildet.
+    - Geschrieben wird in einem Hintergrund-Thread; der Produzent blockiert nur, wenn
+      bereits max_pending Batches warten (Speicher bleibt begrenzt).
+    - adaptive=True: die Batchgröße folgt der beobachteten Bulk-Latenz und Ablehnungsrate
+      (größer bei schnellen Antworten, halbiert bei 429/Überlast, zwischen min_docs und max_docs).
+    - Jedes Item wird als created/updated/conflict/rejected/mapping_error gezählt, zusätzlich
+      je Zielindex in summary["by_index"] (index_summary) — z.B. Verlauf und <index>_latest getrennt.
+    - Vorübergehend abgelehnte Items (429, Transportfehler) landen in einer begrenzten
+      Retry-Queue und werden nach Backoff erneut gesendet; neue Batches laufen in der
+      Zwischenzeit weiter. Ist die Queue voll (max_retry_queue), werden zuerst die Retries
+      abgearbeitet — der Produzent wartet dann über max_pending.
+    - close() liefert die Summe (inkl. Batchgröße und Durchsatz) und hängt sie als
+      JSON-Zeile an stats_file an (None = keine Datei).
+    - on_batch(actions, errors) wird im Schreib-Thread aufgerufen, sobald Actions
+      endgültig erledigt sind (errors = fehlgeschlagene Items inkl. 409-Konflikten).
+      Retries kommen daher später in einem eigenen Aufruf.
+
+    Verwendung:
+        with BulkWriter(es, batch_docs=100, label="yfinance") as writer:
+            writer.add(doc)          # oder writer.write(generator)
+        print(writer.summary["ok"])
+    """
+
+    def __init__(
+        self,
+        es: Elasticsearch,
+        batch_docs: int = 500,
+        max_bytes: int = 5 * 1024 * 1024,
+        max_pending: int = 4,
+        label: str = "bulk",
+        on_batch: Optional[Callable[[List[Dict[str, Any]], List[Dict[str, Any]]], None]] = None,
+        adaptive: bool = True,
+        min_docs: int = 10,
+        max_docs: Optional[int] = None,
+        target_latency: float = 2.0,
+        max_retries: int = 8,
+        initial_backoff: float = 1.0,
+        max_backoff: float = 60.0,
+        max_retry_queue: Optional[int] = None,
+        stats_file: Optional[Path] = BULK_STATS_FILE,
+    ):
+        self.es = es
+        self.batch_docs = batch_docs
+        self.max_bytes = max_bytes
+        self.label = label
+        self.on_batch = on_batch
+        self.adaptive = adaptive
+        self.min_docs = min(min_docs, batch_docs)
+        self.max_docs = max_docs or batch_docs * 4
+        self.target_latency = target_latency
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.max_retry_queue = max_retry_queue or self.max_docs * max_pending
+        self.stats_file = stats_file
+        self.summary: Dict[str, Any] = {
+            "batches": 0, "docs": 0, "ok": 0, "failed": 0,
+            **{k: 0 for k in OUTCOMES},
+            "throttled": 0, "retried": 0, "retry_queue_max": 0,
+            "bytes": 0, "bulk_seconds": 0.0,
+            "by_index": {},
+        }
+        self._batch: List[Dict[str, Any]] = []
+        self._batch_bytes = 0
+        self._queue: "queue.Queue[Optional[List[Dict[str, Any]]]]" = queue.Queue(maxsize=max_pending)
+        self._retry: List[tuple] = []  # Heap: (fällig_um, laufende Nr., Versuch, Action)
+        self._retry_seq = 0
+        self._started_at = datetime.now(UTC)
+        self._started = time.monotonic()
+        self._closed = False
+        self._thread = threading.Thread(target=self._worker, name=f"bulk-{label}", daemon=True)
+        self._thread.start()
+
+    # --- Produzenten-Seite ---
+    def add(self, action: Dict[str, Any]):
+        size = len(json.dumps(action.get("_source", action), default=str))
+        if self._batch and (len(self._batch) >= self.batch_docs or self._batch_bytes + size > self.max_bytes):
+            self.flush()
+        self._batch.append(action)
+        self._batch_bytes += size
+
+    def write(self, actions: Iterable[Dict[str, Any]]):
+        for action in actions:
+            self.add(action)
+
+    def flush(self):
+        if self._batch:
+            self.summary["bytes"] += self._batch_bytes
+            self._queue.put(self._batch)
+            self._batch, self._batch_bytes = [], 0
+
+    def close(self) -> Dict[str, Any]:
+        if not self._closed:
+            self._closed = True
+            self.flush()
+            self._queue.put(None)
+            self._thread.join()
+            s = self.summary
+            s["seconds"] = round(time.monotonic() - self._started, 2)
+            s["bulk_seconds"] = round(s["bulk_seconds"], 2)
+            s["batch_docs"] = self.batch_docs
+            s["docs_per_second"] = round(s["ok"] / s["seconds"], 1) if s["seconds"] else None
+            s["acceptance"] = round(s["ok"] / s["docs"], 4) if s["docs"] else None
+            log(f"[{self.label}] Bulk fertig: {s['created']} neu, {s['updated']} aktualisiert, "
+                f"{s['conflict']} Konflikte, {s['rejected']} abgelehnt, {s['mapping_error']} Mapping-Fehler, "
+                f"{s['retried']} erneut gesendet, Batchgröße zuletzt {s['batch_docs']}, {s['docs_per_second']} Docs/s")
+            if len(s["by_index"]) > 1:
+                log(f"[{self.label}] je Index: " + ", ".join(
+                    f"{idx} {c['ok']} ok / {c['failed']} fehlgeschlagen" for idx, c in s["by_index"].items()))
+            self._write_stats()
+        return self.summary
+
+    def index_summary(self, index: str) -> Dict[str, int]:
+        """ok/failed und Outcomes der Actions mit _index == index (0, wenn keine)."""
+        return dict(self.summary["by_index"].get(index) or dict.fromkeys(("ok", "failed", *OUTCOMES), 0))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _write_stats(self):
+        if self.stats_file is None:
+            return
+        record = {"run_at": self._started_at.isoformat(), "label": self.label, **self.summary}
+        try:
+            self.stats_file.parent.mkdir(parents=True, exist_ok=True)
+            with self.stats_file.open("a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+        except OSError as e:
+            log(f"[{self.label}] ⚠️ Statistik nicht geschrieben ({self.stats_file}): {e}")
+
+    # --- Schreib-Thread ---
+    def _bulk(self, actions: List[Dict[str, Any]]) -> List[tuple]:
+        """Ein Bulk-Request; liefert (ok, item) je Action in Eingabereihenfolge."""
+        try:
+            return list(helpers.streaming_bulk(
+                self.es, actions,
+                chunk_size=len(actions), max_chunk_bytes=self.max_bytes * 2,
+                raise_on_error=False, raise_on_exception=False,
+                yield_ok=True, max_retries=0,
+            ))
+        except Exception as e:
+            log(f"[{self.label}] ❌ Bulk-Request fehlgeschlagen: {e}")
+            return [
+                (False, {a.get("_op_type", "index"): {"_id": a.get("_id"), "status": None, "error": str(e)}})
+                for a in actions
+            ]
+
+    def _adapt(self, sent: int, latency: float, rejected: int):
+        """AIMD: bei Ablehnung/Überlast halbieren, bei schnellen Antworten vorsichtig vergrößern."""
+        if not self.adaptive:
+            return
+        old = self.batch_docs
+        if rejected or latency > self.target_latency * 1.5:
+            self.batch_docs = max(self.min_docs, self.batch_docs // 2)
+        elif latency < self.target_latency * 0.5 and sent >= self.batch_docs:
+            self.batch_docs = min(self.max_docs, int(self.batch_docs * 1.25) + 1)
+        if self.batch_docs != old:
+            log(f"[{self.label}] Batchgröße {old} → {self.batch_docs} (Latenz {latency:.2f}s, {rejected} abgelehnt)")
+
+    def _schedule_retry(self, action: Dict[str, Any], attempt: int):
+        delay = min(self.max_backoff, self.initial_backoff * 2 ** (attempt - 1))
+        due = time.monotonic() + delay + random.uniform(0, delay / 4)
+        self._retry_seq += 1
+        heapq.heappush(self._retry, (due, self._retry_seq, attempt, action))
+        self.summary["retry_queue_max"] = max(self.summary["retry_queue_max"], len(self._retry))
+
+    def _due_retries(self) -> List[tuple]:
+        """Fällige Retries (höchstens eine Batchgröße) als (Versuch, Action)."""
+        now, due = time.monotonic(), []
+        while self._retry and self._retry[0][0] <= now and len(due) < self.batch_docs:
+            _, _, attempt, action = heapq.heappop(self._retry)
+            due.append((attempt, action))
+        return due
+
+    def _send(self, entries: List[tuple]):
+        """Sendet (Versuch, Action)-Paare; vorübergehend abgelehnte gehen in die Retry-Queue."""
+        s = self.summary
+        s["batches"] += 1
+        actions = [a for _, a in entries]
+        t0 = time.monotonic()
+        results = self._bulk(actions)
+        latency = time.monotonic() - t0
+        s["bulk_seconds"] += latency
+
+        settled, errors, counts, throttled = [], [], dict.fromkeys(OUTCOMES, 0), 0
+        for (attempt, action), (success, item) in zip(entries, results):
+            if not success:
+                info = next(iter(item.values()), {})
+                if info.get("status") in RETRYABLE_STATUS and attempt < self.max_retries:
+                    throttled += 1
+                    self._schedule_retry(action, attempt + 1)
+                    continue
+                errors.append(item)
+            outcome = bulk_outcome(success, item)
+            counts[outcome] += 1
+            settled.append(action)
+            per = s["by_index"].setdefault(str(action.get("_index")), dict.fromkeys(("ok", "failed", *OUTCOMES), 0))
+            per[outcome] += 1
+            per["ok" if success else "failed"] += 1
+
+        for k, v in counts.items():
+            s[k] += v
+        s["ok"] += counts["created"] + counts["updated"]
+        s["failed"] += len(errors)
+        s["throttled"] += throttled
+        s["retried"] += sum(1 for attempt, _ in entries if attempt)
+        log(f"[{self.label}] Batch {s['batches']}: {len(entries)} Docs, "
+            + ", ".join(f"{v} {k}" for k, v in counts.items() if v)
+            + f", {throttled} zurückgestellt, {latency:.2f}s")
+        self._adapt(len(entries), latency, throttled)
+
+        if self.on_batch is not None and settled:
+            try:
+                self.on_batch(settled, errors)
+            except Exception as e:
+                log(f"[{self.label}] ⚠️ on_batch-Fehler: {e}")
+
+    def _worker(self):
+        draining = False
+        while True:
+            due = self._due_retries()
+            if due:
+                self._send(due)
+                continue
+            if draining and not self._retry:
+                return
+            wait = max(0.0, self._retry[0][0] - time.monotonic()) if self._retry else None
+            # Retry-Queue voll oder Eingang geschlossen: nur noch auf fällige Retries warten
+            if draining or len(self._retry) >= self.max_retry_queue:
+                time.sleep(wait)
+                continue
+            try:
+                batch = self._queue.get(timeout=wait)
+            except queue.Empty:
+                continue
+            if batch is None:
+                draining = True
+                continue
+            self.summary["docs"] += len(batch)
+            self._send([(0, a) for a in batch])
+
+
+# === 6️⃣ Rate-Limiter je Provider (Token-Bucket) ===
+
+# Standard-Quoten (Aufrufe pro Minute / pro Tag, None = unbegrenzt); per ENV überschreibbar:
+#   <PROVIDER>_CALLS_PER_MINUTE, <PROVIDER>_CALLS_PER_DAY  (z.B. ALPHAVANTAGE_CALLS_PER_DAY=500)
+#   0 = unbegrenzt, negative Werte sind ein Konfigurationsfehler
+RATE_LIMITS: Dict[str, tuple] = {
+    "fmp": (300, 250),           # Free-Plan: 250/Tag
+    "alphavantage": (5, 25),     # Free-Plan: 5/Minute, 25/Tag
+    "yfinance": (30, None),      # inoffiziell, kein festes Limit
+}
+RATE_STATE_DIR = Path(os.getenv("RATE_STATE_DIR", str(Path(__file__).resolve().parent / "data")))
+RATE_STATE_SAVE_CALLS = 25       # Tageszähler spätestens alle N Aufrufe ...
+RATE_STATE_SAVE_SECONDS = 10.0   # ... bzw. alle N Sekunden speichern (und beim Beenden)
+
+
+class QuotaExceeded(RuntimeError):
+    """Tageskontingent eines Providers ist aufgebraucht."""
+
+
+class RateLimiter:
+    """
+    Token-Bucket für einen Provider: höchstens per_minute Aufrufe pro Minute
+    (gleichmäßig verteilt, burst = erlaubte Spitze) und per_day pro UTC-Tag.
+    per_minute/per_day None oder 0 = unbegrenzt.
+
+    - acquire() blockiert genau so lange, bis der nächste Aufruf erlaubt ist.
+    - Ist das Tageskontingent erschöpft, wirft acquire() QuotaExceeded statt zu warten.
+    - Der Tageszähler wird in state_file gespeichert, damit ein Neustart ihn nicht zurücksetzt —
+      gebündelt alle RATE_STATE_SAVE_CALLS Aufrufe bzw. RATE_STATE_SAVE_SECONDS, beim Erreichen
+      des Limits und beim Prozessende (flush).
+    - Thread-sicher; reserve() liefert nur die Wartezeit (für eigene Schlafroutinen).
+    """
+
+    def __init__(
+        self,
+        per_minute: float,
+        per_day: Optional[int] = None,
+        burst: int = 1,
+        name: str = "api",
+        state_file: Optional[Path] = None,
+    ):
+        self.name = name
+        self.rate = per_minute / 60.0 if per_minute and per_minute > 0 else None  # None = ohne Minutenlimit
+        self.burst = max(1, burst)
+        self.per_day = per_day or None
+        self.state_file = state_file
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+        self._day, self._used = self._load_state()
+        self._unsaved = 0
+        self._saved_at = time.monotonic()
+        if self.state_file and self.per_day is not None:
+            atexit.register(self.flush)
+
+    def _today(self) -> str:
+        return datetime.now(UTC).date().isoformat()
+
+    def _load_state(self) -> tuple:
+        today = self._today()
+        if self.state_file and self.state_file.exists():
+            try:
+                st = json.loads(self.state_file.read_text(encoding="utf-8"))
+                if st.get("day") == today:
+                    return today, int(st.get("used", 0))
+            except Exception:
+                pass
+        return today, 0
+
+    def _save_state(self):
+        if not self.state_file:
+            return
+        try:
+            self.state_file.parent.mkdir(parents=True, exist_ok=True)
+            self.state_file.write_text(json.dumps({"day": self._day, "used": self._used}), encoding="utf-8")
+        except OSError as e:
+            log(f"[{self.name}] ⚠️ Rate-Limit-Stand nicht gespeichert: {e}")
+
+    def flush(self):
+        """Noch nicht gespeicherten Tageszähler sofort schreiben."""
+        with self._lock:
+            if self._unsaved:
+                self._save_state()
+                self._unsaved = 0
+                self._saved_at = time.monotonic()
+
+    @property
+    def remaining_today(self) -> Optional[int]:
+        if self.per_day is None:
+            return None
+        with self._lock:
+            if self._day != self._today():
+                return self.per_day
+            return max(0, self.per_day - self._used)
+
+    def reserve(self) -> float:
+        """Nimmt ein Token, falls verfügbar (→ 0.0), sonst die nötige Wartezeit in Sekunden."""
+        with self._lock:
+            today = self._today()
+            if today != self._day:
+                self._day, self._used = today, 0
+            if self.per_day is not None and self._used >= self.per_day:
+                raise QuotaExceeded(f"{self.name}: Tageslimit von {self.per_day} Aufrufen erreicht")
+
+            now = time.monotonic()
+            if self.rate is not None:
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens < 1.0:
+                    return (1.0 - self._tokens) / self.rate
+                self._tokens -= 1.0
+            self._used += 1
+            if self.per_day is not None:
+                self._unsaved += 1
+                if (self._unsaved >= RATE_STATE_SAVE_CALLS or now - self._saved_at >= RATE_STATE_SAVE_SECONDS
+                        or self._used >= self.per_day):
+                    self._save_state()
+                    self._unsaved = 0
+                    self._saved_at = now
+            return 0.0
+
+    def acquire(self) -> float:
+        """Wartet bis zum nächsten erlaubten Aufruf; liefert die gewartete Zeit."""
+        waited = 0.0
+        while True:
+            delay = self.reserve()
+            if delay <= 0:
+                return waited
+            time.sleep(delay)
+            waited += delay
+
+
+_limiters: Dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def _limit_env(name: str, default, cast):
+    """Quote aus ENV; 0 = unbegrenzt (None), negative oder unlesbare Werte → ValueError."""
+    raw = os.getenv(name)
+    if raw is None:
+        return default
+    try:
+        value = cast(raw)
+    except ValueError:
+        raise ValueError(f"{name}={raw!r} ist keine Zahl") from None
+    if value < 0:
+        raise ValueError(f"{name}={raw!r} darf nicht negativ sein (0 = unbegrenzt)")
+    return value or None
+
+
+def rate_limiter(provider: str) -> RateLimiter:
+    """Gemeinsamer Limiter je Provider (pro Prozess), Quoten aus RATE_LIMITS bzw. ENV."""
+    with _limiters_lock:
+        if provider not in _limiters:
+            per_minute, per_day = RATE_LIMITS.get(provider, (60, None))
+            key = provider.upper()
+            per_minute = _limit_env(f"{key}_CALLS_PER_MINUTE", per_minute, float)
+            per_day = _limit_env(f"{key}_CALLS_PER_DAY", per_day, int)
+            _limiters[provider] = RateLimiter(
+                per_minute, per_day,
+                burst=int(os.getenv(f"{key}_BURST", "1")),
+                name=provider,
+                state_file=RATE_STATE_DIR / f"ratelimit_{provider}.json",
+            )
+        return _limiters[provider]
+
+
+# === 7️⃣ Checkpoints für fortsetzbare Läufe ===
+
+def action_symbol(action: Dict[str, Any]) -> str:
+    """Symbol einer Action – volles Dokument, Teil-Update ({"doc": ...}) oder Upsert ({"upsert": ...})."""
+    src = action.get("_source", {})
+    return src.get("symbol") or (src.get("doc") or src.get("upsert") or {}).get("symbol")
+
+
+CHECKPOINT_DIR = Path(os.getenv("CHECKPOINT_DIR", str(Path(__file__).resolve().parent / "data" / "checkpoints")))
+
+
+class RunCheckpoint:
+    """
+    Fortschritt eines Tageslaufs (je Ingestor eine Datei), damit ein Neustart dort weitermacht,
+    wo der Container aufgehört hat.
+
+    - order:     gemischte Symbolreihenfolge des Laufs (bleibt beim Fortsetzen erhalten)
+    - completed: Symbole, deren Dokument ES bestätigt hat oder die nichts geliefert haben
+    - buffered:  abgerufene, aber noch nicht bestätigte Actions (_id → Action); beim Fortsetzen
+                 werden sie direkt erneut geschrieben statt neu abgerufen
+    Checkpoints gelten nur für den aktuellen UTC-Tag; ältere werden beim Laden verworfen.
+    CHECKPOINT_RESET=1 startet unabhängig vom Stand neu.
+
+    Verwendung:
+        ckpt = RunCheckpoint("yfinance", symbols)
+        writer = BulkWriter(es, ..., on_batch=ckpt.ack)
+        writer.write(ckpt.buffered_actions())
+        for sym in ckpt.pending(): ... ckpt.hold(sym, action) / ckpt.done(sym)
+        writer.close(); ckpt.finish()
+    """
+
+    def __init__(self, name: str, symbols: List[str], save_every: int = 25, save_seconds: float = 30.0):
+        self.name = name
+        self.path = CHECKPOINT_DIR / f"{name}.json"
+        self.save_every = save_every
+        self.save_seconds = save_seconds
+        self._lock = threading.Lock()       # Zustand (Hauptthread + Writer-Thread)
+        self._save_lock = threading.Lock()  # nur ein Schreiber je Datei
+        self._dirty = 0
+        self._last_save = time.monotonic()
+
+        state = None if os.getenv("CHECKPOINT_RESET") == "1" else self._load()
+        today = datetime.now(UTC).date().isoformat()
+        if state and state.get("day") == today:
+            self.resumed = True
+            self.run_id = state["run_id"]
+            self.order = state["order"] + [s for s in symbols if s not in set(state["order"])]
+            self.completed = set(state.get("completed", []))
+            self.buffered: Dict[str, Dict[str, Any]] = state.get("buffered", {})
+            self.finished = bool(state.get("finished"))
+        else:
+            if state:
+                log(f"[{name}] Checkpoint vom {state.get('day')} abgelaufen – starte neu.")
+            self.resumed = False
+            self.run_id = f"{name}-{datetime.now(UTC).strftime('%Y%m%dT%H%M%S')}"
+            self.order = list(symbols)
+            self.completed = set()
+            self.buffered = {}
+            self.finished = False
+        self.day = today
+        if self.resumed:
+            log(f"[{name}] Setze Lauf {self.run_id} fort: {len(self.completed)}/{len(self.order)} erledigt, "
+                f"{len(self.buffered)} gepufferte Actions" + (" (bereits abgeschlossen)" if self.finished else ""))
+        self.save()
+
+    def _load(self) -> Optional[Dict[str, Any]]:
+        try:
+            return json.loads(self.path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            log(f"[{self.name}] ⚠️ Checkpoint unlesbar ({e}) – starte neu.")
+            return None
+
+    def save(self):
+        # Schnappschuss unter dem Lock, serialisiert wird die Kopie (der andere Thread ändert weiter)
+        with self._save_lock:
+            with self._lock:
+                state = {
+                    "run_id": self.run_id, "day": self.day, "finished": self.finished,
+                    "order": list(self.order), "completed": sorted(self.completed),
+                    "buffered": dict(self.buffered), "updated_at": datetime.now(UTC).isoformat(),
+                }
+                self._dirty, self._last_save = 0, time.monotonic()
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                tmp = self.path.with_suffix(".json.tmp")
+                tmp.write_text(json.dumps(state, default=str), encoding="utf-8")
+                tmp.replace(self.path)
+            except (OSError, TypeError, ValueError) as e:
+                log(f"[{self.name}] ⚠️ Checkpoint nicht gespeichert: {e}")
+
+    def _touch(self):
+        with self._lock:
+            self._dirty += 1
+            due = self._dirty >= self.save_every or time.monotonic() - self._last_save > self.save_seconds
+        if due:
+            self.save()
+
+    # --- Fortschritt ---
+    def pending(self) -> List[str]:
+        """Noch abzurufende Symbole in der Reihenfolge des Laufs (ohne erledigte und gepufferte)."""
+        with self._lock:
+            held = {action_symbol(a) for a in self.buffered.values()}
+            return [s for s in self.order if s not in self.completed and s not in held]
+
+    def buffered_actions(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self.buffered.values())
+
+    def hold(self, symbol: str, action: Dict[str, Any]):
+        """Action ist abgerufen und an den Writer übergeben, aber noch nicht bestätigt."""
+        with self._lock:
+            self.buffered[action["_id"]] = action
+        self._touch()
+
+    def done(self, symbol: str):
+        """Symbol ohne Dokument abgeschlossen (keine Daten / Fehler beim Abruf)."""
+        with self._lock:
+            self.completed.add(symbol)
+        self._touch()
+
+    def ack(self, actions: List[Dict[str, Any]], errors: List[Dict[str, Any]] = None):
+        """on_batch-Callback des BulkWriters: endgültig erledigte Actions abhaken."""
+        with self._lock:
+            for a in actions:
+                self.buffered.pop(a.get("_id"), None)
+                self.completed.add(action_symbol(a))
+        self._touch()
+
+    def finish(self):
+        """Lauf vollständig: als abgeschlossen markieren (ein Neustart am selben Tag ruft nichts ab)."""
+        with self._lock:
+            self.finished = not self.buffered and all(s in self.completed for s in self.order)
+        self.save()
+        return self.finished
+
+
+# === 8️⃣ Unveränderte Snapshots nicht erneut schreiben ===
+
+SNAPSHOT_DIR = Path(os.getenv("SNAPSHOT_DIR", str(Path(__file__).resolve().parent / "data")))
+SNAPSHOT_META = {"symbol", "date", "source", "ingested_at", "last_confirmed"}
+# unveränderte Snapshots nur alle n Tage im Verlauf bestätigen (jedes Update schreibt das Dokument neu)
+SNAPSHOT_CONFIRM_DAYS = float(os.getenv("SNAPSHOT_CONFIRM_DAYS", "7"))
+
+
+def payload_hash(source: Dict[str, Any]) -> str:
+    """Hash der Kennzahlen eines Dokuments (ohne Symbol/Datum/Zeitstempel)."""
+    payload = {k: v for k, v in source.items() if k not in SNAPSHOT_META}
+    return hashlib.sha1(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class SnapshotCache:
+    """
+    Lokaler Hash-Cache je Ingestor: letzter in ES bestätigter Stand je Symbol
+    (Hash der Kennzahlen + _id/_index des Dokuments), Datei data/snapshots_<name>.json.
+
+    dedupe(action) lässt ein Tagesdokument mit unveränderten Kennzahlen weg, damit der
+    Index nur mit echten Änderungen wächst; dass das Symbol gesehen wurde, steht ohnehin
+    im <index>_latest (latest_action). Nur alle SNAPSHOT_CONFIRM_DAYS Tage geht ein Update
+    von last_confirmed auf das vorhandene Dokument – ES schreibt dafür das ganze Dokument
+    neu, daher nicht täglich. Scheitert dieses Update (Dokument fehlt, z.B. Index neu
+    angelegt), wird der Eintrag verworfen und beim nächsten Mal voll geschrieben.
+    Der Cache wird erst nach der Bestätigung durch ES fortgeschrieben (ack als on_batch),
+    ein fehlgeschlagener Schreibvorgang wird also beim nächsten Lauf nicht unterdrückt.
+    SNAPSHOT_DEDUP=0 schreibt immer volle Dokumente.
+    """
+
+    def __init__(self, name: str, es: Optional[Elasticsearch] = None):
+        self.name = name
+        self.path = SNAPSHOT_DIR / f"snapshots_{name}.json"
+        self.enabled = os.getenv("SNAPSHOT_DEDUP", "1") != "0"
+        self.stats = {"written": 0, "unchanged": 0, "confirmed": 0}
+        self._lock = threading.Lock()
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self._pending: Dict[str, str] = {}  # _id → Hash der geschriebenen, noch unbestätigten Dokumente
+        if self.enabled and self.path.exists():
+            try:
+                self.entries = json.loads(self.path.read_text(encoding="utf-8"))
+            except Exception as e:
+                log(f"[{name}] ⚠️ Snapshot-Cache unlesbar ({e}) – schreibe alle Dokumente.")
+        if es is not None and self.entries:
+            self._drop_empty_indices(es)
+
+    def _drop_empty_indices(self, es: Elasticsearch):
+        """Index neu/leer (z.B. ES-Volume gelöscht) → Einträge verwerfen, sonst fehlten die Dokumente bis zur nächsten Bestätigung."""
+        for index in {e.get("_index") for e in self.entries.values()}:
+            try:
+                count = es.count(index=index).get("count")
+            except Exception:
+                continue  # nicht prüfbar → Cache behalten, die Bestätigung fängt es später ab
+            if count == 0:
+                self.entries = {k: e for k, e in self.entries.items() if e.get("_index") != index}
+                log(f"[{self.name}] Index '{index}' ist leer – Snapshot-Cache dafür verworfen.")
+
+    def dedupe(self, action: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Volles Dokument bei Änderung; unverändert: None oder (fällig) ein Update von
+        last_confirmed auf dem letzten Snapshot.
+        """
+        src = action["_source"]
+        digest = payload_hash(src)
+        with self._lock:
+            prev = self.entries.get(src["symbol"]) if self.enabled else None
+            if not prev or prev.get("hash") != digest or prev.get("_index") != action["_index"]:
+                self._pending[action["_id"]] = digest
+                self.stats["written"] += 1
+                return action
+            self.stats["unchanged"] += 1
+        confirmed = prev.get("confirmed")
+        try:
+            age = datetime.fromisoformat(src["ingested_at"]) - datetime.fromisoformat(confirmed)
+            if age.total_seconds() < SNAPSHOT_CONFIRM_DAYS * 86400:
+                return None
+        except (TypeError, ValueError):
+            pass  # kein lesbarer Zeitstempel → bestätigen
+        self.stats["confirmed"] += 1
+        return {
+            "_op_type": "update",
+            "_index": prev["_index"],
+            "_id": prev["_id"],
+            "_source": {"doc": {"symbol": src["symbol"], "last_confirmed": src["ingested_at"]}},
+        }
+
+    def ack(self, actions: List[Dict[str, Any]], errors: List[Dict[str, Any]] = None):
+        """on_batch-Callback: bestätigte Dokumente übernehmen, fehlgeschlagene Updates verwerfen."""
+        failed = {res.get("_id") for item in errors or [] for res in item.values()}
+        with self._lock:
+            for a in actions:
+                if is_latest_index(a.get("_index")):
+                    continue  # aktueller Stand, kein Verlaufs-Snapshot
+                sym = action_symbol(a)
+                if a.get("_op_type") == "update":
+                    if a["_id"] in failed:
+                        self.entries.pop(sym, None)
+                    elif sym in self.entries:
+                        self.entries[sym]["confirmed"] = a["_source"]["doc"]["last_confirmed"]
+                else:
+                    digest = self._pending.pop(a["_id"], None)
+                    if a["_id"] in failed:
+                        continue
+                    src = a["_source"]
+                    # aus dem Checkpoint erneut gesendete Actions haben keinen Eintrag in _pending
+                    self.entries[sym] = {"hash": digest or payload_hash(src), "_id": a["_id"], "_index": a["_index"],
+                                         "date": src.get("date"), "confirmed": src.get("ingested_at")}
+
+    def save(self):
+        if not self.enabled:
+            return
+        with self._lock:
+            data = json.dumps(self.entries, sort_keys=True)
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix(".json.tmp")
+            tmp.write_text(data, encoding="utf-8")
+            tmp.replace(self.path)
+        except OSError as e:
+            log(f"[{self.name}] ⚠️ Snapshot-Cache nicht gespeichert: {e}")
+        log(f"[{self.name}] Snapshots: {self.stats['written']} geschrieben, {self.stats['unchanged']} unverändert "
+            f"(davon {self.stats['confirmed']} im Verlauf bestätigt)")
@@ -20,6 +20,7 @@ from src.funktionen import (
     load_data_from_es,
     render_source_selector,
     score_row,
+    _keyword_field,
 )
 
 # === 1️⃣ Setup ===
@@ -100,22 +101,142 @@ def _parse_es_date(s: str | None):
         except Exception:
             return None
 
+_DATE_DESC = [{"date": {"order": "desc"}}]
+DETAIL_YEARS = 4  # Geschäftsjahre je Detailansicht: aktuelles, Vorjahr, Q4 davor + Reserve
+
+
 def _es_get_latest(symbol: str, source: str | None):
     body = {
         "size": 1,
-        "sort": [{"date": {"order": "desc"}}],
+        "sort": _DATE_DESC,
         "_source": True,
         "query": {"bool": {"must": _es_must_clauses(symbol, source)}},
     }
     res = es.search(index=ES_INDEX, body=body)
     return res["hits"]["hits"][0]["_source"] if res["hits"]["hits"] else None
 
+# === Detail-Kontext: alle Nachschlagewerte in einem msearch ===
+def es_get_detail_context(symbol: str, source: str | None) -> dict:
+    """
+    Ein Round-Trip statt bis zu sechs nacheinander:
+    1. jüngstes Dokument
+    2. jüngstes Dokument mit calendarYear/period (Basis) und je (Jahr, Periode) der letzten
+       DETAIL_YEARS Jahre das jüngste Dokument (Vorjahr und Vorquartale werden daraus gelesen)
+    """
+    must = _es_must_clauses(symbol, source)
+    year_f = _keyword_field(es, ES_INDEX, "calendarYear")
+    period_f = _keyword_field(es, ES_INDEX, "period")
+    top = {"top_hits": {"size": 1, "sort": _DATE_DESC, "_source": True}}
+    searches = [
+        {"index": ES_INDEX},
+        {"size": 1, "sort": _DATE_DESC, "_source": True, "query": {"bool": {"must": must}}},
+        {"index": ES_INDEX},
+        {
+            "size": 0,
+            "query": {"bool": {"must": must + [{"exists": {"field": "calendarYear"}},
+                                               {"exists": {"field": "period"}}]}},
+            "aggs": {
+                "base": top,
+                "years": {
+                    "terms": {"field": year_f, "size": DETAIL_YEARS, "order": {"_key": "desc"}},
+                    "aggs": {"periods": {"terms": {"field": period_f, "size": 10}, "aggs": {"top": top}}},
+                },
+            },
+        },
+    ]
+    ctx = {"latest": None, "base": None, "periods": {}, "complete_from": None}
+    try:
+        res_latest, res_periods = es.msearch(searches=searches)["responses"]
+    except Exception:
+        ctx["latest"] = _es_get_latest(symbol, source)
+        return ctx
+    if "error" not in res_latest:
+        hits = res_latest["hits"]["hits"]
+        ctx["latest"] = hits[0]["_source"] if hits else None
+    else:
+        ctx["latest"] = _es_get_latest(symbol, source)
+    if "error" in res_periods:
+        return ctx  # complete_from None → Einzelabfragen wie bisher
+
+    aggs = res_periods["aggregations"]
+    hits = aggs["base"]["hits"]["hits"]
+    ctx["base"] = hits[0]["_source"] if hits else None
+    if ctx["base"] and not aggs["years"]["buckets"]:
+        # Basis da, aber keine Jahres-Buckets → gecachte Feldnamen passen nicht mehr zum Mapping
+        _keyword_field(es, ES_INDEX, "calendarYear", refresh=True)
+        _keyword_field(es, ES_INDEX, "period", refresh=True)
+        return ctx  # complete_from None → Einzelabfragen
+    years = []
+    for yb in aggs["years"]["buckets"]:
+        try:
+            years.append(int(str(yb["key"])))
+        except Exception:
+            continue
+        for pb in yb["periods"]["buckets"]:
+            ph = pb["top"]["hits"]["hits"]
+            if ph:
+                ctx["periods"][(years[-1], str(pb["key"]))] = ph[0]["_source"]
+    # alle Jahre ab complete_from sind vollständig enthalten; ältere nur, wenn nichts abgeschnitten wurde
+    truncated = aggs["years"].get("sum_other_doc_count", 0) > 0
+    if not truncated:
+        ctx["complete_from"] = float("-inf")
+    elif years:
+        ctx["complete_from"] = min(years)
+    return ctx
+
+def _es_get_period_doc(symbol: str, source: str | None, year: int, period: str, ctx: dict | None = None):
+    """Jüngstes Dokument zu (calendarYear, period) – aus dem Detail-Kontext, sonst per Einzelabfrage."""
+    if ctx and ctx.get("complete_from") is not None and year >= ctx["complete_from"]:
+        return ctx["periods"].get((year, period))
+
+    must_prev = _es_must_clauses(symbol, source) + [
+        {
+            "bool": {
+                "should": [
+                    {"term": {"calendarYear": year}},
+                    {"term": {"calendarYear": str(year)}},
+                    {"term": {"calendarYear.keyword": str(year)}},
+                ],
+                "minimum_should_match": 1,
+            }
+        },
+        {
+            "bool": {
+                "should": [
+                    {"term": {"period": period}},
+                    {"term": {"period.keyword": period}},
+                ],
+                "minimum_should_match": 1,
+            }
+        },
+    ]
+
+    body_prev = {
+        "size": 1,
+        "sort": _DATE_DESC,
+        "_source": True,
+        "query": {"bool": {"must": must_prev}},
+    }
+
+    res_prev = es.search(index=ES_INDEX, body=body_prev)
+    hits_prev = res_prev["hits"]["hits"]
+    return hits_prev[0]["_source"] if hits_prev else None
+
+def _day_distance(doc_a: dict, doc_b: dict):
+    d_a = _parse_es_date(doc_a.get("date"))
+    d_b = _parse_es_date(doc_b.get("date"))
+    return abs((d_a - d_b).days) if (d_a and d_b) else None
+
 # === Jahr zurück ===
-def es_get_prev_quarter_doc(symbol: str, source: str | None, latest_doc: dict):
+def es_get_prev_quarter_doc(symbol: str, source: str | None, latest_doc: dict, ctx: dict | None = None):
     base_doc = None
 
     if isinstance(latest_doc, dict) and latest_doc.get("calendarYear") and latest_doc.get("period"):
         base_doc = latest_doc
+    elif ctx and ctx.get("complete_from") is not None:
+        base_doc = ctx.get("base")
+        if not base_doc:
+            return None, None
     else:
         must_base = _es_must_clauses(symbol, source) + [
             {"exists": {"field": "calendarYear"}},
@@ -124,7 +245,7 @@ def es_get_prev_quarter_doc(symbol: str, source: str | None, latest_doc: dict):
 
         body_base = {
             "size": 1,
-            "sort": [{"date": {"order": "desc"}}],
+            "sort": _DATE_DESC,
             "_source": True,
             "query": {"bool": {"must": must_base}},
         }
@@ -144,51 +265,11 @@ def es_get_prev_quarter_doc(symbol: str, source: str | None, latest_doc: dict):
         year_now_int = int(str(year_now))
     except Exception:
         return None, None
-    target_year = year_now_int - 1
 
-    must_prev = _es_must_clauses(symbol, source) + [
-        {
-            "bool": {
-                "should": [
-                    {"term": {"calendarYear": target_year}},
-                    {"term": {"calendarYear": str(target_year)}},
-                    {"term": {"calendarYear.keyword": str(target_year)}},
-                ],
-                "minimum_should_match": 1,
-            }
-        },
-        {
-            "bool": {
-                "should": [
-                    {"term": {"period": period}},
-                    {"term": {"period.keyword": period}},
-                ],
-                "minimum_should_match": 1,
-            }
-        },
-    ]
-
-    body_prev = {
-        "size": 1,
-        "sort": [{"date": {"order": "desc"}}],
-        "_source": True,
-        "query": {"bool": {"must": must_prev}},
-    }
-
-    res_prev = es.search(index=ES_INDEX, body=body_prev)
-    hits_prev = res_prev["hits"]["hits"]
-    if not hits_prev:
+    prev_doc = _es_get_period_doc(symbol, source, year_now_int - 1, str(period), ctx)
+    if not prev_doc:
         return None, None
-
-    prev_doc = hits_prev[0]["_source"]
-
-    d_now = _parse_es_date(base_doc.get("date"))
-    d_prev = _parse_es_date(prev_doc.get("date"))
-    dist = None
-    if d_now and d_prev:
-        dist = abs((d_now - d_prev).days)
-
-    return prev_doc, dist
+    return prev_doc, _day_distance(base_doc, prev_doc)
 
 def has_year_back_data(
     symbol: str,
@@ -196,8 +277,9 @@ def has_year_back_data(
     *,
     latest_doc: dict,
     required_fields: list[str] | None = None,
+    ctx: dict | None = None,
 ):
-    doc, dist = es_get_prev_quarter_doc(symbol, source, latest_doc)
+    doc, dist = es_get_prev_quarter_doc(symbol, source, latest_doc, ctx)
     if not doc:
         return False, doc, dist
     if required_fields:
@@ -207,7 +289,7 @@ def has_year_back_data(
     return True, doc, dist
 
 # === Vorquartal-Suche ===
-def es_get_prev_quarter_same_year(symbol: str, source: str | None, base_doc: dict):
+def es_get_prev_quarter_same_year(symbol: str, source: str | None, base_doc: dict, ctx: dict | None = None):
     if not isinstance(base_doc, dict):
         return None, None
 
@@ -231,49 +313,10 @@ def es_get_prev_quarter_same_year(symbol: str, source: str | None, base_doc: dic
     if not prev_period:
         return None, None
 
-    must_prev = _es_must_clauses(symbol, source) + [
-        {
-            "bool": {
-                "should": [
-                    {"term": {"calendarYear": prev_year}},
-                    {"term": {"calendarYear": str(prev_year)}},
-                    {"term": {"calendarYear.keyword": str(prev_year)}},
-                ],
-                "minimum_should_match": 1,
-            }
-        },
-        {
-            "bool": {
-                "should": [
-                    {"term": {"period": prev_period}},
-                    {"term": {"period.keyword": prev_period}},
-                ],
-                "minimum_should_match": 1,
-            }
-        },
-    ]
-
-    body_prev = {
-        "size": 1,
-        "sort": [{"date": {"order": "desc"}}],
-        "_source": True,
-        "query": {"bool": {"must": must_prev}},
-    }
-
-    res_prev = es.search(index=ES_INDEX, body=body_prev)
-    hits_prev = res_prev["hits"]["hits"]
-    if not hits_prev:
+    prev_doc = _es_get_period_doc(symbol, source, prev_year, prev_period, ctx)
+    if not prev_doc:
         return None, None
-
-    prev_doc = hits_prev[0]["_source"]
-
-    d_now = _parse_es_date(base_doc.get("date"))
-    d_prev = _parse_es_date(prev_doc.get("date"))
-    dist = None
-    if d_now and d_prev:
-        dist = abs((d_now - d_prev).days)
-
-    return prev_doc, dist
+    return prev_doc, _day_distance(base_doc, prev_doc)
 
 # === Fallbacks für Felder ===
 FIELD_FALLBACKS = {
@@ -480,23 +523,25 @@ st.markdown("---")
 st.subheader(f"🔍 Detailansicht: {aktie}")
 
 preferred_source = None if (not source_mode) else source_mode
-curr_doc = _es_get_latest(aktie, preferred_source)
+detail_ctx = es_get_detail_context(aktie, preferred_source)  # ein msearch für alle Nachschlagewerte
+curr_doc = detail_ctx["latest"]
 
 ok_prev, prev_doc, prev_dist = has_year_back_data(
     aktie,
     preferred_source,
     latest_doc=curr_doc,
     required_fields=None,
+    ctx=detail_ctx,
 )
 
 # Vorquartale holen
 prev_quarter_curr, _ = (None, None)
 if isinstance(curr_doc, dict):
-    prev_quarter_curr, _ = es_get_prev_quarter_same_year(aktie, preferred_source, curr_doc)
+    prev_quarter_curr, _ = es_get_prev_quarter_same_year(aktie, preferred_source, curr_doc, detail_ctx)
 
 prev_quarter_prev, _ = (None, None)
 if ok_prev and isinstance(prev_doc, dict):
-    prev_quarter_prev, _ = es_get_prev_quarter_same_year(aktie, preferred_source, prev_doc)
+    prev_quarter_prev, _ = es_get_prev_quarter_same_year(aktie, preferred_source, prev_doc, detail_ctx)
 
 # QoQ-Wachstum (EPS = Gewinn, Revenue = Umsatz)
 umsatz_qoq_now = compute_qoq_growth(curr_doc, prev_quarter_curr, "revenue") if prev_quarter_curr else None
@@ -1,8 +1,9 @@
 import os
+import time
 import pandas as pd
 from elasticsearch import Elasticsearch, NotFoundError
 import streamlit as st
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Iterator, List
 import plotly.express as px
 from datetime import datetime, timezone
 
@@ -14,6 +15,12 @@ from .lynch_criteria import CATEGORIES
 
 ES_URL = os.getenv("ELASTICSEARCH_URL", "http://localhost:9200")
 INDEX  = os.getenv("ELASTICSEARCH_INDEX", "stocks")
+# aktueller Stand je Symbol|Quelle zu INDEX (von den Ingestoren gepflegt, siehe utils.latest_index)
+LATEST_INDEX = f"{INDEX}_latest"
+ES_PAGE_SIZE = int(os.getenv("ES_PAGE_SIZE", "1000"))   # Treffer je Seite bei iter_es_pages
+PIT_KEEP_ALIVE = os.getenv("ES_PIT_KEEP_ALIVE", "1m")  # Lebensdauer des Point-in-Time je Seite
+LATEST_CHECK_SECONDS = float(os.getenv("ES_LATEST_CHECK_SECONDS", "60"))  # Cache für _latest_index
+MAPPING_CACHE_SECONDS = float(os.getenv("ES_MAPPING_CACHE_SECONDS", "300"))  # Cache für _keyword_field
 
 # --------- NEU: Historik-Helfer für Feldlisten ---------
 def _ensure_list(x):
@@ -43,6 +50,74 @@ def get_es_connection():
     return es
 
 
+_LATEST_CHECK: Dict[str, Any] = {"at": 0.0, "index": None}
+
+
+def _latest_index(es) -> Optional[str]:
+    """
+    LATEST_INDEX, wenn vorhanden und befüllt – sonst None (Fallback auf die Historie).
+    Das Ergebnis gilt LATEST_CHECK_SECONDS lang, statt bei jedem Aufruf zwei Anfragen zu kosten.
+    """
+    now = time.monotonic()
+    if now - _LATEST_CHECK["at"] < LATEST_CHECK_SECONDS:
+        return _LATEST_CHECK["index"]
+    found = None
+    try:
+        if es.indices.exists(index=LATEST_INDEX) and es.count(index=LATEST_INDEX).get("count", 0) > 0:
+            found = LATEST_INDEX
+    except Exception:
+        pass
+    _LATEST_CHECK.update(at=now, index=found)
+    return found
+
+
+def _read_indices(es, index: str) -> List[str]:
+    """Lesereihenfolge: erst LATEST_INDEX (nur für den Standardindex), bei leerem Ergebnis die Historie."""
+    latest = _latest_index(es) if index == INDEX else None
+    return [latest, index] if latest else [index]
+
+
+def iter_es_pages(es, index: str, query: Dict[str, Any], sort: List[Dict[str, Any]],
+                  _source=None, page_size: int = ES_PAGE_SIZE, max_hits: Optional[int] = None) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Liefert alle Treffer seitenweise (Liste von _source-Dicts je Seite) über Point-in-Time + search_after.
+    Kein 10000er-Limit, konsistente Sicht während des Blätterns; bricht der Aufrufer ab,
+    wird der PIT trotzdem geschlossen. max_hits begrenzt die Gesamtzahl.
+    """
+    pit_id = es.open_point_in_time(index=index, keep_alive=PIT_KEEP_ALIVE)["id"]
+    try:
+        search_after = None
+        seen = 0
+        while max_hits is None or seen < max_hits:
+            size = page_size if max_hits is None else min(page_size, max_hits - seen)
+            body = {
+                "size": size,
+                "query": query,
+                "sort": [*sort, {"_shard_doc": "asc"}],  # eindeutiger Tiebreaker für search_after
+                "pit": {"id": pit_id, "keep_alive": PIT_KEEP_ALIVE},
+                "track_total_hits": False,
+            }
+            if _source is not None:
+                body["_source"] = _source
+            if search_after is not None:
+                body["search_after"] = search_after
+            resp = es.search(body=body)
+            pit_id = resp.get("pit_id", pit_id)
+            hits = resp.get("hits", {}).get("hits", [])
+            if not hits:
+                return
+            seen += len(hits)
+            yield [h["_source"] for h in hits]
+            if len(hits) < size:
+                return
+            search_after = hits[-1]["sort"]
+    finally:
+        try:
+            es.close_point_in_time(id=pit_id)
+        except Exception:
+            pass
+
+
 # -------- Quelle & Dedupe zentral steuern --------
 SOURCE_MODES = [
     "Nur yfinance",
@@ -84,42 +159,94 @@ def _es_query_for_mode(mode: Optional[str]) -> Optional[Dict[str, Any]]:
     return None
 
 
-def _filter_dedupe_by_mode(df: pd.DataFrame, mode: Optional[str]) -> pd.DataFrame:
-    if df.empty or "source" not in df.columns:
-        return df
+# Reihenfolge für "Beides – yfinance bevorzugen": yfinance → fmp → alphavantage → sonst
+SOURCE_RANK = {"yfinance": 0, "fmp": 1, "alphavantage": 2}
+_KEYWORD_FIELDS: Dict[tuple, tuple] = {}  # (index, field) → (Feldname, Zeitpunkt)
 
-    out = df.copy()
-    if "ingested_at" in out.columns:
-        out["ingested_at"] = pd.to_datetime(out["ingested_at"], utc=True, errors="coerce")
 
-    if mode == "Nur yfinance":
-        return out[out["source"] == "yfinance"]
-    if mode == "Nur Alpha Vantage":
-        return out[out["source"] == "alphavantage"]
-    if mode == "Nur FMP":
-        return out[out["source"] == "fmp"]
-
-    # Kombi-Modi: pro (symbol, date) auf 1 Zeile reduzieren
-    if mode == "Beides – yfinance bevorzugen":
-        # Reihenfolge: yfinance → fmp → alphavantage → sonst
-        pref = {"yfinance": 0, "fmp": 1, "alphavantage": 2}
-        out["__src_rank"] = out["source"].map(pref).fillna(9)
-        out = (
-            out.sort_values(["symbol", "date", "__src_rank", "ingested_at"])
-               .drop_duplicates(subset=["symbol", "date"], keep="first")
-               .drop(columns=["__src_rank"])
-        )
-        return out
+def _keyword_field(es, index: str, field: str, refresh: bool = False) -> str:
+    """
+    Aggregierbares Feld: field (keyword-Mapping) oder field.keyword (dynamisch angelegte Indizes).
+    Gilt MAPPING_CACHE_SECONDS lang – nach einem Mapping-Wechsel (reindex_stocks.py) stimmt der
+    gecachte Name nicht mehr; refresh=True liest das Mapping sofort neu.
+    """
+    key = (index, field)
+    now = time.monotonic()
+    cached = _KEYWORD_FIELDS.get(key)
+    if cached and not refresh and now - cached[1] < MAPPING_CACHE_SECONDS:
+        return cached[0]
+    name = field
+    try:
+        for m in es.indices.get_mapping(index=index).values():
+            props = m.get("mappings", {}).get("properties", {}).get(field, {})
+            if props.get("type") != "keyword" and "keyword" in props.get("fields", {}):
+                name = f"{field}.keyword"
+    except Exception:
+        pass
+    _KEYWORD_FIELDS[key] = (name, now)
+    return name
 
-    if mode == "Beides – jüngster Import gewinnt":
-        if "ingested_at" in out.columns:
-            return (
-                out.sort_values(["symbol", "date", "ingested_at"])
-                   .drop_duplicates(subset=["symbol", "date"], keep="last")
-            )
-        return out.drop_duplicates(subset=["symbol", "date"], keep="last")
 
-    return out
+def _mode_sort(mode: Optional[str]) -> List[Dict[str, Any]]:
+    """
+    Sortierung, deren erster Treffer je (Symbol, Datum) das Dokument des Modus ist – zum
+    Auswählen direkt in ES. "yfinance bevorzugen": Quelle laut SOURCE_RANK, bei Gleichstand
+    der älteste Import (wie früher beim Deduplizieren in pandas); sonst der jüngste Import.
+    """
+    by_date = {"date": {"order": "desc"}}
+    if mode != "Beides – yfinance bevorzugen":
+        return [by_date, {"ingested_at": {"order": "desc", "missing": "_last"}}]
+    rank = {
+        "_script": {
+            "type": "number",
+            "order": "asc",
+            "script": {
+                "lang": "painless",
+                # source.keyword (dynamisches Mapping) oder source (kanonisches Mapping), ohne Mapping-Cache
+                "source": "for (f in params.fields) { if (doc.containsKey(f) && doc[f].size() > 0) "
+                          "{ return params.rank.getOrDefault(doc[f].value, 9); } } return 9;",
+                "params": {"fields": ["source.keyword", "source"], "rank": SOURCE_RANK},
+            },
+        }
+    }
+    return [by_date, rank, {"ingested_at": {"order": "asc", "missing": "_last"}}]
+
+
+def iter_top_per_group(es, index: str, group_field: str, query: Dict[str, Any], sort: List[Dict[str, Any]],
+                       _source=None, page_size: int = 500) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Je Gruppe (z.B. Symbol oder Datum) nur das erste Dokument laut sort – ausgewählt in ES
+    per composite-Aggregation + top_hits, seitenweise über after_key (Gruppen aufsteigend).
+    group_field wird per _keyword_field aufgelöst; bleibt die erste Seite leer, wird das
+    Mapping einmal neu gelesen (gecachter Feldname nach Mapping-Wechsel veraltet).
+    """
+    field = _keyword_field(es, index, group_field)
+    after = None
+    while True:
+        composite = {"size": page_size, "sources": [{"key": {"terms": {"field": field}}}]}
+        if after is not None:
+            composite["after"] = after
+        top_hits = {"size": 1, "sort": sort}
+        if _source is not None:
+            top_hits["_source"] = _source
+        body = {
+            "size": 0,
+            "query": query,
+            "aggs": {"groups": {"composite": composite, "aggs": {"top": {"top_hits": top_hits}}}},
+        }
+        agg = es.search(index=index, body=body)["aggregations"]["groups"]
+        buckets = agg.get("buckets", [])
+        if not buckets and after is None:
+            fresh = _keyword_field(es, index, group_field, refresh=True)
+            if fresh != field:
+                field = fresh
+                continue
+        page = [b["top"]["hits"]["hits"][0]["_source"] for b in buckets if b["top"]["hits"]["hits"]]
+        if page:
+            yield page
+        after = agg.get("after_key")
+        if after is None or len(buckets) < page_size:
+            return
 
 
 # ==========================================================
@@ -168,20 +295,21 @@ def lade_historische_kennzahlen(es, symbol: str, kennzahl, source_mode: Optional
     # wir holen alle Kandidatenfelder in einem Rutsch und picken später das erste, das Daten hat
     _source = list(dict.fromkeys(["symbol", "date", "source", "ingested_at", *fields]))
 
-    query = {
-        "size": 10000,
-        "query": {"bool": {"must": must}},
-        "sort": [{"date": {"order": "asc"}}, {"ingested_at": {"order": "asc"}}],
-        "_source": _source,
-    }
-    resp = es.search(index=INDEX, body=query)
-    hits = [h["_source"] for h in resp.get("hits", {}).get("hits", [])]
-    raw = pd.DataFrame(hits)
+    query = {"bool": {"must": must}}
+    if q_src:
+        # eine Quelle: je Datum genau ein Dokument, einfach aufsteigend blättern
+        pages = iter_es_pages(es, INDEX, query,
+                              sort=[{"date": {"order": "asc"}}, {"ingested_at": {"order": "asc"}}],
+                              _source=_source)
+    else:
+        # Kombi-Modi: die Quelle je Datum wählt ES (composite über date, aufsteigend)
+        pages = iter_top_per_group(es, INDEX, "date", query, _mode_sort(source_mode), _source=_source)
+    frames = [pd.DataFrame(page) for page in pages]
+    raw = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
     if raw.empty:
         return pd.DataFrame(columns=["Datum", "Wert"])
 
     raw["date"] = pd.to_datetime(raw["date"], errors="coerce")
-    raw = _filter_dedupe_by_mode(raw, source_mode)
     raw = raw.sort_values("date")
 
     # erstes Feld mit echten Werten wählen
@@ -383,24 +511,21 @@ def suche_aktie_in_es(es, symbol: str, source_mode: Optional[str] = None):
     if q_src:
         must.append(q_src)
 
-    query = {
-        "size": 1000,
-        "query": {"bool": {"must": must}},
-        "sort": [{"date": {"order": "desc"}}, {"ingested_at": {"order": "desc"}}],
-    }
-    resp = es.search(index=INDEX, body=query)
-    hits = [h["_source"] for h in resp.get("hits", {}).get("hits", [])]
+    query = {"bool": {"must": must}}
+    # aktueller Stand zuerst aus LATEST_INDEX (ein Dokument je Quelle), sonst aus der Historie;
+    # die Quelle wählt ES über die Sortierung des Modus → genau ein Treffer
+    hits = []
+    for idx in _read_indices(es, INDEX):
+        resp = es.search(index=idx, body={"size": 1, "query": query, "sort": _mode_sort(source_mode)})
+        hits = [h["_source"] for h in resp.get("hits", {}).get("hits", [])]
+        if hits:
+            break
     if not hits:
         return None
 
-    df = pd.DataFrame(hits)
-    df = _filter_dedupe_by_mode(df, source_mode)
-
-    if "date" in df.columns:
-        df["date"] = pd.to_datetime(df["date"], errors="coerce")
-        df = df.sort_values("date")
-
-    doc = df.iloc[-1].to_dict()
+    doc = dict(hits[0])
+    if doc.get("date") is not None:
+        doc["date"] = pd.to_datetime(doc["date"], errors="coerce")
     doc = enrich_document_fields(doc, es=es, source_mode=source_mode, fill_growth_from_history=True)
     return doc
 
@@ -568,21 +693,23 @@ def load_data_from_es(es=None, limit: int = 2000, index: str = INDEX, source_mod
     if q_src:
         base_query = {"bool": {"must": [q_src]}}
 
-    query = {
-        "size": limit,
-        "sort": [{"date": {"order": "desc"}}, {"ingested_at": {"order": "desc"}}],
-        "query": base_query,
-    }
-    resp = es.search(index=index, body=query)
-    hits = [h["_source"] for h in resp.get("hits", {}).get("hits", [])]
-    df = pd.DataFrame(hits)
+    # Standardfall: aktuelles Universum aus LATEST_INDEX (alle Symbole, ohne die Historie zu sortieren);
+    # liefert er für den Modus nichts (z.B. Quelle dort noch nicht vorhanden), dann die Historie.
+    # neueste pro Symbol (Quelle je nach Modus) wählt ES – es kommt genau ein Dokument je Symbol an
+    frames = []
+    for target in _read_indices(es, index):
+        for page in iter_top_per_group(es, target, "symbol", base_query, _mode_sort(source_mode)):
+            frames.append(pd.DataFrame(page))
+            if sum(map(len, frames)) >= limit:  # limit: max. Anzahl Symbole
+                break
+        if frames:
+            break
+    df = pd.concat(frames, ignore_index=True).head(limit) if frames else pd.DataFrame()
     if df.empty:
         return df
 
-    # neueste pro Symbol
-    if "symbol" in df.columns and "date" in df.columns:
+    if "date" in df.columns:
         df["date"] = pd.to_datetime(df["date"], errors="coerce")
-        df = df.sort_values(["symbol", "date"], ascending=[True, False]).drop_duplicates("symbol", keep="first")
 
     # Harmonisierung/abgeleitete Felder (einfach)
     if "marketCap" in df.columns:
@@ -607,10 +734,6 @@ def load_data_from_es(es=None, limit: int = 2000, index: str = INDEX, source_mod
         with pd.option_context("mode.use_inf_as_na", True):
             df["debtToAssets"] = df["totalDebt"] / df["totalAssets"]
 
-
-    # Quelle/Dedupe
-    df = _filter_dedupe_by_mode(df, source_mode)
-
     # Dokument-weise Enrichment (ohne teure YoY-Abfragen)
     if not df.empty:
         df = pd.DataFrame([
@@ -623,8 +746,8 @@ def load_data_from_es(es=None, limit: int = 2000, index: str = INDEX, source_mod
 
 def load_industries(es=None, index: str = INDEX, source_mode: Optional[str] = None) -> pd.DataFrame:
     """
-    Lädt Symbol & Industry ohne 'collapse', damit es auch funktioniert,
-    wenn 'symbol.keyword' nicht existiert. Dedupe machen wir in Python.
+    Lädt Symbol & Industry, ein Eintrag je Symbol (jüngstes Dokument, Quelle je nach Modus).
+    Gruppiert wird in ES über symbol bzw. symbol.keyword (iter_top_per_group).
     """
     if es is None:
         es = get_es_connection()
@@ -634,25 +757,18 @@ def load_industries(es=None, index: str = INDEX, source_mode: Optional[str] = No
     if q_src:
         must.append(q_src)
 
-    query = {
-        "size": 10000,
-        "_source": ["symbol", "industry"],
-        "query": {"bool": {"must": must}} if must else {"match_all": {}},
-        "sort": [{"date": {"order": "desc"}}]
-    }
-
-    resp = es.search(index=index, body=query)
-    hits = [h["_source"] for h in resp.get("hits", {}).get("hits", [])]
-    df = pd.DataFrame(hits) if hits else pd.DataFrame(columns=["symbol", "industry"])
-
-    # Dedupe in Python: pro Symbol der jüngste Eintrag
-    if not df.empty and "symbol" in df.columns:
-        df = (
-            df.dropna(subset=["symbol"])
-              .drop_duplicates(subset=["symbol"], keep="first")
+    rows = []
+    for target in _read_indices(es, index):  # LATEST_INDEX, bei leerem Ergebnis die Historie
+        pages = iter_top_per_group(
+            es, target, "symbol",
+            query={"bool": {"must": must}} if must else {"match_all": {}},
+            sort=_mode_sort(source_mode),
+            _source=["symbol", "industry"],
         )
-
-    return df[["symbol", "industry"]] if not df.empty else df
+        rows = [h for page in pages for h in page]
+        if rows:
+            break
+    return pd.DataFrame(rows, columns=["symbol", "industry"])
 
 
 # ==========================================================